@@ -0,0 +1,164 @@
+# Copyright (C) 2022 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Compare per-cell and batched tabulate_tensor kernels.
+
+The per-cell kernel is called in a C loop over cells with the data stored
+cell by cell, the batched kernel is called once with the same data stored
+with the cell index innermost. Run as
+
+    python bench/bench_batched_kernels.py --num-cells 4096 --batch-size 8
+
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+import tempfile
+import time
+
+import cffi
+import numpy as np
+
+import ffcx.codegeneration.jit
+import ffcx.element_interface
+
+demo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "demo")
+
+# Forms to benchmark, as (demo file, form name)
+cases = [("PoissonQuad", "a"), ("HyperElasticity", "a_J")]
+
+driver_decl = """
+typedef void (kernel_t)(double*, const double*, const double*, const double*, const int*, const uint8_t*);
+typedef void (batch_kernel_t)(int, double*, const double*, const double*, const double*, const int*,
+                              const uint8_t*);
+void run_cells(kernel_t* kernel, int num_cells, int a_size, int w_size, int c_size, int x_size,
+               double* A, const double* w, const double* c, const double* x);
+void run_batch(batch_kernel_t* kernel, int num_cells, double* A, const double* w, const double* c,
+               const double* x);
+"""
+
+driver_source = """
+#include <stdint.h>
+typedef void (kernel_t)(double*, const double*, const double*, const double*, const int*, const uint8_t*);
+typedef void (batch_kernel_t)(int, double*, const double*, const double*, const double*, const int*,
+                              const uint8_t*);
+void run_cells(kernel_t* kernel, int num_cells, int a_size, int w_size, int c_size, int x_size,
+               double* A, const double* w, const double* c, const double* x)
+{
+  for (int i = 0; i < num_cells; ++i)
+    kernel(A + i * a_size, w + i * w_size, c + i * c_size, x + i * x_size, 0, 0);
+}
+void run_batch(batch_kernel_t* kernel, int num_cells, double* A, const double* w, const double* c,
+               const double* x)
+{
+  kernel(num_cells, A, w, c, x, 0, 0);
+}
+"""
+
+
+def load_demo(name):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(demo_dir, f"{name}.py"))
+    demo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(demo)
+    return demo
+
+
+def build_driver(build_dir, compile_args):
+    ffibuilder = cffi.FFI()
+    ffibuilder.set_source("_ffcx_bench_driver", driver_source, extra_compile_args=compile_args)
+    ffibuilder.cdef(driver_decl)
+    ffibuilder.compile(tmpdir=build_dir)
+    sys.path.insert(0, build_dir)
+    import _ffcx_bench_driver
+    return _ffcx_bench_driver
+
+
+def best_time(f, repeats):
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--num-cells", type=int, default=4096)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--cflags", default="-O2 -march=native")
+    args = parser.parse_args(args)
+
+    compile_args = args.cflags.split()
+    build_dir = tempfile.mkdtemp(prefix="ffcx-bench-")
+    driver = build_driver(build_dir, compile_args)
+    rng = np.random.default_rng(0)
+    N = args.num_cells
+
+    print(f"{'form':<22}{'A size':>8}{'per-cell [us]':>15}{'batched [us]':>15}{'speedup':>10}")
+    for demo_name, form_name in cases:
+        form = getattr(load_demo(demo_name), form_name)
+        compiled_forms, module, _ = ffcx.codegeneration.jit.compile_forms(
+            [form], parameters={"batch_size": args.batch_size}, cache_dir=build_dir,
+            cffi_extra_compile_args=compile_args)
+        integral = compiled_forms[0].integrals(module.lib.cell)[0]
+
+        a_size = int(np.prod([dim(v) for v in form.arguments()]))
+        w_size = sum(dim(f) for f in form.coefficients())
+        c_size = sum(int(np.prod(k.ufl_shape)) for k in form.constants())
+
+        # Random affine images of the reference cell, stored cell by
+        # cell. Coefficients are small to keep nonlinear forms well
+        # conditioned.
+        w = 0.1 * rng.random((N, w_size))
+        c = 1.0 + rng.random((N, c_size))
+        x = random_cells(form, N, rng)
+        x_size = x.shape[1]
+        A = np.zeros((N, a_size))
+
+        # Same data with the cell index innermost
+        w_b, c_b, x_b = (np.ascontiguousarray(d.T) for d in (w, c, x))
+        A_b = np.zeros((a_size, N))
+
+        ffi = driver.ffi
+        cast = module.ffi.cast
+        kernel = ffi.cast("kernel_t*", int(cast("uintptr_t", integral.tabulate_tensor_float64)))
+        batch_kernel = ffi.cast("batch_kernel_t*", int(cast("uintptr_t", integral.tabulate_tensor_batch_float64)))
+
+        def ptr(a):
+            return ffi.cast("double*", a.ctypes.data)
+
+        t_cells = best_time(lambda: driver.lib.run_cells(kernel, N, a_size, w_size, c_size, x_size,
+                                                         ptr(A), ptr(w), ptr(c), ptr(x)), args.repeats)
+        t_batch = best_time(lambda: driver.lib.run_batch(batch_kernel, N, ptr(A_b), ptr(w_b), ptr(c_b), ptr(x_b)),
+                            args.repeats)
+        assert np.linalg.norm(A_b.T - A) <= 1e-10 * np.linalg.norm(A)
+
+        # Time per cell in microseconds
+        t_cells, t_batch = 1e6 * t_cells / N, 1e6 * t_batch / N
+        print(f"{demo_name + '.' + form_name:<22}{a_size:>8}{t_cells:>15.3f}{t_batch:>15.3f}{t_cells / t_batch:>10.2f}")
+
+
+def dim(f):
+    """Return the number of dofs of the function f on a cell."""
+    return ffcx.element_interface.create_element(f.ufl_element()).dim
+
+
+def random_cells(form, num_cells, rng):
+    """Return coordinate dofs of num_cells random affine images of the reference cell."""
+    coordinate_element = ffcx.element_interface.create_element(form.ufl_domain().ufl_coordinate_element())
+    points = coordinate_element.sub_element.element.points
+    tdim = points.shape[1]
+    maps = np.eye(tdim) + 0.2 * rng.random((num_cells, tdim, tdim))
+    x = np.zeros((num_cells, points.shape[0], 3))
+    x[:, :, :tdim] = points @ maps + rng.random((num_cells, 1, tdim))
+    return x.reshape(num_cells, -1)
+
+
+if __name__ == "__main__":
+    main()
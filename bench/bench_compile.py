@@ -0,0 +1,234 @@
+# Copyright (C) 2022 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Benchmark compilation of the demos and of synthetic forms of increasing size.
+
+For every demo, and synthetic forms scaling the polynomial degree, the
+number of coefficients, the width of a mixed element and the depth of a
+nonlinearity, measures the time of compiler stages 1-4 (best of
+--repeats), the time of compiling the generated C source (once), the
+size of the source and the flops of the integrals (count_flops). Every
+repeat starts from empty element table and signature caches, after an
+untimed warm-up compilation of the case. Results
+are saved as a baseline, and compared with a baseline, reporting the
+times which changed by more than --threshold and any change of code
+size or flops. Run as
+
+    python bench/bench_compile.py --save baseline.json
+    python bench/bench_compile.py --compare baseline.json
+
+with --cases "synthetic/*" (or any other patterns of case names) to run
+some of the cases, and --quick for smaller synthetic forms. Timings are
+only comparable on the same machine. The exit status is 1 if there are
+regressions.
+"""
+
+import argparse
+import fnmatch
+import json
+import pathlib
+import shlex
+import sys
+import tempfile
+import time
+
+import ffcx
+import ffcx.codegeneration
+import ffcx.codegeneration.jit
+import ffcx.compiler
+import ffcx.ir.elementtables
+import ffcx.naming
+import ffcx.parameters
+import ufl
+from ffcx.codegeneration.flop_count import count_flops
+
+demo_dir = pathlib.Path(__file__).resolve().parent.parent.joinpath("demo")
+
+stages = ("analysis", "ir", "codegeneration", "formatting")
+timed = stages + ("total", "c_compile")
+counted = ("code_bytes", "flops")
+
+
+def best_time(f, repeats):
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = f()
+        times.append(time.perf_counter() - t0)
+    return min(times), result
+
+
+def demo_cases():
+    """Yield (name, UFL objects, object names) of the demos."""
+    for filename in sorted(demo_dir.glob("*.py")):
+        if filename.name != "test_demos.py":
+            ufd = ufl.algorithms.load_ufl_file(str(filename))
+            yield f"demo/{filename.stem}", ufd.forms + ufd.expressions + ufd.elements, ufd.object_names
+
+
+def synthetic_cases(quick):
+    """Yield (name, UFL objects, object names) of synthetic forms scaling in one dimension each."""
+    cell = ufl.tetrahedron
+
+    for degree in (1, 2, 3) if quick else (1, 2, 3, 4, 5):
+        element = ufl.FiniteElement("Lagrange", cell, degree)
+        u, v, kappa = ufl.TrialFunction(element), ufl.TestFunction(element), ufl.Coefficient(element)
+        yield f"synthetic/degree-{degree}", [kappa * ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx], {}
+
+    element = ufl.FiniteElement("Lagrange", cell, 2)
+    for n in (1, 4) if quick else (1, 4, 16, 32):
+        u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+        coefficients = [ufl.Coefficient(element) for _ in range(n)]
+        a = sum(w * ufl.inner(ufl.grad(u), ufl.grad(v)) + w**2 * u * v for w in coefficients) * ufl.dx
+        yield f"synthetic/coefficients-{n}", [a], {}
+
+    for width in (2, 4) if quick else (2, 4, 8, 12):
+        mixed = ufl.MixedElement([element] * width)
+        u, v = ufl.TrialFunctions(mixed), ufl.TestFunctions(mixed)
+        a = sum(ufl.inner(ufl.grad(u[i]), ufl.grad(v[i])) + u[i] * v[(i + 1) % width] for i in range(width)) * ufl.dx
+        yield f"synthetic/mixed-{width}", [a], {}
+
+    # Fixed quadrature degree, as the estimated degree grows with the depth
+    for depth in (1, 4) if quick else (1, 4, 16, 64):
+        u, v, w = ufl.TrialFunction(element), ufl.TestFunction(element), ufl.Coefficient(element)
+        q = w
+        for _ in range(depth):
+            q = ufl.exp(-q**2) + ufl.sin(q)
+        F = (1 + q**2) * ufl.inner(ufl.grad(w), ufl.grad(v)) * ufl.dx(metadata={"quadrature_degree": 4})
+        yield f"synthetic/nonlinear-{depth}", [F, ufl.derivative(F, w, u)], {}
+
+
+def c_compile_time(code_c, name, compile_args):
+    """Return the time of compiling C source to an object file with the compiler used by the JIT."""
+    compiler = ffcx.codegeneration.jit._new_compiler()
+    compiler.force = True
+    with tempfile.TemporaryDirectory() as tmpdir:
+        c_filename = pathlib.Path(tmpdir).joinpath(name.replace("/", "_") + ".c")
+        c_filename.write_text(code_c)
+        t, _ = best_time(lambda: compiler.compile([str(c_filename)], output_dir=tmpdir,
+                                                  include_dirs=[ffcx.codegeneration.get_include_path()],
+                                                  extra_postargs=compile_args), 1)
+    return t
+
+
+def clear_caches():
+    """Clear the in-process caches of the compiler, which later compilations would hit."""
+    ffcx.ir.elementtables.table_cache_clear()
+    ffcx.naming._expression_signatures.clear()
+    ffcx.naming._signature_hash.cache_clear()
+
+
+def measure(name, ufl_objects, object_names, args):
+    """Return the results of compiling UFL objects."""
+    # Without code cache, which would skip stages 1-3
+    parameters = ffcx.parameters.get_parameters({"code_cache_dir": ""})
+
+    prefix = name.split("/")[-1].replace("-", "_")
+
+    def compile():
+        clear_caches()
+        metrics = {}
+        _, code_c = ffcx.compiler.compile_ufl_objects(ufl_objects, object_names, prefix=prefix,
+                                                      parameters=parameters, metrics=metrics)
+        return {stage: metrics["stages"][stage]["time"] for stage in stages}, metrics, code_c
+
+    # Untimed warm-up (imports, Basix elements), then the stage times of the fastest run
+    compile()
+    result, metrics, code_c = min((compile() for _ in range(args.repeats)), key=lambda run: sum(run[0].values()))
+    result["total"] = sum(result.values())
+
+    if not args.no_c_compile:
+        result["c_compile"] = c_compile_time(code_c, name, args.compile_args)
+    result["code_bytes"] = metrics["code_bytes"]["c"]
+    try:
+        result["flops"] = sum(sum(count_flops(form, parameters)) for form in ufl_objects
+                              if isinstance(form, ufl.Form))
+    except NotImplementedError:
+        # Not counted for all integrands (conditionals)
+        result["flops"] = None
+    result["kernels"] = len(metrics["kernels"])
+    return result
+
+
+def compare(results, baseline, threshold, min_time):
+    """Print the changes of results against the baseline, and return the number of regressions."""
+    rows = []
+    for name in sorted(set(results) & set(baseline)):
+        new, old = results[name], baseline[name]
+        for key in timed:
+            if key in new and key in old and abs(new[key] - old[key]) > min_time:
+                ratio = new[key] / max(old[key], 1e-12)
+                if ratio > 1 + threshold:
+                    rows.append(("regression", name, key, old[key], new[key]))
+                elif ratio < 1 / (1 + threshold):
+                    rows.append(("improvement", name, key, old[key], new[key]))
+        for key in counted:
+            if new[key] is not None and old[key] is not None and new[key] != old[key]:
+                rows.append(("regression" if new[key] > old[key] else "improvement", name, key, old[key], new[key]))
+
+    print(f"{'change':<13}{'case':<36}{'metric':<16}{'baseline':>14}{'current':>14}{'ratio':>8}")
+    for change, name, key, old, new in rows:
+        print(f"{change:<13}{name:<36}{key:<16}{old:>14.4g}{new:>14.4g}{new / max(old, 1e-12):>8.2f}")
+    for name in sorted(set(baseline) - set(results)):
+        print(f"{'missing':<13}{name}")
+    for name in sorted(set(results) - set(baseline)):
+        print(f"{'new':<13}{name}")
+
+    regressions = sum(1 for row in rows if row[0] == "regression")
+    print(f"{regressions} regressions, {len(rows) - regressions} improvements "
+          f"in {len(set(results) & set(baseline))} cases compared (threshold {threshold:.0%})")
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--cases", nargs="+", default=["*"], help="patterns of names of cases to run")
+    parser.add_argument("--quick", action="store_true", help="smaller synthetic forms")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--compile-args", type=shlex.split, default=["-O2"],
+                        help="C compiler arguments, as one string (default: -O2)")
+    parser.add_argument("--no-c-compile", action="store_true", help="do not compile the generated C source")
+    parser.add_argument("--save", help="save the results as baseline to this file")
+    parser.add_argument("--compare", help="compare the results with the baseline in this file")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative change of times reported by the comparison (default: 0.1)")
+    parser.add_argument("--min-time", type=float, default=0.01,
+                        help="absolute change of times in seconds below which they are not compared (default: 0.01)")
+    args = parser.parse_args(args)
+
+    def selected(cases):
+        return ((name, *case) for name, *case in cases
+                if any(fnmatch.fnmatch(name, pattern) for pattern in args.cases))
+
+    print(f"{'case':<36}{'stages 1-4 [s]':>16}{'C compile [s]':>15}{'.c [kB]':>10}{'flops':>12}{'kernels':>9}")
+    results = {}
+    for name, ufl_objects, object_names in selected(list(demo_cases()) + list(synthetic_cases(args.quick))):
+        try:
+            result = measure(name, ufl_objects, object_names, args)
+        except Exception as e:
+            print(f"{name:<36}skipped ({type(e).__name__}: {e})")
+            continue
+        results[name] = result
+        c_compile = f"{result['c_compile']:>15.2f}" if "c_compile" in result else f"{'-':>15}"
+        flops = f"{'-' if result['flops'] is None else result['flops']:>12}"
+        print(f"{name:<36}{result['total']:>16.3f}{c_compile}{result['code_bytes'] / 1e3:>10.1f}"
+              f"{flops}{result['kernels']:>9}")
+
+    if args.save is not None:
+        with open(args.save, "w") as f:
+            json.dump({"ffcx_version": ffcx.__version__, "compile_args": args.compile_args, "results": results},
+                      f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        print(f"Comparison with {args.compare} (FFCx {baseline['ffcx_version']})")
+        return 1 if compare(results, baseline["results"], args.threshold, args.min_time) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
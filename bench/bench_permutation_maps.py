@@ -0,0 +1,150 @@
+# Copyright (C) 2022 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Compare permuted tables and runtime permutation maps for interior facet integrals.
+
+DG interior penalty forms are compiled with stacked permuted tables (the
+default) and with the quadrature_permutation_maps parameter. Reports the
+size of the compiled module and the time per facet of the interior facet
+kernel called in a C loop over facets with random facets and
+permutations. Run as
+
+    python bench/bench_permutation_maps.py --num-facets 4096 --degrees 1 2 3
+
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import cffi
+import numpy as np
+
+import ffcx.codegeneration.jit
+import ffcx.element_interface
+import ufl
+
+driver_decl = """
+typedef void (kernel_t)(double*, const double*, const double*, const double*, const int*, const uint8_t*);
+void run_facets(kernel_t* kernel, int num_facets, int a_size, int x_size, double* A, const double* w,
+                const double* c, const double* x, const int* facets, const uint8_t* perms);
+"""
+
+driver_source = """
+#include <stdint.h>
+typedef void (kernel_t)(double*, const double*, const double*, const double*, const int*, const uint8_t*);
+void run_facets(kernel_t* kernel, int num_facets, int a_size, int x_size, double* A, const double* w,
+                const double* c, const double* x, const int* facets, const uint8_t* perms)
+{
+  for (int i = 0; i < num_facets; ++i)
+    kernel(A + i * a_size, w, c, x + i * x_size, facets + 2 * i, perms + 2 * i);
+}
+"""
+
+# Cells to benchmark, as (cell, number of facets, number of facet permutations)
+cases = [(ufl.tetrahedron, 4, 6), (ufl.hexahedron, 6, 8)]
+
+
+def build_driver(build_dir, compile_args):
+    ffibuilder = cffi.FFI()
+    ffibuilder.set_source("_ffcx_bench_perm_driver", driver_source, extra_compile_args=compile_args)
+    ffibuilder.cdef(driver_decl)
+    ffibuilder.compile(tmpdir=build_dir)
+    sys.path.insert(0, build_dir)
+    import _ffcx_bench_perm_driver
+    return _ffcx_bench_perm_driver
+
+
+def best_time(f, repeats):
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def interior_penalty_form(cell, degree):
+    """Return the interior facet terms of a symmetric interior penalty DG Laplacian."""
+    element = ufl.FiniteElement("DG", cell, degree)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    n = ufl.FacetNormal(cell)
+    h = ufl.avg(ufl.CellDiameter(cell))
+    return (- ufl.inner(ufl.avg(ufl.grad(u)), ufl.jump(v, n)) - ufl.inner(ufl.jump(u, n), ufl.avg(ufl.grad(v)))
+            + 10.0 / h * ufl.inner(ufl.jump(u), ufl.jump(v))) * ufl.dS
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--num-facets", type=int, default=4096)
+    parser.add_argument("--degrees", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--cflags", default="-O2 -march=native")
+    args = parser.parse_args(args)
+
+    compile_args = args.cflags.split()
+    build_dir = tempfile.mkdtemp(prefix="ffcx-bench-")
+    driver = build_driver(build_dir, compile_args)
+    rng = np.random.default_rng(0)
+    N = args.num_facets
+
+    print(f"{'form':<16}{'tables [kB]':>12}{'maps [kB]':>12}{'tables [us]':>13}{'maps [us]':>12}{'speedup':>10}")
+    for cell, num_facets, num_perms in cases:
+        for degree in args.degrees:
+            form = interior_penalty_form(cell, degree)
+            a_size = (2 * ffcx.element_interface.create_element(form.arguments()[0].ufl_element()).dim) ** 2
+
+            # Pairs of random cells with random facets and permutations
+            x = np.concatenate([random_cells(form, N, rng), random_cells(form, N, rng)], axis=1)
+            facets = rng.integers(0, num_facets, (N, 2)).astype(np.intc)
+            perms = rng.integers(0, num_perms, (N, 2)).astype(np.uint8)
+            w = np.zeros(1)
+            c = np.zeros(1)
+
+            sizes, times, results = [], [], []
+            for permutation_maps in (False, True):
+                cache_dir = os.path.join(build_dir, f"maps{int(permutation_maps)}")
+                compiled_forms, module, _ = ffcx.codegeneration.jit.compile_forms(
+                    [form], parameters={"quadrature_permutation_maps": permutation_maps}, cache_dir=cache_dir,
+                    cffi_extra_compile_args=compile_args)
+                integral = compiled_forms[0].integrals(module.lib.interior_facet)[0]
+                sizes.append(os.path.getsize(module.__file__) / 1024)
+
+                ffi = driver.ffi
+                kernel = ffi.cast("kernel_t*", int(module.ffi.cast("uintptr_t", integral.tabulate_tensor_float64)))
+                A = np.zeros((N, a_size))
+
+                def run():
+                    A[:] = 0.0
+                    driver.lib.run_facets(kernel, N, a_size, x.shape[1], ffi.cast("double*", A.ctypes.data),
+                                          ffi.cast("double*", w.ctypes.data), ffi.cast("double*", c.ctypes.data),
+                                          ffi.cast("double*", x.ctypes.data), ffi.cast("int*", facets.ctypes.data),
+                                          ffi.cast("uint8_t*", perms.ctypes.data))
+
+                # Time per facet in microseconds
+                times.append(1e6 * best_time(run, args.repeats) / N)
+                results.append(A.copy())
+
+            assert np.linalg.norm(results[1] - results[0]) <= 1e-10 * np.linalg.norm(results[0])
+            name = f"{cell.cellname()} P{degree}"
+            print(f"{name:<16}{sizes[0]:>12.1f}{sizes[1]:>12.1f}{times[0]:>13.3f}{times[1]:>12.3f}"
+                  f"{times[0] / times[1]:>10.2f}")
+
+
+def random_cells(form, num_cells, rng):
+    """Return coordinate dofs of num_cells random affine images of the reference cell."""
+    coordinate_element = ffcx.element_interface.create_element(form.ufl_domain().ufl_coordinate_element())
+    points = coordinate_element.sub_element.element.points
+    tdim = points.shape[1]
+    maps = np.eye(tdim) + 0.2 * rng.random((num_cells, tdim, tdim))
+    x = np.zeros((num_cells, points.shape[0], 3))
+    x[:, :, :tdim] = points @ maps + rng.random((num_cells, 1, tdim))
+    return x.reshape(num_cells, -1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# Copyright (C) 2022 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Compare naming of generated objects with and without cached signatures.
+
+The IR of synthetic forms with many integrals over subdomains, each of
+which is named from the signature of the form, and the names of
+expressions. Run as
+
+    python bench/bench_signatures.py --sizes 10 40 160
+
+"""
+
+import argparse
+import hashlib
+import time
+
+import numpy as np
+
+import ffcx
+import ffcx.analysis
+import ffcx.codegeneration
+import ffcx.ir.representation
+import ffcx.naming
+import ffcx.parameters
+import ufl
+
+
+def uncached_compute_signature(ufl_objects, tag):
+    """Compute the signature hash of UFL objects, as done before signatures were cached."""
+    object_signature = ""
+    for ufl_object in ufl_objects:
+        if isinstance(ufl_object, ufl.Form):
+            kind = "form"
+            object_signature += ufl_object.signature()
+        elif isinstance(ufl_object, ufl.FiniteElementBase):
+            object_signature += repr(ufl_object)
+            kind = "element"
+        else:
+            # Bypass the cache of expression signatures
+            expr, points = ufl_object
+            ffcx.naming._expression_signatures.pop(expr, None)
+            object_signature += ffcx.naming._expression_signature(expr)
+            ffcx.naming._expression_signatures.pop(expr, None)
+            object_signature += repr(points)
+            kind = "expression"
+
+    signatures = [object_signature, str(ffcx.__version__), ffcx.codegeneration.get_signature(), kind, tag]
+    return hashlib.sha1(";".join(signatures).encode('utf-8')).hexdigest()
+
+
+def best_time(f, repeats):
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = f()
+        times.append(time.perf_counter() - t0)
+    return min(times), result
+
+
+def synthetic_form(n):
+    """Return a form with a long signature, integrated over n cell and n facet subdomains."""
+    cell = ufl.tetrahedron
+    element = ufl.FiniteElement("Lagrange", cell, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    coefficients = [ufl.Coefficient(element) for _ in range(8)]
+    integrand = sum(ufl.exp(w) * ufl.inner(ufl.grad(u), ufl.grad(v)) + w**2 * u * v for w in coefficients)
+    return sum(integrand * ufl.dx(i) + integrand * ufl.ds(i) for i in range(n))
+
+
+def synthetic_expressions(n):
+    """Return n expressions sharing one UFL expression, evaluated at different points."""
+    element = ufl.VectorElement("Lagrange", ufl.tetrahedron, 2)
+    w = ufl.Coefficient(element)
+    expr = ufl.sym(ufl.grad(w)) + ufl.tr(ufl.grad(w)) * ufl.Identity(3)
+    return [(expr, np.full((1, 3), 0.1 + i / n)) for i in range(n)]
+
+
+def analyze(form):
+    parameters = ffcx.parameters.get_parameters()
+    return ffcx.analysis.analyze_ufl_objects([form], parameters), parameters
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 40, 160])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args(args)
+
+    cached_compute_signature = ffcx.naming.compute_signature
+
+    print(f"{'subdomains':>12}{'integrals':>11}{'uncached IR [s]':>18}{'cached IR [s]':>16}"
+          f"{'uncached names [ms]':>22}{'cached names [ms]':>20}")
+    for n in args.sizes:
+        form = synthetic_form(n)
+        analysis, parameters = analyze(form)
+        integrals = [(fd.original_form, itg.integral_type, i, itg.subdomain_id)
+                     for i, fd in enumerate(analysis.form_data) for itg in fd.integral_data]
+
+        def names():
+            return [ffcx.naming.integral_name(*itg, "bench") for itg in integrals]
+
+        times = []
+        for compute_signature in (uncached_compute_signature, cached_compute_signature):
+            ffcx.naming.compute_signature = compute_signature
+            try:
+                t_ir, _ = best_time(lambda: ffcx.ir.representation.compute_ir(analysis, {}, "bench", parameters,
+                                                                              False), args.repeats)
+                t_names, result = best_time(names, args.repeats)
+            finally:
+                ffcx.naming.compute_signature = cached_compute_signature
+            times += [t_ir, t_names, result]
+        assert times[2] == times[5]
+        print(f"{n:>12}{len(integrals):>11}{times[0]:>18.3f}{times[3]:>16.3f}"
+              f"{1e3 * times[1]:>22.2f}{1e3 * times[4]:>20.2f}")
+
+    print()
+    print(f"{'expressions':>12}{'uncached names [ms]':>22}{'cached names [ms]':>20}")
+    for n in args.sizes:
+        expressions = synthetic_expressions(n)
+        times = []
+        for compute_signature in (uncached_compute_signature, cached_compute_signature):
+            ffcx.naming.compute_signature = compute_signature
+            try:
+                t, result = best_time(lambda: [ffcx.naming.expression_name(e, "bench") for e in expressions],
+                                      args.repeats)
+            finally:
+                ffcx.naming.compute_signature = cached_compute_signature
+            times += [t, result]
+        assert times[1] == times[3]
+        print(f"{n:>12}{1e3 * times[0]:>22.2f}{1e3 * times[2]:>20.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# Copyright (C) 2022 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Compare table deduplication by linear search and by the hashed table index.
+
+Synthetic streams of tables, with every table added once and looked up
+again as a copy perturbed within the table tolerances, and the IR of
+synthetic forms with coefficients in many different elements. Run as
+
+    python bench/bench_table_dedup.py --sizes 100 200 400 800
+
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import ffcx.analysis
+import ffcx.codegeneration
+import ffcx.ir.elementtables
+import ffcx.ir.representation
+import ffcx.parameters
+import ufl
+from ffcx.ir.elementtables import UniqueTableIndex, equal_tables
+
+
+class LinearTableIndex(object):
+    """Deduplication by comparing against every table, as done before the hashed index."""
+
+    def __init__(self, tables=None, rtol=1e-6, atol=1e-9):
+        self.rtol = rtol
+        self.atol = atol
+        self.tables = dict(tables or {})
+
+    def __getitem__(self, name):
+        return self.tables[name]
+
+    def add(self, name, table):
+        self.tables[name] = table
+
+    def find(self, table):
+        for name, t in self.tables.items():
+            if equal_tables(table, t, rtol=self.rtol, atol=self.atol):
+                return name
+        return None
+
+
+def table_stream(n, rng):
+    """Return n random tables of a few shapes."""
+    shapes = [(1, 1, 4, 3), (1, 3, 6, 6), (1, 4, 14, 10), (2, 3, 6, 10)]
+    return [rng.random(shapes[i % len(shapes)]) for i in range(n)]
+
+
+def dedup(index, tables, rtol=1e-6):
+    """Add tables to the index, then look up slightly perturbed copies."""
+    for i, t in enumerate(tables):
+        if index.find(t) is None:
+            index.add(f"T{i}", t)
+    return [index.find(t * (1.0 + 0.1 * rtol)) for t in tables]
+
+
+def best_time(f, repeats):
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = f()
+        times.append(time.perf_counter() - t0)
+    return min(times), result
+
+
+def synthetic_form(n):
+    """Return a form with coefficients in n distinct elements, each giving several tables."""
+    cell = ufl.tetrahedron
+    families = [("Lagrange", 1), ("Discontinuous Lagrange", 0), ("N1curl", 1), ("RT", 1), ("N2curl", 1),
+                ("BDM", 1)]
+    elements = []
+    for i in range(n):
+        family, degree = families[i % len(families)]
+        elements.append(ufl.FiniteElement(family, cell, degree + i // len(families)))
+    v = ufl.TestFunction(ufl.FiniteElement("Lagrange", cell, 1))
+    f = sum(ufl.inner(ufl.grad(w), ufl.grad(w)) for w in map(ufl.Coefficient, elements))
+    return f * v * ufl.dx(metadata={"quadrature_degree": 2})
+
+
+def compute_ir(form):
+    parameters = ffcx.parameters.get_parameters()
+    analysis = ffcx.analysis.analyze_ufl_objects([form], parameters)
+    return ffcx.ir.representation.compute_ir(analysis, {}, "bench", parameters, False)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 200, 400, 800])
+    parser.add_argument("--form-sizes", type=int, nargs="+", default=[12, 24, 36])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args(args)
+
+    rng = np.random.default_rng(0)
+    print(f"{'tables':>8}{'linear [ms]':>14}{'hashed [ms]':>14}{'speedup':>10}")
+    for n in args.sizes:
+        tables = table_stream(n, rng)
+        t_linear, r_linear = best_time(lambda: dedup(LinearTableIndex(), tables), args.repeats)
+        t_hashed, r_hashed = best_time(lambda: dedup(UniqueTableIndex(), tables), args.repeats)
+        assert r_linear == r_hashed
+        print(f"{n:>8}{1e3 * t_linear:>14.2f}{1e3 * t_hashed:>14.2f}{t_linear / t_hashed:>10.2f}")
+
+    print()
+    print(f"{'elements':>12}{'tables':>8}{'linear IR [s]':>16}{'hashed IR [s]':>16}")
+    for n in args.form_sizes:
+        form = synthetic_form(n)
+        times = []
+        for index in (LinearTableIndex, UniqueTableIndex):
+            ffcx.ir.elementtables.UniqueTableIndex = index
+            try:
+                t, ir = best_time(lambda: compute_ir(form), 1)
+            finally:
+                ffcx.ir.elementtables.UniqueTableIndex = UniqueTableIndex
+            times.append(t)
+        num_tables = sum(len(integral.unique_tables) for integral in ir.integrals)
+        print(f"{n:>12}{num_tables:>8}{times[0]:>16.2f}{times[1]:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,12 +12,16 @@ FFCx compiles finite element variational forms into C code.
 
 import logging
 
-import pkg_resources
+try:
+    from importlib.metadata import version
+except ImportError:
+    # Python < 3.8
+    from importlib_metadata import version
 
 # Import default parameters
 from ffcx.parameters import get_parameters  # noqa: F401
 
-__version__ = pkg_resources.get_distribution("fenics-ffcx").version
+__version__ = version("fenics-ffcx")
 
 logging.basicConfig()
 logger = logging.getLogger("ffcx")
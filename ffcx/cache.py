@@ -0,0 +1,563 @@
+# Copyright (C) 2022 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""On-disk caches of generated code and of compiled modules.
+
+The code blocks generated by compiler stage 3 are stored in a directory,
+one JSON file per set of compiled UFL objects, under a key computed from
+the signatures of the UFL objects, their names, the prefix, the
+parameters, the signature of ufcx.h and the versions of FFCx, UFL and
+Basix. Compiling the same objects again then only formats the cached
+code.
+
+The cache is enabled by the parameter ``code_cache_dir``. When the total
+size of the cache exceeds ``code_cache_size`` MiB, the least recently
+used entries are removed.
+
+The modules compiled by the JIT are kept in its cache directory, which
+is bounded by the parameters ``jit_cache_size`` (MiB) and
+``jit_cache_entries`` in the same way. The directory has a manifest,
+listing the file of each compiled module, which is read once by each
+process and saves the JIT from searching the directory for modules.
+Run
+
+    python -m ffcx.cache {stats,prune,verify,clear} <cache_dir>
+    python -m ffcx.cache {export,import} <cache_dir> <archive>
+
+to inspect or clean up a JIT cache directory, or to copy its modules to
+another directory (for example on another machine) through an archive.
+"""
+
+import argparse
+import collections
+import fcntl
+import hashlib
+import importlib.machinery
+import io
+import json
+import logging
+import os
+import re
+import sys
+import tarfile
+import tempfile
+import time
+from pathlib import Path
+
+from ffcx.parameters import FFCX_DEFAULT_PARAMETERS
+
+logger = logging.getLogger("ffcx")
+
+# Parameters which configure caching or logging and do not change the
+# generated code
+cache_parameters = ("code_cache_dir", "code_cache_size", "jit_cache_size", "jit_cache_entries")
+nocode_parameters = cache_parameters + ("verbosity", )
+
+
+class CodeCache(object):
+    """Directory of generated code, with least recently used entries evicted beyond a size limit."""
+
+    suffix = ".code.json"
+
+    def __init__(self, path, max_size=None):
+        """Create cache in directory path, with maximum total size in bytes (None for no limit)."""
+        self.path = Path(path)
+        self.max_size = max_size
+
+    def filename(self, key):
+        return self.path.joinpath(key + self.suffix)
+
+    def get(self, key):
+        """Return the code blocks stored under key, or None."""
+        filename = self.filename(key)
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        # Mark entry as recently used
+        try:
+            os.utime(filename)
+        except FileNotFoundError:
+            pass
+        from ffcx.codegeneration.codegeneration import code_blocks
+        return code_blocks(**{field: [tuple(part) for part in data[field]] for field in code_blocks._fields})
+
+    def put(self, key, code):
+        """Store code blocks under key, then evict entries beyond the size limit."""
+        self.path.mkdir(exist_ok=True, parents=True)
+
+        # Write to a temporary file and move it in place, so that
+        # concurrent readers never see a partial entry
+        fd, tmpname = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(code._asdict(), f)
+        os.replace(tmpname, self.filename(key))
+
+        self.evict()
+
+    def entries(self):
+        """Return (filename, size, last use time) of all entries, least recently used first."""
+        entries = []
+        for filename in self.path.glob("*" + self.suffix):
+            try:
+                stat = filename.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((filename, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda e: e[2])
+
+    def evict(self):
+        """Remove least recently used entries until the cache is within the size limit."""
+        if self.max_size is None:
+            return
+        entries = self.entries()
+        size = sum(e[1] for e in entries)
+        for filename, nbytes, _ in entries:
+            if size <= self.max_size:
+                break
+            try:
+                filename.unlink()
+                logger.info(f"Evicted {filename} from code cache.")
+            except FileNotFoundError:
+                pass
+            size -= nbytes
+
+    def clear(self):
+        """Remove all entries."""
+        for filename, _, _ in self.entries():
+            try:
+                filename.unlink()
+            except FileNotFoundError:
+                pass
+
+
+# Entry of the JIT cache directory: a compiled module, or the object file
+# of a translation unit (see ffcx.codegeneration.jit)
+module_entry = collections.namedtuple("module_entry", ["name", "state", "files", "size", "last_use"])
+
+
+class ModuleCache(object):
+    """JIT cache directory, with least recently used modules evicted beyond size and count limits.
+
+    The files of a module share its name, <module>.*. The marker
+    <module>.c.cached is created when the module is compiled, and touched
+    by mark_used when the module is loaded, such that its modification
+    time is the time of last use, to within half the grace period. Loads
+    thus write to the directory at most once per interval, not on every
+    hit, which matters on shared filesystems. Modules are removed holding the compile lock
+    <module>.lock, and modules which are being compiled, or were used in
+    the last grace seconds, are never removed. Other files in the
+    directory are left alone.
+
+    The manifest is a file of JSON lines {"module": name, "file":
+    filename}, with filenames relative to the cache directory, to which
+    the JIT appends compiled modules. It is rewritten when entries are
+    evicted. Entries of the manifest may be missing from the directory,
+    and users of the manifest must then fall back to the directory.
+    """
+
+    manifest_name = "ffcx-manifest.jsonl"
+
+    # Default grace period in seconds
+    grace = 60
+
+    def __init__(self, path, max_size=None, max_entries=None, grace=grace):
+        """Create cache in directory path, with maximum total size in bytes and entries (None for no limit)."""
+        self.path = Path(path)
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.grace = grace
+
+    def entries(self):
+        """Return all entries, least recently used first.
+
+        The state of an entry is "ready", "failed" (compilation failed),
+        "incomplete" (compiling, or abandoned by the compiling process) or
+        "unit" (object file of a translation unit).
+        """
+        groups = collections.defaultdict(list)
+        try:
+            filenames = list(self.path.iterdir())
+        except FileNotFoundError:
+            return []
+        for filename in filenames:
+            name = filename.name.split(".")[0]
+            if not name.startswith(("libffcx_", "ffcx_unit_")):
+                continue
+            try:
+                stat = filename.stat()
+            except FileNotFoundError:
+                continue
+            groups[name].append((filename, stat))
+
+        entries = []
+        for name, files in groups.items():
+            stats = {f.name[len(name):]: stat for f, stat in files}
+            if ".c.cached" in stats:
+                state, last_use = "ready", stats[".c.cached"].st_mtime
+            else:
+                if ".c.failed" in stats:
+                    state = "failed"
+                elif re.fullmatch("ffcx_unit_[0-9a-f]{40}", name) and list(stats) == [".o"]:
+                    state = "unit"
+                else:
+                    state = "incomplete"
+                last_use = max(stat.st_mtime for stat in stats.values())
+            size = sum(stat.st_size for stat in stats.values())
+            entries.append(module_entry(name, state, [f for f, _ in files], size, last_use))
+        return sorted(entries, key=lambda e: e.last_use)
+
+    def remove(self, entry):
+        """Remove the files of entry, unless its module is being compiled or was used since entry was listed.
+
+        Returns True if the entry was removed.
+        """
+        if not entry.name.startswith("libffcx_"):
+            # Object files and temporary files of translation units are
+            # not locked, and only protected by the grace period
+            for filename in entry.files:
+                _unlink(filename)
+            return True
+
+        lock_name = self.path.joinpath(entry.name + ".lock")
+        lock = os.open(lock_name, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+
+            ready_name = self.path.joinpath(entry.name + ".c.cached")
+            try:
+                if ready_name.stat().st_mtime > entry.last_use:
+                    return False
+            except FileNotFoundError:
+                pass
+
+            # Remove the marker first, so that the module is not loaded
+            # while it is being removed. The lock file goes last, and
+            # processes which opened it before check that it is still in
+            # place once they hold the lock.
+            _unlink(ready_name)
+            for filename in entry.files:
+                if filename != lock_name:
+                    _unlink(filename)
+            _unlink(lock_name)
+        finally:
+            os.close(lock)
+        logger.info(f"Removed {entry.name} from JIT cache.")
+        return True
+
+    def evict(self):
+        """Remove least recently used entries until the cache is within the limits.
+
+        Returns the removed entries.
+        """
+        if self.max_size is None and self.max_entries is None:
+            return []
+        entries = self.entries()
+        size = sum(e.size for e in entries)
+        count = len(entries)
+        now = time.time()
+        removed = []
+        for entry in entries:
+            if (self.max_size is None or size <= self.max_size) and \
+               (self.max_entries is None or count <= self.max_entries):
+                break
+            if entry.last_use > now - self.grace:
+                break
+            if self.remove(entry):
+                size -= entry.size
+                count -= 1
+                removed.append(entry)
+        if removed:
+            self.write_manifest()
+        return removed
+
+    def verify(self):
+        """Return (entry, problem) for entries which are not usable modules or unit objects."""
+        problems = []
+        now = time.time()
+        for entry in self.entries():
+            if entry.state == "ready":
+                modules = [f for f in entry.files if f.name[len(entry.name):] in
+                           importlib.machinery.EXTENSION_SUFFIXES]
+                if not modules or any(f.stat().st_size == 0 for f in modules if f.exists()):
+                    problems.append((entry, "compiled module is missing or empty"))
+            elif entry.state == "failed":
+                problems.append((entry, "compilation failed"))
+            elif entry.state == "incomplete" and entry.last_use <= now - self.grace and not self.locked(entry):
+                problems.append((entry, "compilation was abandoned"))
+        return problems
+
+    def locked(self, entry):
+        """Return True if the module of entry is being compiled."""
+        lock_name = self.path.joinpath(entry.name + ".lock")
+        try:
+            lock = os.open(lock_name, os.O_RDWR)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(lock, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            return False
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(lock)
+
+    def clear(self):
+        """Remove all entries, except modules being compiled. Returns the removed entries."""
+        removed = [entry for entry in self.entries() if self.remove(entry)]
+        self.write_manifest()
+        return removed
+
+    def module_file(self, entry):
+        """Return the compiled module of a ready entry, or None."""
+        for filename in entry.files:
+            if filename.name[len(entry.name):] in importlib.machinery.EXTENSION_SUFFIXES:
+                return filename
+        return None
+
+    def read_manifest(self):
+        """Return the manifest as a dict of module name -> path of the compiled module."""
+        manifest = {}
+        try:
+            with open(self.path.joinpath(self.manifest_name)) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return manifest
+        for line in lines:
+            try:
+                record = json.loads(line)
+                manifest[record["module"]] = self.path.joinpath(record["file"])
+            except (ValueError, KeyError, TypeError):
+                # Partially written line
+                continue
+        return manifest
+
+    def add_to_manifest(self, modules):
+        """Append (module name, path of compiled module) pairs to the manifest."""
+        lines = "".join(json.dumps({"module": name, "file": Path(filename).name}) + "\n" for name, filename in modules)
+        self.path.mkdir(exist_ok=True, parents=True)
+        fd = os.open(self.path.joinpath(self.manifest_name), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            os.write(fd, lines.encode("utf-8"))
+        finally:
+            os.close(fd)
+
+    def write_manifest(self):
+        """Rewrite the manifest from the ready entries of the directory."""
+        manifest_name = self.path.joinpath(self.manifest_name)
+        try:
+            fd = os.open(manifest_name, os.O_RDONLY)
+        except FileNotFoundError:
+            return
+        try:
+            # Appends which wait for the lock meanwhile go to the
+            # replaced file and are lost, which only costs a search of
+            # the directory for these modules
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            modules = [(e.name, self.module_file(e)) for e in self.entries() if e.state == "ready"]
+            tmp_fd, tmpname = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+            with os.fdopen(tmp_fd, "w") as f:
+                for name, filename in modules:
+                    if filename is not None:
+                        f.write(json.dumps({"module": name, "file": filename.name}) + "\n")
+            os.replace(tmpname, manifest_name)
+        finally:
+            os.close(fd)
+
+    def export_archive(self, archive):
+        """Write the ready modules to a compressed tar archive, with a manifest. Returns the exported entries."""
+        entries = [e for e in self.entries() if e.state == "ready" and self.module_file(e) is not None]
+        with tarfile.open(archive, "w:gz") as tar:
+            manifest = "".join(json.dumps({"module": e.name, "file": self.module_file(e).name}) + "\n"
+                               for e in entries).encode("utf-8")
+            info = tarfile.TarInfo(self.manifest_name)
+            info.size = len(manifest)
+            info.mtime = time.time()
+            tar.addfile(info, io.BytesIO(manifest))
+            for entry in entries:
+                # The marker goes last, so that modules are complete once
+                # it is extracted
+                for filename in (self.module_file(entry), self.path.joinpath(entry.name + ".c.cached")):
+                    tar.add(filename, arcname=filename.name)
+        return entries
+
+    def import_archive(self, archive):
+        """Add the modules of an archive written by export_archive, except those present. Returns their names."""
+        self.path.mkdir(exist_ok=True, parents=True)
+        present = {e.name for e in self.entries() if e.state == "ready"}
+        imported = []
+        with tarfile.open(archive, "r:*") as tar:
+            f = tar.extractfile(self.manifest_name)
+            if f is None:
+                raise ValueError(f"{archive} is not an archive of a JIT cache directory.")
+            modules = [json.loads(line) for line in f.read().decode("utf-8").splitlines()]
+            for record in modules:
+                name, module_file = record["module"], record["file"]
+                if name in present:
+                    continue
+                if module_file[len(name):] not in importlib.machinery.EXTENSION_SUFFIXES:
+                    logger.warning(f"Skipping {name}, which was compiled for another platform.")
+                    continue
+                # Extract to temporary files moved in place, such that
+                # processes using the directory never see partial files
+                for member_name in (module_file, name + ".c.cached"):
+                    if Path(member_name).name != member_name or not member_name.startswith(name):
+                        raise ValueError(f"Invalid file name {member_name} in {archive}.")
+                    data = tar.extractfile(member_name).read()
+                    fd, tmpname = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+                    with os.fdopen(fd, "wb") as out:
+                        out.write(data)
+                    os.replace(tmpname, self.path.joinpath(member_name))
+                imported.append((name, module_file))
+        self.add_to_manifest(imported)
+        return [name for name, _ in imported]
+
+
+def mark_used(marker, interval=ModuleCache.grace / 2):
+    """Set the modification time of the marker of a module to now, unless it is more recent than interval seconds.
+
+    Raises FileNotFoundError if the marker does not exist.
+    """
+    if os.stat(marker).st_mtime < time.time() - interval:
+        os.utime(marker)
+
+
+def _unlink(filename):
+    try:
+        filename.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def get_module_cache(path, parameters):
+    """Return the JIT cache in directory path, with the limits configured by parameters."""
+    max_size = parameters.get("jit_cache_size", FFCX_DEFAULT_PARAMETERS["jit_cache_size"][0])
+    max_entries = parameters.get("jit_cache_entries", FFCX_DEFAULT_PARAMETERS["jit_cache_entries"][0])
+    return ModuleCache(path, None if max_size <= 0 else max_size * 2**20, None if max_entries <= 0 else max_entries)
+
+
+def get_code_cache(parameters):
+    """Return the code cache configured by parameters, or None if caching is disabled."""
+    path = parameters.get("code_cache_dir")
+    if not path:
+        return None
+    max_size = parameters.get("code_cache_size", FFCX_DEFAULT_PARAMETERS["code_cache_size"][0])
+    return CodeCache(Path(path).expanduser(), None if max_size <= 0 else max_size * 2**20)
+
+
+def compute_code_key(ufl_objects, object_names, prefix, parameters):
+    """Return the cache key of the code generated for UFL objects, or None if it can not be computed."""
+    import basix
+    import ufl
+
+    import ffcx.codegeneration
+    import ffcx.naming
+
+    try:
+        signature = ffcx.naming.compute_signature(ufl_objects, "")
+    except RuntimeError:
+        return None
+
+    # Names of the objects and of the functions they depend on appear in
+    # the generated code
+    names = []
+    for obj in ufl_objects:
+        if isinstance(obj, ufl.Form):
+            functions = list(obj.arguments()) + list(obj.coefficients()) + list(obj.constants())
+        elif isinstance(obj, tuple):
+            expr = obj[0]
+            functions = list(ufl.algorithms.extract_arguments(expr)) + list(ufl.algorithms.extract_coefficients(expr)) \
+                + list(ufl.algorithms.analysis.extract_constants(expr))
+        else:
+            functions = ()
+        names.append((object_names.get(id(obj)), [object_names.get(id(f), str(f)) for f in functions]))
+
+    p = sorted((k, v) for k, v in parameters.items()
+               if k in FFCX_DEFAULT_PARAMETERS and k not in nocode_parameters)
+    key = ";".join([signature, str(prefix), repr(names), repr(p), ffcx.__version__,
+                    ffcx.codegeneration.get_signature(), ufl.__version__, basix.__version__])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def _format_size(size):
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="python -m ffcx.cache", description="Manage a JIT cache directory of FFCx")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    stats = subparsers.add_parser("stats", help="print number and size of entries")
+    prune = subparsers.add_parser("prune", help="remove least recently used entries beyond the limits")
+    prune.add_argument("--max-size", type=float, help="size limit in MiB (default: parameter jit_cache_size)")
+    prune.add_argument("--max-entries", type=int, help="limit of entries (default: parameter jit_cache_entries)")
+    verify = subparsers.add_parser("verify", help="list failed, abandoned and broken entries")
+    verify.add_argument("--remove", action="store_true", help="remove the entries listed")
+    clear = subparsers.add_parser("clear", help="remove all entries")
+    export = subparsers.add_parser("export", help="write compiled modules to an archive")
+    import_ = subparsers.add_parser("import", help="add compiled modules from an archive")
+    for subparser in (stats, prune, verify, clear, export, import_):
+        subparser.add_argument("cache_dir", help="JIT cache directory")
+    for subparser in (export, import_):
+        subparser.add_argument("archive", help="archive file (.tar.gz)")
+    for subparser in (prune, verify):
+        subparser.add_argument("--grace", type=float, default=ModuleCache.grace,
+                               help="keep entries used in the last GRACE seconds (default: 60)")
+    xargs = parser.parse_args(args)
+
+    cache = ModuleCache(xargs.cache_dir, grace=getattr(xargs, "grace", ModuleCache.grace))
+    if xargs.command == "stats":
+        entries = cache.entries()
+        print(f"{'state':<12}{'entries':>9}{'size':>12}")
+        for state in ("ready", "unit", "failed", "incomplete"):
+            selected = [e for e in entries if e.state == state]
+            print(f"{state:<12}{len(selected):>9}{_format_size(sum(e.size for e in selected)):>12}")
+        print(f"{'total':<12}{len(entries):>9}{_format_size(sum(e.size for e in entries)):>12}")
+        print(f"Modules in manifest: {len(cache.read_manifest())}")
+        if entries:
+            print(f"Least recently used: {time.ctime(entries[0].last_use)}")
+            print(f"Most recently used:  {time.ctime(entries[-1].last_use)}")
+    elif xargs.command == "prune":
+        import ffcx.parameters
+        limits = get_module_cache(xargs.cache_dir, ffcx.parameters.get_parameters())
+        cache.max_size = limits.max_size if xargs.max_size is None else int(xargs.max_size * 2**20)
+        cache.max_entries = limits.max_entries if xargs.max_entries is None else xargs.max_entries
+        if cache.max_size is None and cache.max_entries is None:
+            parser.error("no limit given, and the parameters jit_cache_size and jit_cache_entries are not set")
+        removed = cache.evict()
+        print(f"Removed {len(removed)} entries ({_format_size(sum(e.size for e in removed))}).")
+    elif xargs.command == "verify":
+        problems = cache.verify()
+        for entry, problem in problems:
+            print(f"{entry.name}: {problem}")
+        if xargs.remove:
+            removed = [entry for entry, _ in problems if cache.remove(entry)]
+            cache.write_manifest()
+            print(f"Removed {len(removed)} entries.")
+        elif problems:
+            return 1
+    elif xargs.command == "clear":
+        removed = cache.clear()
+        print(f"Removed {len(removed)} entries ({_format_size(sum(e.size for e in removed))}).")
+    elif xargs.command == "export":
+        exported = cache.export_archive(xargs.archive)
+        print(f"Exported {len(exported)} modules to {xargs.archive}.")
+    elif xargs.command == "import":
+        imported = cache.import_archive(xargs.archive)
+        print(f"Imported {len(imported)} modules from {xargs.archive}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+# Copyright (C) 2022 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Vectorisation of tabulate_tensor bodies across a batch of cells.
+
+The statements generated for a single cell never branch on data, so the
+cell loop can be pushed down to the leaf statements: each run of
+consecutive leaf statements is executed for all cells of the batch
+before the next loop of the per-cell code is entered. This makes the
+cell index the innermost (unit stride) loop, which compilers turn into
+SIMD instructions.
+"""
+
+import logging
+
+logger = logging.getLogger("ffcx")
+
+# Kernel arguments which are stored as [entry][num_cells] in the
+# batched kernel
+batched_arguments = ("A", "w", "c", "coordinate_dofs", "entity_local_index", "quadrature_permutation")
+
+# Maximum number of statements in a single loop over the cells. Compile
+# times grow quickly with the size of vectorised loop bodies.
+max_run_length = 64
+
+
+class CellBatchTransformer(object):
+    """Rewrite a per-cell statement tree into a batched statement tree."""
+
+    def __init__(self, language, batch_size, scalar_type, tensor_size):
+        self.L = language
+        self.batch_size = batch_size
+        self.scalar_type = scalar_type
+        self.tensor_size = tensor_size
+
+        self.num_cells = self.L.Symbol("num_cells")
+        self.cell_offset = self.L.Symbol("cell0")
+        self.cell = self.L.Symbol("icell")
+
+        # The element tensors of a batch are accumulated in a local
+        # array, and added to A once at the end of the batch
+        self.element_tensor = self.L.Symbol("A")
+        self.batch_tensor = self.L.Symbol("A_batch")
+
+        # Local arrays, and local variables which are used outside the
+        # run of leaf statements defining them. These are given an extra
+        # cell dimension, all other local variables are declared inside
+        # the cell loop where compilers keep them in (vector) registers.
+        self.batched_scalars = set()
+        self.batched_arrays = set()
+
+        # Static tables are shared by all cells, and hoisted out of the batch loop
+        self.static_declarations = []
+
+    def generate(self, body):
+        """Return the batched version of the per-cell statement tree body."""
+        L = self.L
+        self.analyse(body)
+
+        B = self.batch_size
+        batch = L.Symbol("ib")
+        num_batches = L.Symbol("num_batches")
+        num_remaining = L.Symbol("num_remaining")
+
+        # Complete batches have a constant trip count for the compiler
+        # to vectorise, the remaining cells are processed by a copy of
+        # the code with a variable trip count
+        full_batches = [L.VariableDecl("const int", self.cell_offset, batch * B)]
+        full_batches += self.batch(body, B)
+        last_batch = [L.VariableDecl("const int", self.cell_offset, num_batches * B)]
+        last_batch += self.batch(body, num_remaining)
+
+        parts = list(self.static_declarations)
+        parts += [L.VariableDecl("const int", num_batches, self.num_cells / B),
+                  L.VariableDecl("const int", num_remaining, self.num_cells - num_batches * B)]
+        parts += L.commented_code_list(
+            L.ForRange(batch, 0, num_batches, body=full_batches),
+            f"Loop over batches of {B} cells, with the cell index innermost")
+        parts += [L.If(L.GT(num_remaining, 0), last_batch)]
+        return L.StatementList(parts)
+
+    def batch(self, body, num_batch):
+        """Return the statements computing the element tensors of a batch of num_batch cells."""
+        L = self.L
+        code = [L.ArrayDecl(self.scalar_type, self.batch_tensor, (self.tensor_size, self.batch_size), values=0)]
+        code += self.statement(body, num_batch)
+
+        entry = L.Symbol("ia")
+        update = L.AssignAdd(self.element_tensor[entry * self.num_cells + self.cell_offset + self.cell],
+                             self.batch_tensor[entry][self.cell])
+        code += L.commented_code_list(
+            L.ForRange(entry, 0, self.tensor_size, body=L.ForRange(self.cell, 0, num_batch, body=update)),
+            "Add element tensors of the batch to A")
+        return code
+
+    def segments(self, s):
+        """Split the block s into runs of consecutive leaf statements and other statements."""
+        L = self.L
+        segments = []
+        leaves = []
+        for st in flatten(L, s):
+            if isinstance(st, (L.ArrayDecl, L.VariableDecl, L.Statement)):
+                leaves.append(st)
+                if len(leaves) == max_run_length:
+                    segments.append(leaves)
+                    leaves = []
+            else:
+                if leaves:
+                    segments.append(leaves)
+                    leaves = []
+                segments.append(st)
+        if leaves:
+            segments.append(leaves)
+        return segments
+
+    def analyse(self, s):
+        """Find local variables used outside of the run of statements defining them, and static tables."""
+        L = self.L
+        definition = {}
+        uses = []
+
+        def visit(s):
+            for segment in self.segments(s):
+                if isinstance(segment, list):
+                    run = len(uses)
+                    names = set()
+                    for st in segment:
+                        if isinstance(st, L.VariableDecl):
+                            definition[st.symbol.name] = run
+                            names.update(symbol_names(L, st.value))
+                        elif isinstance(st, L.ArrayDecl) and st.typename.startswith("static"):
+                            self.static_declarations.append(st)
+                        elif isinstance(st, L.ArrayDecl):
+                            self.batched_arrays.add(st.symbol.name)
+                        else:
+                            names.update(symbol_names(L, st.expr))
+                    uses.append(names)
+                elif isinstance(segment, L.ForRange):
+                    visit(segment.body)
+                elif isinstance(segment, L.VerbatimStatement):
+                    # Only alignment hints for the per-cell pointers are pasted
+                    # verbatim into integral kernels, they do not apply here
+                    logger.debug(f"Dropping verbatim statement from batched kernel: {segment.codestring}")
+                elif not isinstance(segment, (L.Comment, L.Pragma)):
+                    raise RuntimeError(f"Cannot batch statement of type {type(segment).__name__}.")
+
+        visit(s)
+        for run, names in enumerate(uses):
+            self.batched_scalars.update(name for name in names if definition.get(name, run) != run)
+
+    def statement(self, s, num_batch):
+        """Return a list of statements replacing the block s, for a batch of num_batch cells."""
+        L = self.L
+        code = []
+        for segment in self.segments(s):
+            if isinstance(segment, list):
+                declarations = []
+                leaves = []
+                for st in segment:
+                    if isinstance(st, L.ArrayDecl) and st.symbol.name in self.batched_arrays:
+                        if st.values is not None:
+                            raise RuntimeError(f"Cannot batch initialised array {st.symbol.name}.")
+                        declarations.append(L.ArrayDecl(st.typename, st.symbol, st.sizes + (self.batch_size, ),
+                                                        padlen=st.padlen))
+                    elif isinstance(st, L.ArrayDecl):
+                        # Static tables are hoisted out of the batch loop
+                        continue
+                    elif isinstance(st, L.VariableDecl) and st.symbol.name in self.batched_scalars:
+                        typename = st.typename.replace("const ", "")
+                        declarations.append(L.ArrayDecl(typename, st.symbol, (self.batch_size, )))
+                        if st.value is not None:
+                            leaves.append(L.Assign(st.symbol[self.cell], self.expression(st.value)))
+                    elif isinstance(st, L.VariableDecl):
+                        value = None if st.value is None else self.expression(st.value)
+                        leaves.append(L.VariableDecl(st.typename, st.symbol, value))
+                    else:
+                        leaves.append(L.Statement(self.expression(st.expr)))
+                code += declarations
+                if leaves:
+                    code.append(L.ForRange(self.cell, 0, num_batch, body=leaves))
+            elif isinstance(segment, L.ForRange):
+                body = self.statement(segment.body, num_batch)
+                code.append(L.ForRange(segment.index, segment.begin, segment.end, body=body,
+                                       index_type=segment.index_type))
+            elif not isinstance(segment, L.VerbatimStatement):
+                code.append(segment)
+        return code
+
+    def expression(self, e):
+        """Return expression e evaluated for the cell with index icell of the current batch."""
+        L = self.L
+        if isinstance(e, L.Symbol):
+            if e.name in self.batched_scalars:
+                return e[self.cell]
+            elif e.name in batched_arguments:
+                raise RuntimeError(f"Unexpected direct use of kernel argument {e.name}.")
+            return e
+        elif isinstance(e, L.ArrayAccess):
+            indices = tuple(self.expression(i) for i in e.indices)
+            name = e.array.name
+            if name in self.batched_arrays:
+                return L.ArrayAccess(e.array, indices + (self.cell, ))
+            elif name == self.element_tensor.name:
+                assert len(indices) == 1, "Expecting flat access to element tensor."
+                return L.ArrayAccess(self.batch_tensor, indices + (self.cell, ))
+            elif name in batched_arguments:
+                assert len(indices) == 1, "Expecting flat access to kernel arguments."
+                index, = indices
+                return L.ArrayAccess(e.array, index * self.num_cells + self.cell_offset + self.cell)
+            return L.ArrayAccess(e.array, indices)
+        elif isinstance(e, L.BinOp):
+            return type(e)(self.expression(e.lhs), self.expression(e.rhs))
+        elif isinstance(e, L.NaryOp):
+            return type(e)([self.expression(arg) for arg in e.args])
+        elif isinstance(e, L.UnaryOp):
+            return type(e)(self.expression(e.arg))
+        elif isinstance(e, L.Conditional):
+            return L.Conditional(self.expression(e.condition), self.expression(e.true), self.expression(e.false))
+        elif isinstance(e, L.Call):
+            return L.Call(e.function, [self.expression(arg) for arg in e.arguments])
+        elif isinstance(e, L.CExprLiteral):
+            return e
+        else:
+            raise RuntimeError(f"Cannot batch expression of type {type(e).__name__}.")
+
+
+def flatten(L, s):
+    """Return the statements of s with nested statement lists flattened."""
+    if isinstance(s, L.StatementList):
+        return [t for st in s.statements for t in flatten(L, st)]
+    return [s]
+
+
+def symbol_names(L, e):
+    """Return the names of all symbols used in expression e."""
+    if isinstance(e, L.Symbol):
+        return {e.name}
+    elif isinstance(e, L.ArrayAccess):
+        return set().union(symbol_names(L, e.array), *(symbol_names(L, i) for i in e.indices))
+    elif isinstance(e, L.BinOp):
+        return symbol_names(L, e.lhs) | symbol_names(L, e.rhs)
+    elif isinstance(e, L.NaryOp):
+        return set().union(*(symbol_names(L, arg) for arg in e.args))
+    elif isinstance(e, L.UnaryOp):
+        return symbol_names(L, e.arg)
+    elif isinstance(e, L.Conditional):
+        return symbol_names(L, e.condition) | symbol_names(L, e.true) | symbol_names(L, e.false)
+    elif isinstance(e, L.Call):
+        return set().union(*(symbol_names(L, arg) for arg in e.arguments))
+    return set()
@@ -11,9 +11,11 @@ UFC function from an intermediate representation (IR).
 
 """
 
+import hashlib
 import logging
 from collections import namedtuple
 
+import ffcx.metrics
 from ffcx.codegeneration.dofmap import generator as dofmap_generator
 from ffcx.codegeneration.expressions import generator as expression_generator
 from ffcx.codegeneration.finite_element import \
@@ -26,8 +28,12 @@ logger = logging.getLogger("ffcx")
 code_blocks = namedtuple("code_blocks", ["elements", "dofmaps", "integrals", "forms", "expressions"])
 
 
-def generate_code(ir, parameters):
-    """Generate code blocks from intermediate representation."""
+def generate_code(ir, parameters, metrics=None):
+    """Generate code blocks from intermediate representation.
+
+    If metrics is not None, metrics["kernels"] is set to the metrics of
+    each integral and expression (see ffcx.metrics).
+    """
     logger.info(79 * "*")
     logger.info("Compiler stage 3: Generating code")
     logger.info(79 * "*")
@@ -35,9 +41,41 @@ def generate_code(ir, parameters):
     # Generate code for finite_elements
     code_finite_elements = [finite_element_generator(element_ir, parameters) for element_ir in ir.elements]
     code_dofmaps = [dofmap_generator(dofmap_ir, parameters) for dofmap_ir in ir.dofmaps]
-    code_integrals = [integral_generator(integral_ir, parameters) for integral_ir in ir.integrals]
-    code_forms = [form_generator(form_ir, parameters) for form_ir in ir.forms]
+
+    # Name integrals by a signature of their code, so that unchanged
+    # integrals keep their name (and compiled object) when other parts
+    # of a form change. Integrals with identical code are generated once.
+    code_integrals = []
+    integral_names = {}
+    kernels = []
+    for integral_ir in ir.integrals:
+        code, name = _content_addressed(integral_generator(integral_ir, parameters), integral_ir.name, "integral")
+        if name not in integral_names.values():
+            code_integrals.append(code)
+        integral_names[integral_ir.name] = name
+        kernels.append(("integral", integral_ir, name, code))
+
+    ir_forms = [form_ir._replace(integral_names={itg_type: [integral_names[name] for name in names]
+                                                 for itg_type, names in form_ir.integral_names.items()})
+                for form_ir in ir.forms]
+    code_forms = [form_generator(form_ir, parameters) for form_ir in ir_forms]
     code_expressions = [expression_generator(expression_ir, parameters) for expression_ir in ir.expressions]
+    kernels += [("expression", expression_ir, expression_ir.name, code)
+                for expression_ir, code in zip(ir.expressions, code_expressions)]
+
+    if metrics is not None:
+        metrics["kernels"] = [ffcx.metrics.kernel_metrics(*kernel) for kernel in kernels]
 
     return code_blocks(elements=code_finite_elements, dofmaps=code_dofmaps,
                        integrals=code_integrals, forms=code_forms, expressions=code_expressions)
+
+
+def _content_addressed(code, name, kind):
+    """Rename object in code blocks to kind_<signature of the code>.
+
+    The code refers to the coordinate element, whose name depends on
+    the prefix, so the signature is unique across prefixes.
+    """
+    signature = hashlib.sha1("".join(code).replace(name, kind).encode("utf-8")).hexdigest()
+    new_name = f"{kind}_{signature}"
+    return tuple(c.replace(name, new_name) for c in code), new_name
@@ -8,6 +8,7 @@
 # old implementation in FFC
 
 import logging
+import re
 
 from ffcx.codegeneration import form_template
 
@@ -110,8 +111,11 @@ def generator(ir, parameters):
 
     # FIXME: Should be handled differently, revise how
     # ufcx_function_space is generated
+    # Names of functions without a name in the UFL file are their UFL
+    # representation, such as w_{10}, which are made valid identifiers
+    symbols = {name: re.sub(r"\W", "_", name) for name in ir.function_spaces}
     for (name, (element, dofmap, cmap_family, cmap_degree, cmap_celltype, cmap_variant)) in ir.function_spaces.items():
-        code += [f"static ufcx_function_space functionspace_{name} ="]
+        code += [f"static ufcx_function_space functionspace_{symbols[name]} ="]
         code += ["{"]
         code += [f".finite_element = &{element},"]
         code += [f".dofmap = &{dofmap},"]
@@ -124,7 +128,7 @@ def generator(ir, parameters):
     _if = L.If
     for name in ir.function_spaces.keys():
         condition = L.EQ(L.Call("strcmp", (function_name, L.LiteralString(name))), 0)
-        code += [_if(condition, L.Return(L.Symbol(f"&functionspace_{name}")))]
+        code += [_if(condition, L.Return(L.Symbol(f"&functionspace_{symbols[name]}")))]
         _if = L.ElseIf
 
     code += ["return NULL;\n"]
@@ -8,10 +8,12 @@ import collections
 import logging
 from typing import List, Tuple
 
+import numpy
 import ufl
 from ffcx.codegeneration import geometry
 from ffcx.codegeneration import integrals_template as ufcx_integrals
 from ffcx.codegeneration.backend import FFCXBackend
+from ffcx.codegeneration.batching import CellBatchTransformer
 from ffcx.codegeneration.C.format_lines import format_indented_lines
 from ffcx.codegeneration.C.cnodes import CNode, BinOp
 from ffcx.ir.elementtables import piecewise_ttypes
@@ -71,11 +73,28 @@ def generator(ir, parameters):
     if parameters["tabulate_tensor_void"]:
         code["tabulate_tensor"] = ""
 
+    # Generate the batched kernel from the same statement tree
+    if parameters["batch_size"] > 0:
+        batch_parts = ig.generate_batch(parts, parameters["batch_size"])
+        batch_body = format_indented_lines(batch_parts.cs_format(ir.precision), 1)
+        if parameters["tabulate_tensor_void"]:
+            batch_body = ""
+        code["tabulate_tensor_batch_function"] = ufcx_integrals.batch_factory.format(
+            factory_name=factory_name,
+            tabulate_tensor_batch=batch_body,
+            scalar_type=parameters["scalar_type"])
+        code["tabulate_tensor_batch"] = f"tabulate_tensor_batch_{factory_name}"
+    else:
+        code["tabulate_tensor_batch_function"] = ""
+        code["tabulate_tensor_batch"] = L.Null()
+
     implementation = ufcx_integrals.factory.format(
         factory_name=factory_name,
         enabled_coefficients=code["enabled_coefficients"],
         enabled_coefficients_init=code["enabled_coefficients_init"],
         tabulate_tensor=code["tabulate_tensor"],
+        tabulate_tensor_batch_function=code["tabulate_tensor_batch_function"],
+        tabulate_tensor_batch=code["tabulate_tensor_batch"],
         needs_facet_permutations="true" if ir.needs_facet_permutations else "false",
         scalar_type=parameters["scalar_type"],
         np_scalar_type=cdtype_to_numpy(parameters["scalar_type"]),
@@ -207,6 +226,10 @@ class IntegralGenerator(object):
             # Generate code to compute piecewise constant scalar factors
             all_preparts += self.generate_piecewise_partition(rule)
 
+            # Generate code to add preintegrated blocks times their
+            # piecewise constant factors to the element tensor
+            all_preparts += self.generate_preintegrated_dofblock_partition(rule)
+
             # Generate code to integrate reusable blocks of final
             # element tensor
             pre_definitions, preparts, quadparts = self.generate_quadrature_loop(rule)
@@ -223,6 +246,20 @@ class IntegralGenerator(object):
 
         return L.StatementList(parts)
 
+    def generate_batch(self, parts, batch_size):
+        """Generate tabulate_tensor body for a batch of cells from the per-cell body.
+
+        The cell index becomes the innermost loop of every statement,
+        and kernel arguments are accessed in structure-of-arrays
+        layout, see ufcx_tabulate_tensor_batch_float64.
+        """
+        tensor_size = 1
+        for dim in self.ir.tensor_shape:
+            tensor_size *= dim
+        transformer = CellBatchTransformer(self.backend.language, batch_size,
+                                           self.backend.access.parameters["scalar_type"], tensor_size)
+        return transformer.generate(parts)
+
     def generate_quadrature_tables(self):
         """Generate static tables of quadrature points and weights."""
         L = self.backend.language
@@ -239,6 +276,11 @@ class IntegralGenerator(object):
 
         # Loop over quadrature rules
         for quadrature_rule, integrand in self.ir.integrand.items():
+            # Weights are not needed if all blocks are preintegrated or
+            # premultiplied
+            if all(blockdata.name is not None for contributions in integrand["block_contributions"].values()
+                   for blockdata in contributions):
+                continue
 
             num_points = quadrature_rule.weights.shape[0]
             # Generate quadrature weights array
@@ -303,13 +345,19 @@ class IntegralGenerator(object):
 
         for name in table_names:
             table = tables[name]
-            parts += self.declare_table(name, table, padlen)
+            if table_types[name] == "permutation_map":
+                parts += [L.ArrayDecl("static const int", name, table.shape, table)]
+            else:
+                parts += self.declare_table(name, table, padlen)
 
         # Add leading comment if there are any tables
-        parts = L.commented_code_list(parts, [
+        comments = [
             "Precomputed values of basis functions and precomputations",
             "FE* dimensions: [permutation][entities][points][dofs]",
-        ])
+        ]
+        if "permutation_map" in table_types.values():
+            comments.append("qperm* dimensions: [permutation][points]")
+        parts = L.commented_code_list(parts, comments)
         return parts
 
     def declare_table(self, name, table, padlen):
@@ -327,6 +375,9 @@ class IntegralGenerator(object):
     def generate_quadrature_loop(self, quadrature_rule: QuadratureRule):
         """Generate quadrature loop with for this quadrature_rule."""
         L = self.backend.language
+        symbols = self.backend.symbols
+        symbols.permuted_points.clear()
+
         # Generate varying partition
         pre_definitions, body = self.generate_varying_partition(quadrature_rule)
 
@@ -335,10 +386,16 @@ class IntegralGenerator(object):
 
         # Generate dofblock parts, some of this will be placed before or
         # after quadloop
-        preparts, quadparts = \
+        preparts, quadparts, postparts = \
             self.generate_dofblock_partition(quadrature_rule)
         body += quadparts
 
+        # Indices of the permuted quadrature points in unpermuted tables
+        iq = symbols.quadrature_loop_index()
+        body = [L.VariableDecl("const int", symbols.permuted_quadrature_loop_index(index),
+                               symbols.named_table(point_map)[symbols.quadrature_permutation(index)][iq])
+                for point_map, index in sorted(symbols.permuted_points)] + body
+
         # Wrap body in loop or scope
         if not body:
             # Could happen for integral with everything zero and
@@ -346,8 +403,8 @@ class IntegralGenerator(object):
             quadparts = []
         else:
             num_points = quadrature_rule.points.shape[0]
-            iq = self.backend.symbols.quadrature_loop_index()
             quadparts = [L.ForRange(iq, 0, num_points, body=body)]
+        quadparts += postparts
 
         return pre_definitions, preparts, quadparts
 
@@ -478,6 +535,7 @@ class IntegralGenerator(object):
         block_contributions = self.ir.integrand[quadrature_rule]["block_contributions"]
         preparts = []
         quadparts = []
+        postparts = []
         blocks = [(blockmap, blockdata)
                   for blockmap, contributions in sorted(block_contributions.items())
                   for blockdata in contributions]
@@ -487,6 +545,17 @@ class IntegralGenerator(object):
         # Group loops by blockmap, in Vector elements each component has
         # a different blockmap
         for blockmap, blockdata in blocks:
+            if self.is_preintegrated(blockdata):
+                # Preintegrated blocks are computed outside the quadrature loop
+                continue
+            if blockdata.sum_factorization is not None:
+                block_preparts, block_quadparts, block_postparts = \
+                    self.generate_sum_factorized_block(quadrature_rule, blockdata)
+                preparts.extend(block_preparts)
+                quadparts.extend(block_quadparts)
+                postparts.extend(block_postparts)
+                continue
+
             scalar_blockmap = []
             assert len(blockdata.ma_data) == len(blockmap)
             for i, b in enumerate(blockmap):
@@ -506,7 +575,63 @@ class IntegralGenerator(object):
             # Add computations
             quadparts.extend(block_quadparts)
 
-        return preparts, quadparts
+        return preparts, quadparts, postparts
+
+    def generate_preintegrated_dofblock_partition(self, quadrature_rule: QuadratureRule):
+        """Generate code adding the preintegrated blocks of a quadrature rule to the element tensor.
+
+        Each block contributes A[blockmap] += f * PI, where PI is the
+        integral of the product of the argument tables computed at
+        compile time and f is the piecewise constant factor of the block.
+        """
+        L = self.backend.language
+        block_contributions = self.ir.integrand[quadrature_rule]["block_contributions"]
+        blocks = [(blockmap, blockdata)
+                  for blockmap, contributions in sorted(block_contributions.items())
+                  for blockdata in contributions if self.is_preintegrated(blockdata)]
+
+        A = L.FlattenedArray(self.backend.symbols.element_tensor(), dims=self.ir.tensor_shape)
+        F = self.ir.integrand[quadrature_rule]["factorization"]
+
+        # Blocks with the same blockmap are added in a single loop nest
+        rhs_expressions = collections.defaultdict(list)
+        A_indices = {}
+        for blockmap, blockdata in blocks:
+            if len(blockdata.factor_indices_comp_indices) > 1:
+                raise RuntimeError("Code generation for non-scalar integrals unsupported")
+            factor_index = blockdata.factor_indices_comp_indices[0][0]
+            f = self.get_var(None, F.nodes[factor_index]['expression'])
+
+            block_rank = len(blockmap)
+            arg_indices = tuple(self.backend.symbols.argument_loop_index(i) for i in range(block_rank))
+
+            # Preintegrated tables are uniform if all argument tables are
+            if blockdata.is_uniform:
+                entity = 0
+            else:
+                entity = self.backend.symbols.entity(self.ir.entitytype, None)
+            PI = L.Symbol(blockdata.name)[(0, entity) + arg_indices]
+
+            indices = []
+            for i in range(block_rank):
+                td = blockdata.ma_data[i].tabledata
+                if len(blockmap[i]) == 1:
+                    indices.append(arg_indices[i] + td.offset)
+                else:
+                    indices.append(td.block_size * arg_indices[i] + td.offset)
+            A_indices[blockmap] = tuple(indices)
+            rhs_expressions[blockmap].append(L.float_product([f, PI]))
+
+        parts = []
+        for blockmap, rhs in rhs_expressions.items():
+            arg_indices = tuple(self.backend.symbols.argument_loop_index(i) for i in range(len(blockmap)))
+            body = [L.AssignAdd(A[A_indices[blockmap]], L.Sum(rhs))]
+            for i in reversed(range(len(blockmap))):
+                body = [L.ForRange(arg_indices[i], 0, len(blockmap[i]), body=body)]
+            parts += body
+
+        return L.commented_code_list(
+            parts, f"Preintegrated blocks for quadrature rule {quadrature_rule.id()}")
 
     def get_arg_factors(self, blockdata, block_rank, quadrature_rule, iq, indices):
         arg_factors = []
@@ -533,6 +658,149 @@ class IntegralGenerator(object):
             arg_factors.append(arg_factor)
         return arg_factors
 
+    def is_preintegrated(self, blockdata):
+        """Check if the block is integrated at compile time."""
+        return self.ir.unique_table_types.get(blockdata.name) == "preintegrated"
+
+    def get_block_factor(self, quadrature_rule, blockdata):
+        """Return the factor of a block times the quadrature weight, and the code defining it.
+
+        The code defining the factor of premultiplied blocks goes before the
+        quadrature loop, for all other blocks inside.
+        """
+        L = self.backend.language
+        parts = []
+
+        if len(blockdata.factor_indices_comp_indices) > 1:
+            raise RuntimeError("Code generation for non-scalar integrals unsupported")
+
+        # We have scalar integrand here, take just the factor index
+        factor_index = blockdata.factor_indices_comp_indices[0][0]
+
+        # Get factor expression
+        F = self.ir.integrand[quadrature_rule]["factorization"]
+
+        v = F.nodes[factor_index]['expression']
+        f = self.get_var(quadrature_rule, v)
+
+        scalar_type = self.backend.access.parameters["scalar_type"]
+        key = (quadrature_rule, factor_index, blockdata.all_factors_piecewise)
+
+        # The weight is folded into the table of premultiplied blocks,
+        # their piecewise factor is defined outside the quadrature loop
+        if self.ir.unique_table_types.get(blockdata.name) == "premultiplied":
+            if isinstance(f, (L.Symbol, L.ArrayAccess, L.LiteralFloat)):
+                return f, parts
+            fp, defined = self.get_temp_symbol("fp", key)
+            if not defined:
+                parts.append(L.VariableDecl(f"const {scalar_type}", fp, f))
+            return fp, parts
+
+        # Quadrature weight was removed in representation, add it back now
+        iq = self.backend.symbols.quadrature_loop_index()
+        if self.ir.integral_type in ufl.custom_integral_types:
+            weights = self.backend.symbols.custom_weights_table()
+            weight = weights[iq]
+        else:
+            weights = self.backend.symbols.weights_table(quadrature_rule)
+            weight = weights[iq]
+
+        # Define fw = f * weight
+        fw_rhs = L.float_product([f, weight])
+        if not isinstance(fw_rhs, L.Product):
+            fw = fw_rhs
+        else:
+            # Define and cache scalar temp variable
+            fw, defined = self.get_temp_symbol("fw", key)
+            if not defined:
+                parts.append(L.VariableDecl(f"const {scalar_type}", fw, fw_rhs))
+
+        return fw, parts
+
+    def generate_sum_factorized_block(self, quadrature_rule: QuadratureRule, blockdata: block_data_t):
+        """Generate and return code parts for a sum factorized block.
+
+        The block factor is stored for all quadrature points inside the
+        quadrature loop. After the loop, it is contracted with the one
+        dimensional tables of the arguments one dimension at a time,
+        starting from the last dimension. Returns parts occuring
+        before, inside and after the quadrature loop.
+        """
+        L = self.backend.language
+        scalar_type = self.backend.access.parameters["scalar_type"]
+
+        preparts: List[CNode] = []
+        quadparts: List[CNode] = []
+        postparts: List[CNode] = []
+
+        assert not blockdata.transposed, "Not handled yet"
+        sf = blockdata.sum_factorization
+        block_rank = len(sf)
+        tables = self.ir.unique_tables
+
+        # Store the block factor in all quadrature points
+        fw, fw_parts = self.get_block_factor(quadrature_rule, blockdata)
+        quadparts += fw_parts
+        factor_index = blockdata.factor_indices_comp_indices[0][0]
+        key = (quadrature_rule, factor_index, blockdata.all_factors_piecewise)
+        fq, defined = self.get_temp_symbol("fq", key)
+        if not defined:
+            iq = self.backend.symbols.quadrature_loop_index()
+            preparts.append(L.ArrayDecl(scalar_type, fq, quadrature_rule.points.shape[0]))
+            quadparts.append(L.Assign(fq[iq], fw))
+
+        # Number of points and dofs of each argument in each dimension
+        points_shape = tuple(tables[name].shape[2] for name in sf[0].tables)
+        dofs_shape = [tuple(tables[name].shape[3] for name in asf.tables) for asf in sf]
+        tdim = len(points_shape)
+
+        q = [L.Symbol(f"q{d}") for d in range(tdim)]
+        dofs = [[L.Symbol(f"{'ij'[i]}{d}") for d in range(tdim)] for i in range(block_rank)]
+
+        # Maps from tensor product dofs to dofs in the element tensor
+        A = L.FlattenedArray(self.backend.symbols.element_tensor(), dims=self.ir.tensor_shape)
+        A_indices = []
+        for i in range(block_rank):
+            td = blockdata.ma_data[i].tabledata
+            dofmap, defined = self.get_temp_symbol("sf_dofs", (sf[i].dofmap, ))
+            if not defined:
+                postparts.append(L.ArrayDecl("static const int", dofmap, len(sf[i].dofmap),
+                                             values=numpy.array(sf[i].dofmap)))
+            index = L.FlattenedArray(dofmap, dims=dofs_shape[i])[tuple(dofs[i])]
+            A_indices.append(td.block_size * index + td.offset)
+
+        code = []
+        values = L.FlattenedArray(fq, dims=points_shape)
+        for d in reversed(range(tdim)):
+            # Contract the values with the tables of dimension d
+            dof_indices = [dofs[i][e] for e in range(d, tdim) for i in range(block_rank)]
+            dof_dims = [dofs_shape[i][e] for e in range(d, tdim) for i in range(block_rank)]
+            acc = self.new_temp_symbol("acc")
+            terms = [L.ArrayAccess(L.Symbol(sf[i].tables[d]), (0, 0, q[d], dofs[i][d])) for i in range(block_rank)]
+            terms.append(values[tuple(q[:d + 1]) + tuple(dof_indices[block_rank:])])
+            body = [L.VariableDecl(scalar_type, acc, 0.0),
+                    L.ForRange(q[d], 0, points_shape[d], body=L.AssignAdd(acc, L.float_product(terms)))]
+
+            if d > 0:
+                result = self.new_temp_symbol("sf")
+                result_dims = points_shape[:d] + tuple(dof_dims)
+                code.append(L.ArrayDecl(scalar_type, result, int(numpy.prod(result_dims))))
+                result = L.FlattenedArray(result, dims=result_dims)
+                body.append(L.Assign(result[tuple(q[:d]) + tuple(dof_indices)], acc))
+            else:
+                body.append(L.AssignAdd(A[tuple(A_indices)], acc))
+
+            for index, dim in reversed(list(zip(q[:d] + dof_indices, points_shape[:d] + tuple(dof_dims)))):
+                body = [L.ForRange(index, 0, dim, body=body)]
+            code += body
+
+            values = result
+
+        postparts += L.commented_code_list(
+            code, f"Sum factorized contraction for tables {', '.join(blockdata.unames)}")
+
+        return preparts, quadparts, postparts
+
     def generate_block_parts(self, quadrature_rule: QuadratureRule, blockmap: Tuple, blocklist: List[block_data_t]):
         """Generate and return code parts for a given block.
 
@@ -570,34 +838,11 @@ class IntegralGenerator(object):
             if len(blockdata.factor_indices_comp_indices) > 1:
                 raise RuntimeError("Code generation for non-scalar integrals unsupported")
 
-            # We have scalar integrand here, take just the factor index
-            factor_index = blockdata.factor_indices_comp_indices[0][0]
-
-            # Get factor expression
-            F = self.ir.integrand[quadrature_rule]["factorization"]
-
-            v = F.nodes[factor_index]['expression']
-            f = self.get_var(quadrature_rule, v)
-
-            # Quadrature weight was removed in representation, add it back now
-            if self.ir.integral_type in ufl.custom_integral_types:
-                weights = self.backend.symbols.custom_weights_table()
-                weight = weights[iq]
-            else:
-                weights = self.backend.symbols.weights_table(quadrature_rule)
-                weight = weights[iq]
-
-            # Define fw = f * weight
-            fw_rhs = L.float_product([f, weight])
-            if not isinstance(fw_rhs, L.Product):
-                fw = fw_rhs
+            fw, fw_parts = self.get_block_factor(quadrature_rule, blockdata)
+            if self.ir.unique_table_types.get(blockdata.name) == "premultiplied":
+                preparts += fw_parts
             else:
-                # Define and cache scalar temp variable
-                key = (quadrature_rule, factor_index, blockdata.all_factors_piecewise)
-                fw, defined = self.get_temp_symbol("fw", key)
-                if not defined:
-                    scalar_type = self.backend.access.parameters["scalar_type"]
-                    quadparts.append(L.VariableDecl(f"const {scalar_type}", fw, fw_rhs))
+                quadparts += fw_parts
 
             assert not blockdata.transposed, "Not handled yet"
             A_shape = self.ir.tensor_shape
@@ -19,7 +19,7 @@ void tabulate_tensor_{factory_name}({scalar_type}* restrict A,
 {{
 {tabulate_tensor}
 }}
-
+{tabulate_tensor_batch_function}
 {enabled_coefficients_init}
 
 ufcx_integral {factory_name} =
@@ -28,7 +28,21 @@ ufcx_integral {factory_name} =
   .tabulate_tensor_{np_scalar_type} = tabulate_tensor_{factory_name},
   .needs_facet_permutations = {needs_facet_permutations},
   .coordinate_element = {coordinate_element},
+  .tabulate_tensor_batch_{np_scalar_type} = {tabulate_tensor_batch},
 }};
 
 // End of code for integral {factory_name}
 """
+
+batch_factory = """
+void tabulate_tensor_batch_{factory_name}(int num_cells,
+                                          {scalar_type}* restrict A,
+                                          const {scalar_type}* restrict w,
+                                          const {scalar_type}* restrict c,
+                                          const double* restrict coordinate_dofs,
+                                          const int* restrict entity_local_index,
+                                          const uint8_t* restrict quadrature_permutation)
+{{
+{tabulate_tensor_batch}
+}}
+"""
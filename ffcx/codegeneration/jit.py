@@ -4,253 +4,893 @@
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
+import concurrent.futures
+import fcntl
+import functools
+import hashlib
 import importlib
 import io
 import logging
 import os
+import pickle
 import re
+import signal
+import subprocess
+import sys
 import tempfile
+import threading
 import time
+import types
+import weakref
 from contextlib import redirect_stdout
 from pathlib import Path
 
-import cffi
+import ufl
+
 import ffcx
+import ffcx.cache
+import ffcx.formatting
+import ffcx.metrics
 import ffcx.naming
+import ffcx.server
 
 logger = logging.getLogger("ffcx")
 
-# Get declarations directly from ufcx.h
-file_dir = os.path.dirname(os.path.abspath(__file__))
-with open(file_dir + "/ufcx.h", "r") as f:
-    ufcx_h = ''.join(f.readlines())
+# Module attributes with ufcx.h and its declarations for cffi, which are
+# parsed on first use rather than on import
+_ufcx_decl_names = ("ufcx_h", "UFC_HEADER_DECL", "UFC_ELEMENT_DECL", "UFC_DOFMAP_DECL", "UFC_FORM_DECL",
+                    "UFC_INTEGRAL_DECL", "UFC_EXPRESSION_DECL")
+
+
+@functools.lru_cache(maxsize=None)
+def _ufcx_decls():
+    """Get declarations directly from ufcx.h."""
+    file_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(file_dir + "/ufcx.h", "r") as f:
+        ufcx_h = ''.join(f.readlines())
+
+    header = ufcx_h.split("<HEADER_DECL>")[1].split("</HEADER_DECL>")[0].strip(" /\n")
+    header = header.replace("{", "{{").replace("}", "}}")
+    decls = {"ufcx_h": ufcx_h, "UFC_HEADER_DECL": header + "\n"}
+
+    decls["UFC_ELEMENT_DECL"] = '\n'.join(re.findall('typedef struct ufcx_finite_element.*?ufcx_finite_element;',
+                                                     ufcx_h, re.DOTALL))
+    decls["UFC_DOFMAP_DECL"] = '\n'.join(re.findall('typedef struct ufcx_dofmap.*?ufcx_dofmap;', ufcx_h, re.DOTALL))
+    decls["UFC_FORM_DECL"] = '\n'.join(re.findall('typedef struct ufcx_form.*?ufcx_form;', ufcx_h, re.DOTALL))
+
+    integral_decl = ""
+    for np_type in ("float32", "float64", "complex64", "complex128", "longdouble"):
+        integral_decl += '\n'.join(re.findall(rf'typedef void ?\(ufcx_tabulate_tensor_{np_type}\).*?\);',
+                                              ufcx_h, re.DOTALL))
+    for np_type in ("float32", "float64", "longdouble", "complex64", "complex128"):
+        integral_decl += '\n'.join(re.findall(rf'typedef void ?\(ufcx_tabulate_tensor_batch_{np_type}\).*?\);',
+                                              ufcx_h, re.DOTALL))
+    integral_decl += '\n'.join(re.findall('typedef struct ufcx_integral.*?ufcx_integral;', ufcx_h, re.DOTALL))
+    decls["UFC_INTEGRAL_DECL"] = integral_decl
+    decls["UFC_EXPRESSION_DECL"] = '\n'.join(re.findall('typedef struct ufcx_expression.*?ufcx_expression;',
+                                                        ufcx_h, re.DOTALL))
 
-header = ufcx_h.split("<HEADER_DECL>")[1].split("</HEADER_DECL>")[0].strip(" /\n")
-header = header.replace("{", "{{").replace("}", "}}")
-UFC_HEADER_DECL = header + "\n"
+    element_decl = decls["UFC_ELEMENT_DECL"] + decls["UFC_DOFMAP_DECL"]
+    form_decl = element_decl + decls["UFC_INTEGRAL_DECL"] + decls["UFC_FORM_DECL"]
+    decls["elements"] = element_decl
+    decls["forms"] = form_decl
+    decls["expressions"] = form_decl + decls["UFC_EXPRESSION_DECL"]
+    return decls
+
+
+def __getattr__(name):
+    if name in _ufcx_decl_names:
+        return _ufcx_decls()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _compute_decl(kind, scalar_type, object_names):
+    """Return the cffi declarations of a module with the named objects of kind."""
+    decls = _ufcx_decls()
+    decl = decls["UFC_HEADER_DECL"].format(scalar_type) + decls[kind]
+    if kind == "elements":
+        # Elements are paired with their dofmaps
+        type_names = ["ufcx_finite_element", "ufcx_dofmap"] * (len(object_names) // 2)
+    else:
+        type_names = [{"forms": "ufcx_form", "expressions": "ufcx_expression"}[kind]] * len(object_names)
+    for type_name, name in zip(type_names, object_names):
+        decl += f"extern {type_name} {name};\n"
+    return decl
 
-UFC_ELEMENT_DECL = '\n'.join(re.findall('typedef struct ufcx_finite_element.*?ufcx_finite_element;', ufcx_h, re.DOTALL))
-UFC_DOFMAP_DECL = '\n'.join(re.findall('typedef struct ufcx_dofmap.*?ufcx_dofmap;', ufcx_h, re.DOTALL))
-UFC_FORM_DECL = '\n'.join(re.findall('typedef struct ufcx_form.*?ufcx_form;', ufcx_h, re.DOTALL))
 
-UFC_INTEGRAL_DECL = '\n'.join(re.findall(r'typedef void ?\(ufcx_tabulate_tensor_float32\).*?\);', ufcx_h, re.DOTALL))
-UFC_INTEGRAL_DECL += '\n'.join(re.findall(r'typedef void ?\(ufcx_tabulate_tensor_float64\).*?\);', ufcx_h, re.DOTALL))
-UFC_INTEGRAL_DECL += '\n'.join(re.findall(r'typedef void ?\(ufcx_tabulate_tensor_complex64\).*?\);', ufcx_h, re.DOTALL))
-UFC_INTEGRAL_DECL += '\n'.join(re.findall(r'typedef void ?\(ufcx_tabulate_tensor_complex128\).*?\);',
-                               ufcx_h, re.DOTALL))
-UFC_INTEGRAL_DECL += '\n'.join(re.findall(r'typedef void ?\(ufcx_tabulate_tensor_longdouble\).*?\);',
-                               ufcx_h, re.DOTALL))
+def _mode_tag(cffi_mode):
+    """Return the part of module signatures for the cffi mode."""
+    if cffi_mode not in ("api", "abi"):
+        raise ValueError(f"Unknown cffi mode {cffi_mode}, expected 'api' or 'abi'.")
+    # Modules compiled in API mode keep their names
+    return "" if cffi_mode == "api" else ";abi"
 
-UFC_INTEGRAL_DECL += '\n'.join(re.findall('typedef struct ufcx_integral.*?ufcx_integral;',
-                                          ufcx_h, re.DOTALL))
-UFC_EXPRESSION_DECL = '\n'.join(re.findall('typedef struct ufcx_expression.*?ufcx_expression;', ufcx_h, re.DOTALL))
+
+# Modules loaded by this process, as module name -> (cache directory,
+# compiled objects, module)
+_loaded_modules = {}
+
+# Stores of module names of the UFL objects compiled by this process,
+# which live as long as their object: forms keep theirs in their cache,
+# other objects are weakly referenced here, as id -> (weak reference,
+# store). Each object compiled in a module stores its name under a key
+# of the ids of all objects and the compile arguments, see
+# _lookup_module_name.
+_module_name_stores = {}
+
+# Manifests of cache directories read by this process, as cache
+# directory -> (size of manifest file, manifest)
+_manifests = {}
+
+# Cache directory of tiered compilations without one, created once per
+# process, and background processes of tiered builds not yet reaped
+_tiered_cache_dir = None
+_tiered_builds = set()
 
 
 def _compute_parameter_signature(parameters):
     """Return parameters signature (some parameters should not affect signature)."""
-    return str(sorted(parameters.items()))
+    return str(sorted((k, v) for k, v in parameters.items() if k not in ffcx.cache.cache_parameters))
+
+
+def _compute_prefix(kind, parameters):
+    """Return prefix for the names of generated objects.
+
+    The prefix depends on the parameters only, such that objects keep
+    their names, and can reuse their compiled code, when compiled with
+    different objects. Names of objects include a signature of the
+    object.
+    """
+    signature = ";".join([_compute_parameter_signature(parameters), ffcx.__version__,
+                          ffcx.codegeneration.get_signature()])
+    return kind + hashlib.sha1(signature.encode("utf-8")).hexdigest()
+
+
+def _identified_objects(ufl_objects):
+    """Yield the objects identifying a call, with the expressions and points of (expression, points) pairs."""
+    for obj in ufl_objects:
+        if isinstance(obj, tuple):
+            yield from obj
+        else:
+            yield obj
+
+
+def _object_key(ufl_objects, parameters, cffi_extra_compile_args, cffi_debug, cffi_mode):
+    """Return a key identifying the UFL objects by identity, and the resolved parameters and compile arguments."""
+    return (tuple(id(obj) for obj in _identified_objects(ufl_objects)), _compute_parameter_signature(parameters),
+            str(cffi_extra_compile_args), str(cffi_debug), cffi_mode)
+
+
+def _module_name_store(obj):
+    """Return the store of module names of obj, or None if obj can not keep one."""
+    if isinstance(obj, ufl.Form):
+        return obj._cache.setdefault("ffcx_module_names", {})
+
+    entry = _module_name_stores.get(id(obj))
+    if entry is not None and entry[0]() is obj:
+        return entry[1]
+
+    def remove(ref, key=id(obj)):
+        if _module_name_stores.get(key, (None, ))[0] is ref:
+            del _module_name_stores[key]
+
+    try:
+        ref = weakref.ref(obj, remove)
+    except TypeError:
+        return None
+    _module_name_stores[id(obj)] = (ref, {})
+    return _module_name_stores[id(obj)][1]
+
+
+def _lookup_module_name(key, ufl_objects):
+    """Return the module name of UFL objects compiled before with the same key, or None.
+
+    All objects must have stored the name under the key. A store lives
+    as long as its object, so an object created since, with the id of an
+    object of the key, has not.
+    """
+    names = set()
+    for obj in _identified_objects(ufl_objects):
+        store = _module_name_store(obj)
+        if store is None or key not in store:
+            return None
+        names.add(store[key])
+    return names.pop() if len(names) == 1 else None
+
+
+def _remember_module_name(key, ufl_objects, module_name):
+    for obj in _identified_objects(ufl_objects):
+        store = _module_name_store(obj)
+        if store is not None:
+            store[key] = module_name
+
+
+def _loaded_module(module_name, cache_dir):
+    """Return (compiled objects, module) if module_name is loaded in this process, or None.
+
+    The module must have been loaded from cache_dir. Modules compiled
+    without a cache directory, and modules removed from sys.modules, are
+    compiled or loaded again.
+    """
+    loaded = _loaded_modules.get(module_name)
+    if loaded is None or cache_dir is None or sys.modules.get(module_name) is not loaded[2]:
+        return None
+    if str(Path(cache_dir)) != loaded[0]:
+        return None
+    return loaded[1:]
+
+
+class _LockTimeout(Exception):
+    """Raised by the alarm ending a blocking wait for a lock."""
+
 
+def _lock(fd, operation, timeout):
+    """Acquire an advisory lock on a file descriptor, waiting at most timeout seconds.
 
-def get_cached_module(module_name, object_names, cache_dir, timeout):
-    """Look for an existing C file and wait for compilation, or if it does not exist, create it."""
+    Returns True if the lock was acquired. In the main thread, without
+    an interval timer of the program running, the wait blocks in the
+    kernel until an alarm at the timeout, so it ends as soon as the lock
+    is released, including when the owning process dies. Otherwise the
+    lock is polled with exponential backoff (from 1 ms up to 0.1 s).
+    """
+    try:
+        fcntl.flock(fd, operation | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        if timeout <= 0:
+            return False
+
+    if threading.current_thread() is not threading.main_thread() \
+            or signal.getitimer(signal.ITIMER_REAL) != (0.0, 0.0):
+        return _poll_lock(fd, operation, timeout)
+
+    waiting = [True]
+
+    def alarm(signum, frame):
+        if waiting[0]:
+            raise _LockTimeout()
+
+    previous = signal.signal(signal.SIGALRM, alarm)
+    try:
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            fcntl.flock(fd, operation)
+            waiting[0] = False
+            return True
+        except _LockTimeout:
+            # The alarm may have come just after the lock was acquired
+            return _poll_lock(fd, operation, 0)
+        finally:
+            waiting[0] = False
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    finally:
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _poll_lock(fd, operation, timeout):
+    """Acquire an advisory lock by polling with backoff, waiting at most timeout seconds."""
+    deadline = time.monotonic() + timeout
+    delay = 0.001
+    while True:
+        try:
+            fcntl.flock(fd, operation | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(delay, remaining))
+            delay = min(2 * delay, 0.1)
+
+
+def get_cached_module(module_name, object_names, cache_dir, timeout, abi_decl=None):
+    """Look for a compiled module, waiting for a running compilation, or take ownership of compiling it.
+
+    Compilation of a module is guarded by an exclusive advisory lock on
+    the file <module_name>.lock in the cache directory, held by the
+    compiling process until it has published the module (.c.cached) or
+    failed (.c.failed). Other processes block on the lock and wake as
+    soon as it is released. A lock released without either outcome
+    means the owner died, and compilation is taken over.
+
+    Returns
+    -------
+    (compiled objects, module, None) if the module is available, or
+    (None, None, lock) where lock is a file descriptor holding the
+    compile lock, to be closed by the caller once the module is
+    published or the compilation failed.
+
+    Modules compiled in cffi ABI mode are loaded with the declarations
+    abi_decl.
+
+    """
     cache_dir = Path(cache_dir)
     c_filename = cache_dir.joinpath(module_name).with_suffix(".c")
     ready_name = c_filename.with_suffix(".c.cached")
+    failed_name = c_filename.with_suffix(".c.failed")
+
+    lock_name = c_filename.with_suffix(".lock")
+
+    try:
+        # Mark module as recently used, see ffcx.cache.ModuleCache, and
+        # load it from the file listed in the manifest
+        ffcx.cache.mark_used(ready_name)
+        module_file = _lookup_manifest(cache_dir, module_name)
+        return (*_load_objects(cache_dir, module_name, object_names, module_file, abi_decl), None)
+    except (FileNotFoundError, ImportError):
+        # Not compiled yet, or removed from the cache meanwhile
+        pass
 
     # Ensure cache dir exists
     cache_dir.mkdir(exist_ok=True, parents=True)
 
+    t0 = time.time()
+    while True:
+        lock = os.open(lock_name, os.O_RDWR | os.O_CREAT, 0o666)
+        if _lock(lock, fcntl.LOCK_EX, 0):
+            if not _same_file(lock, lock_name):
+                # Lock file was removed from the cache after it was
+                # opened, lock the current one
+                os.close(lock)
+                continue
+
+            if ready_name.exists():
+                # Published since the check above
+                os.close(lock)
+                return (*_load_objects(cache_dir, module_name, object_names, abi_decl=abi_decl), None)
+
+            if c_filename.exists() and not failed_name.exists():
+                logger.info(f"Taking over compilation of {c_filename} from a stale owner.")
+
+            # Take ownership, clearing the outcome of previous attempts
+            c_filename.touch()
+            if failed_name.exists():
+                failed_name.unlink()
+            return None, None, lock
+
+        # Another process is compiling, wait for it to release the lock
+        logger.info(f"Waiting for compilation of {c_filename}.")
+        if not _lock(lock, fcntl.LOCK_SH, max(timeout - (time.time() - t0), 0)):
+            os.close(lock)
+            raise TimeoutError(f"""JIT compilation timed out after {timeout} seconds, waiting for {c_filename}.
+        Try increasing timeout parameter.""")
+        os.close(lock)
+
+        if ready_name.exists():
+            return (*_load_objects(cache_dir, module_name, object_names, abi_decl=abi_decl), None)
+        if failed_name.exists():
+            raise RuntimeError(f"JIT compilation of {c_filename} failed in another process.")
+
+        # Owner died without publishing the module, try to take over
+        logger.info(f"Compilation of {c_filename} was abandoned.")
+
+
+def _record_module(metrics, how):
+    """Record in metrics (if not None) how the module was obtained."""
+    if metrics is not None:
+        metrics["module"] = how
+
+
+def _lookup_manifest(cache_dir, module_name):
+    """Return the path of the compiled module in the manifest of cache_dir, or None.
+
+    The manifest is read on the first lookup, and read again only after
+    it has grown.
+    """
+    size, manifest = _manifests.get(str(cache_dir), (None, {}))
+    filename = manifest.get(module_name)
+    if filename is None:
+        cache = ffcx.cache.ModuleCache(cache_dir)
+        try:
+            new_size = os.stat(cache.path.joinpath(cache.manifest_name)).st_size
+        except FileNotFoundError:
+            return None
+        if new_size != size:
+            manifest = cache.read_manifest()
+            _manifests[str(cache_dir)] = (new_size, manifest)
+            filename = manifest.get(module_name)
+    return filename
+
+
+def _same_file(fd, filename):
+    """Return True if the file descriptor refers to the file filename."""
     try:
-        # Create C file with exclusive access
-        open(c_filename, "x")
-        return None, None
-    except FileExistsError:
-        logger.info("Cached C file already exists: " + str(c_filename))
-        finder = importlib.machinery.FileFinder(
-            str(cache_dir), (importlib.machinery.ExtensionFileLoader, importlib.machinery.EXTENSION_SUFFIXES))
-        finder.invalidate_caches()
-
-        # Now, wait for ready
-        for i in range(timeout):
-            if os.path.exists(ready_name):
-                spec = finder.find_spec(module_name)
-                if spec is None:
-                    raise ModuleNotFoundError("Unable to find JIT module.")
-                compiled_module = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(compiled_module)
-
-                compiled_objects = [getattr(compiled_module.lib, name) for name in object_names]
-                return compiled_objects, compiled_module
-
-            logger.info(f"Waiting for {ready_name} to appear.")
-            time.sleep(1)
-        raise TimeoutError(f"""JIT compilation timed out, probably due to a failed previous compile.
-        Try cleaning cache (e.g. remove {c_filename}) or increase timeout parameter.""")
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return False
+    fstat = os.fstat(fd)
+    return (fstat.st_dev, fstat.st_ino) == (stat.st_dev, stat.st_ino)
 
 
 def compile_elements(elements, parameters=None, cache_dir=None, timeout=10, cffi_extra_compile_args=None,
-                     cffi_verbose=False, cffi_debug=None, cffi_libraries=None):
-    """Compile a list of UFL elements and dofmaps into Python objects."""
+                     cffi_verbose=False, cffi_debug=None, cffi_libraries=None, num_workers=1, cffi_mode="api",
+                     metrics=None):
+    """Compile a list of UFL elements and dofmaps into Python objects.
+
+    With num_workers > 1, each object is compiled in a separate translation
+    unit, using num_workers C compiler processes in parallel.
+
+    With cffi_mode="abi" or metrics, see compile_forms.
+    """
     p = ffcx.parameters.get_parameters(parameters)
 
-    # Get a signature for these elements
+    # Return the module loaded before for the same elements
+    key = _object_key(elements, p, cffi_extra_compile_args, cffi_debug, cffi_mode)
+    loaded = _loaded_module(_lookup_module_name(key, elements), cache_dir)
+    if loaded is not None:
+        _record_module(metrics, "loaded")
+        return list(zip(loaded[0][::2], loaded[0][1::2])), loaded[1], (None, None)
+
+    # Get a signature for these elements, and a prefix for generated
+    # names which does not depend on the elements
+    prefix = _compute_prefix('libffcx_elements_', p)
     module_name = 'libffcx_elements_' + \
-        ffcx.naming.compute_signature(elements, _compute_parameter_signature(p)
-                                      + str(cffi_extra_compile_args) + str(cffi_debug))
+        ffcx.naming.compute_signature(elements, prefix + str(cffi_extra_compile_args) + str(cffi_debug)
+                                      + _mode_tag(cffi_mode))
+    _remember_module_name(key, elements, module_name)
+
+    loaded = _loaded_module(module_name, cache_dir)
+    if loaded is not None:
+        _record_module(metrics, "loaded")
+        return list(zip(loaded[0][::2], loaded[0][1::2])), loaded[1], (None, None)
 
     names = []
     for e in elements:
-        name = ffcx.naming.finite_element_name(e, module_name)
+        name = ffcx.naming.finite_element_name(e, prefix)
         names.append(name)
-        name = ffcx.naming.dofmap_name(e, module_name)
+        name = ffcx.naming.dofmap_name(e, prefix)
         names.append(name)
 
+    if os.environ.get(ffcx.server.socket_variable):
+        remote = _compile_remote("elements", elements, module_name, names, metrics, parameters=p, cache_dir=cache_dir,
+                                 timeout=timeout, cffi_extra_compile_args=cffi_extra_compile_args,
+                                 cffi_verbose=cffi_verbose, cffi_debug=cffi_debug, cffi_libraries=cffi_libraries,
+                                 num_workers=num_workers, cffi_mode=cffi_mode)
+        if remote is not None:
+            obj, mod, code = remote
+            # Pair up elements with dofmaps
+            return list(zip(obj[::2], obj[1::2])), mod, code
+
+    decl = _compute_decl("elements", p["scalar_type"], names)
+    abi_decl = decl if cffi_mode == "abi" else None
+
     if cache_dir is not None:
         cache_dir = Path(cache_dir)
-        obj, mod = get_cached_module(module_name, names, cache_dir, timeout)
+        with ffcx.metrics.stage(metrics, "load"):
+            obj, mod, lock = get_cached_module(module_name, names, cache_dir, timeout, abi_decl)
         if obj is not None:
+            _record_module(metrics, "cached")
             # Pair up elements with dofmaps
             obj = list(zip(obj[::2], obj[1::2]))
             return obj, mod, (None, None)
     else:
         cache_dir = Path(tempfile.mkdtemp())
+        lock = None
 
     try:
-        decl = UFC_HEADER_DECL.format(p["scalar_type"]) + UFC_ELEMENT_DECL + UFC_DOFMAP_DECL
-        element_template = "extern ufcx_finite_element {name};\n"
-        dofmap_template = "extern ufcx_dofmap {name};\n"
-        for i in range(len(elements)):
-            decl += element_template.format(name=names[i * 2])
-            decl += dofmap_template.format(name=names[i * 2 + 1])
-
-        impl = _compile_objects(decl, elements, names, module_name, p, cache_dir,
-                                cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries)
+        impl = _compile_objects(decl, elements, names, module_name, prefix, p, cache_dir,
+                                cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries, num_workers,
+                                cffi_mode, metrics)
     except Exception:
-        # remove c file so that it will not timeout next time
+        # Mark compilation as failed, for processes waiting on the lock
         c_filename = cache_dir.joinpath(module_name + ".c")
         os.replace(c_filename, c_filename.with_suffix(".c.failed"))
         raise
+    finally:
+        if lock is not None:
+            os.close(lock)
 
-    objects, module = _load_objects(cache_dir, module_name, names)
+    with ffcx.metrics.stage(metrics, "load"):
+        objects, module = _load_objects(cache_dir, module_name, names, abi_decl=abi_decl)
+    _record_module(metrics, "compiled")
     # Pair up elements with dofmaps
     objects = list(zip(objects[::2], objects[1::2]))
     return objects, module, (decl, impl)
 
 
 def compile_forms(forms, parameters=None, cache_dir=None, timeout=10, cffi_extra_compile_args=None,
-                  cffi_verbose=False, cffi_debug=None, cffi_libraries=None):
-    """Compile a list of UFL forms into UFC Python objects."""
+                  cffi_verbose=False, cffi_debug=None, cffi_libraries=None, num_workers=1,
+                  tiered=False, cffi_mode="api", metrics=None):
+    """Compile a list of UFL forms into UFC Python objects.
+
+    A module loaded before by this process from cache_dir for the same
+    forms is returned directly. Passing the same form objects again also
+    skips computing their signature.
+
+    With num_workers > 1, each object is compiled in a separate translation
+    unit, using num_workers C compiler processes in parallel.
+
+    With tiered=True, a module compiled without optimization (-O0) is
+    returned, and the module with the given compiler arguments is built
+    in a background process. The attribute optimized_build of the
+    returned module is an OptimizedBuild handle, which loads the
+    optimized module when it is ready. Later calls return the optimized
+    module once it is built. Without
+    cache_dir, both modules are compiled in a temporary directory shared
+    by the tiered compilations of the process.
+
+    With cffi_mode="abi", the generated code is compiled into a plain
+    shared library, without a Python extension wrapper, which is loaded
+    with cffi in ABI mode (ffi.dlopen). The library does not depend on
+    the Python version, and can be loaded by other programs. The module
+    returned has the attributes ffi and lib, as modules compiled in the
+    default cffi API mode.
+
+    If metrics is a dict, it is filled in with the metrics of the
+    compiler stages, the C compilation and the loading of the module
+    (see ffcx.metrics).
+    """
     p = ffcx.parameters.get_parameters(parameters)
 
-    # Get a signature for these forms
+    # Return the module loaded before for the same forms
+    key = _object_key(forms, p, cffi_extra_compile_args, cffi_debug, cffi_mode)
+    loaded = None if tiered else _loaded_module(_lookup_module_name(key, forms), cache_dir)
+    if loaded is not None:
+        _record_module(metrics, "loaded")
+        return (*loaded, (None, None))
+
+    # Get a signature for these forms, and a prefix for generated names
+    # which does not depend on the forms
+    prefix = _compute_prefix('libffcx_forms_', p)
     module_name = 'libffcx_forms_' + \
-        ffcx.naming.compute_signature(forms, _compute_parameter_signature(p)
-                                      + str(cffi_extra_compile_args) + str(cffi_debug))
+        ffcx.naming.compute_signature(forms, prefix + str(cffi_extra_compile_args) + str(cffi_debug)
+                                      + _mode_tag(cffi_mode))
+    _remember_module_name(key, forms, module_name)
+
+    loaded = None if tiered else _loaded_module(module_name, cache_dir)
+    if loaded is not None:
+        _record_module(metrics, "loaded")
+        return (*loaded, (None, None))
+
+    form_names = [ffcx.naming.form_name(form, i, prefix) for i, form in enumerate(forms)]
+
+    if tiered:
+        return _compile_tiered("forms", forms, module_name, form_names, metrics, parameters=p, cache_dir=cache_dir,
+                               timeout=timeout, cffi_extra_compile_args=cffi_extra_compile_args,
+                               cffi_verbose=cffi_verbose, cffi_debug=cffi_debug, cffi_libraries=cffi_libraries,
+                               num_workers=num_workers, cffi_mode=cffi_mode)
 
-    form_names = [ffcx.naming.form_name(form, i, module_name) for i, form in enumerate(forms)]
+    if os.environ.get(ffcx.server.socket_variable):
+        remote = _compile_remote("forms", forms, module_name, form_names, metrics, parameters=p, cache_dir=cache_dir,
+                                 timeout=timeout, cffi_extra_compile_args=cffi_extra_compile_args,
+                                 cffi_verbose=cffi_verbose, cffi_debug=cffi_debug, cffi_libraries=cffi_libraries,
+                                 num_workers=num_workers, cffi_mode=cffi_mode)
+        if remote is not None:
+            return remote
+
+    decl = _compute_decl("forms", p["scalar_type"], form_names)
+    abi_decl = decl if cffi_mode == "abi" else None
 
     if cache_dir is not None:
         cache_dir = Path(cache_dir)
-        obj, mod = get_cached_module(module_name, form_names, cache_dir, timeout)
+        with ffcx.metrics.stage(metrics, "load"):
+            obj, mod, lock = get_cached_module(module_name, form_names, cache_dir, timeout, abi_decl)
         if obj is not None:
+            _record_module(metrics, "cached")
             return obj, mod, (None, None)
     else:
         cache_dir = Path(tempfile.mkdtemp())
+        lock = None
 
     try:
-        decl = UFC_HEADER_DECL.format(p["scalar_type"]) + UFC_ELEMENT_DECL + UFC_DOFMAP_DECL + \
-            UFC_INTEGRAL_DECL + UFC_FORM_DECL
-
-        form_template = "extern ufcx_form {name};\n"
-        for name in form_names:
-            decl += form_template.format(name=name)
-
-        impl = _compile_objects(decl, forms, form_names, module_name, p, cache_dir,
-                                cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries)
+        impl = _compile_objects(decl, forms, form_names, module_name, prefix, p, cache_dir,
+                                cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries, num_workers,
+                                cffi_mode, metrics)
     except Exception:
-        # remove c file so that it will not timeout next time
+        # Mark compilation as failed, for processes waiting on the lock
         c_filename = cache_dir.joinpath(module_name + ".c")
         os.replace(c_filename, c_filename.with_suffix(".c.failed"))
         raise
+    finally:
+        if lock is not None:
+            os.close(lock)
 
-    obj, module = _load_objects(cache_dir, module_name, form_names)
+    with ffcx.metrics.stage(metrics, "load"):
+        obj, module = _load_objects(cache_dir, module_name, form_names, abi_decl=abi_decl)
+    _record_module(metrics, "compiled")
     return obj, module, (decl, impl)
 
 
 def compile_expressions(expressions, parameters=None, cache_dir=None, timeout=10, cffi_extra_compile_args=None,
-                        cffi_verbose=False, cffi_debug=None, cffi_libraries=None):
+                        cffi_verbose=False, cffi_debug=None, cffi_libraries=None, num_workers=1,
+                        tiered=False, cffi_mode="api", metrics=None):
     """Compile a list of UFL expressions into UFC Python objects.
 
     Parameters
     ----------
     expressions
         List of (UFL expression, evaluation points).
+    num_workers
+        Number of parallel C compiler processes. With more than one, each
+        object is compiled in a separate translation unit.
+    tiered
+        Return a module compiled without optimization, with an
+        OptimizedBuild handle (attribute optimized_build) to the module
+        with the given compiler arguments, which is built in the
+        background (see compile_forms).
+    cffi_mode
+        "api" to compile a Python extension module, or "abi" to compile
+        a plain shared library (see compile_forms).
+    metrics
+        Dict filled in with the metrics of the compilation (see
+        compile_forms).
 
     """
     p = ffcx.parameters.get_parameters(parameters)
 
+    # Return the module loaded before for the same expressions
+    key = _object_key(expressions, p, cffi_extra_compile_args, cffi_debug, cffi_mode)
+    loaded = None if tiered else _loaded_module(_lookup_module_name(key, expressions), cache_dir)
+    if loaded is not None:
+        _record_module(metrics, "loaded")
+        return (*loaded, (None, None))
+
+    prefix = _compute_prefix('libffcx_expressions_', p)
     module_name = 'libffcx_expressions_' + \
-        ffcx.naming.compute_signature(expressions, _compute_parameter_signature(p)
-                                      + str(cffi_extra_compile_args) + str(cffi_debug))
-    expr_names = [ffcx.naming.expression_name(expression, module_name) for expression in expressions]
+        ffcx.naming.compute_signature(expressions, prefix + str(cffi_extra_compile_args) + str(cffi_debug)
+                                      + _mode_tag(cffi_mode))
+    _remember_module_name(key, expressions, module_name)
+
+    loaded = None if tiered else _loaded_module(module_name, cache_dir)
+    if loaded is not None:
+        _record_module(metrics, "loaded")
+        return (*loaded, (None, None))
+    expr_names = [ffcx.naming.expression_name(expression, prefix) for expression in expressions]
+
+    if tiered:
+        return _compile_tiered("expressions", expressions, module_name, expr_names, metrics, parameters=p,
+                               cache_dir=cache_dir, timeout=timeout, cffi_extra_compile_args=cffi_extra_compile_args,
+                               cffi_verbose=cffi_verbose, cffi_debug=cffi_debug, cffi_libraries=cffi_libraries,
+                               num_workers=num_workers, cffi_mode=cffi_mode)
+
+    if os.environ.get(ffcx.server.socket_variable):
+        remote = _compile_remote("expressions", expressions, module_name, expr_names, metrics, parameters=p,
+                                 cache_dir=cache_dir, timeout=timeout, cffi_extra_compile_args=cffi_extra_compile_args,
+                                 cffi_verbose=cffi_verbose, cffi_debug=cffi_debug, cffi_libraries=cffi_libraries,
+                                 num_workers=num_workers, cffi_mode=cffi_mode)
+        if remote is not None:
+            return remote
+
+    decl = _compute_decl("expressions", p["scalar_type"], expr_names)
+    abi_decl = decl if cffi_mode == "abi" else None
 
     if cache_dir is not None:
         cache_dir = Path(cache_dir)
-        obj, mod = get_cached_module(module_name, expr_names, cache_dir, timeout)
+        with ffcx.metrics.stage(metrics, "load"):
+            obj, mod, lock = get_cached_module(module_name, expr_names, cache_dir, timeout, abi_decl)
         if obj is not None:
+            _record_module(metrics, "cached")
             return obj, mod, (None, None)
     else:
         cache_dir = Path(tempfile.mkdtemp())
+        lock = None
 
     try:
-        decl = UFC_HEADER_DECL.format(p["scalar_type"]) + UFC_ELEMENT_DECL + UFC_DOFMAP_DECL + \
-            UFC_INTEGRAL_DECL + UFC_FORM_DECL + UFC_EXPRESSION_DECL
-
-        expression_template = "extern ufcx_expression {name};\n"
-        for name in expr_names:
-            decl += expression_template.format(name=name)
-
-        impl = _compile_objects(decl, expressions, expr_names, module_name, p, cache_dir,
-                                cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries)
+        impl = _compile_objects(decl, expressions, expr_names, module_name, prefix, p, cache_dir,
+                                cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries, num_workers,
+                                cffi_mode, metrics)
     except Exception:
-        # remove c file so that it will not timeout next time
+        # Mark compilation as failed, for processes waiting on the lock
         c_filename = cache_dir.joinpath(module_name + ".c")
         os.replace(c_filename, c_filename.with_suffix(".c.failed"))
         raise
+    finally:
+        if lock is not None:
+            os.close(lock)
 
-    obj, module = _load_objects(cache_dir, module_name, expr_names)
+    with ffcx.metrics.stage(metrics, "load"):
+        obj, module = _load_objects(cache_dir, module_name, expr_names, abi_decl=abi_decl)
+    _record_module(metrics, "compiled")
     return obj, module, (decl, impl)
 
 
-def _compile_objects(decl, ufl_objects, object_names, module_name, parameters, cache_dir,
-                     cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries):
+class OptimizedBuild(object):
+    """Handle to the optimized module of a tiered compilation, built in a background process.
 
-    import ffcx.compiler
+    If the build could not be started, error is the reason, and the
+    optimized module never becomes ready.
+    """
 
-    # JIT uses module_name as prefix, which is needed to make names of all struct/function
-    # unique across modules
-    _, code_body = ffcx.compiler.compile_ufl_objects(ufl_objects, prefix=module_name, parameters=parameters)
+    def __init__(self, kind, ufl_objects, module_name, object_names, kwargs):
+        self.kind = kind
+        self.ufl_objects = ufl_objects
+        self.module_name = module_name
+        self.object_names = object_names
+        self.kwargs = kwargs
+        self.process = None
+        self.result = None
+        self.error = None
 
-    ffibuilder = cffi.FFI()
-    ffibuilder.set_source(module_name, code_body, include_dirs=[ffcx.codegeneration.get_include_path()],
-                          extra_compile_args=cffi_extra_compile_args, libraries=cffi_libraries)
-    ffibuilder.cdef(decl)
+    @property
+    def ready_name(self):
+        return Path(self.kwargs["cache_dir"]).joinpath(self.module_name).with_suffix(".c.cached")
 
-    c_filename = cache_dir.joinpath(module_name + ".c")
-    ready_name = c_filename.with_suffix(".c.cached")
+    def start(self):
+        """Start the build in a background process, unless the objects cannot be pickled."""
+        try:
+            data = pickle.dumps({"kind": self.kind, "objects": self.ufl_objects, "kwargs": self.kwargs},
+                                protocol=pickle.HIGHEST_PROTOCOL)
+        except ffcx.server.pickling_errors as e:
+            self.error = f"objects cannot be pickled ({e})"
+            logger.warning(f"Optimized build of {self.module_name} not started: {self.error}.")
+            return
+
+        _reap_tiered_builds()
+        self.process = subprocess.Popen([sys.executable, "-c", "import ffcx.codegeneration.jit, sys; "
+                                         "ffcx.codegeneration.jit._compile_pickled(sys.stdin.buffer)"],
+                                        stdin=subprocess.PIPE)
+        _tiered_builds.add(self.process)
+        self.process.stdin.write(data)
+        self.process.stdin.close()
+
+    def ready(self):
+        """Return True if the optimized module is built."""
+        _reap_tiered_builds()
+        return self.ready_name.exists()
+
+    def upgrade(self, wait=False):
+        """Return (compiled objects, module) of the optimized module, or None if it is not ready.
+
+        With wait=True, wait for the build to finish, and raise
+        RuntimeError if it failed or was not started.
+        """
+        if self.result is None:
+            if wait and self.error is not None:
+                raise RuntimeError(f"Optimized build of {self.module_name} not started: {self.error}.")
+            if wait and self.process is not None and self.process.wait() != 0 and not self.ready():
+                raise RuntimeError(f"Optimized build of {self.module_name} failed.")
+            if self.ready():
+                self.result = _load_objects(Path(self.kwargs["cache_dir"]), self.module_name, self.object_names,
+                                            abi_decl=_abi_decl(self.kind, self.object_names, self.kwargs))
+        return self.result
+
+    __call__ = upgrade
+
+
+def _reap_tiered_builds():
+    """Reap the background processes of tiered builds which have finished."""
+    for process in list(_tiered_builds):
+        if process.poll() is not None:
+            _tiered_builds.discard(process)
+
+
+def _compile_tiered(kind, ufl_objects, module_name, object_names, metrics, **kwargs):
+    """Compile objects without optimization, and start building the optimized module in the background.
+
+    The OptimizedBuild handle is set as the attribute optimized_build of
+    the returned module.
+    """
+    global _tiered_cache_dir
+    compile_objects = {"forms": compile_forms, "expressions": compile_expressions}[kind]
+
+    # Both tiers are compiled in the same cache directory, which is
+    # shared by all tiered compilations of this process without one, so
+    # that their modules are found again
+    if kwargs["cache_dir"] is None:
+        if _tiered_cache_dir is None:
+            _tiered_cache_dir = tempfile.mkdtemp(prefix="ffcx-tiered-")
+        kwargs["cache_dir"] = _tiered_cache_dir
+    kwargs["cache_dir"] = str(kwargs["cache_dir"])
+
+    optimized = OptimizedBuild(kind, ufl_objects, module_name, object_names, kwargs)
+    result = optimized()
+    if result is not None:
+        _record_module(metrics, "cached")
+        objects, module = result
+        module.optimized_build = optimized
+        return objects, module, (None, None)
+
+    fast_kwargs = {**kwargs, "cffi_extra_compile_args": list(kwargs["cffi_extra_compile_args"] or []) + ["-O0"]}
+    objects, module, code = compile_objects(ufl_objects, metrics=metrics, **fast_kwargs)
+    optimized.start()
+    module.optimized_build = optimized
+    return objects, module, code
+
+
+def _compile_pickled(stream):
+    """Compile the objects of a pickled request from stream."""
+    message = pickle.load(stream)
+    compile_objects = {"elements": compile_elements, "forms": compile_forms,
+                       "expressions": compile_expressions}[message["kind"]]
+    compile_objects(message["objects"], **message["kwargs"])
+
+
+def _abi_decl(kind, object_names, kwargs):
+    """Return the declarations for loading a module compiled with the arguments kwargs in ABI mode, or None."""
+    if kwargs.get("cffi_mode", "api") != "abi":
+        return None
+    return _compute_decl(kind, kwargs["parameters"]["scalar_type"], object_names)
+
+
+def _compile_remote(kind, ufl_objects, module_name, object_names, metrics, **kwargs):
+    """Compile objects in the compile server, and load the module.
+
+    Returns None if the server is not available, or if the objects
+    cannot be pickled.
+    """
+    socket_path = os.environ[ffcx.server.socket_variable]
+    message = {"version": ffcx.__version__, "kind": kind, "objects": ufl_objects,
+               "kwargs": {**kwargs, "cache_dir": None if kwargs["cache_dir"] is None else str(kwargs["cache_dir"])}}
+    try:
+        data = ffcx.server.dumps(message)
+    except ffcx.server.pickling_errors as e:
+        logger.warning(f"Objects cannot be sent to the FFCx compile server ({e}), compiling locally.")
+        return None
+    try:
+        with ffcx.metrics.stage(metrics, "remote"):
+            response = ffcx.server.request(socket_path, data)
+    except OSError as e:
+        logger.warning(f"FFCx compile server at {socket_path} not available ({e}), compiling locally.")
+        return None
+
+    if "refused" in response:
+        logger.warning(f"FFCx compile server at {socket_path} refused request ({response['refused']}), "
+                       "compiling locally.")
+        return None
+    if "error" in response:
+        raise response["error"]
+
+    module_file = Path(response["module"])
+    with ffcx.metrics.stage(metrics, "load"):
+        objects, module = _load_objects(module_file.parent, module_name, object_names, module_file,
+                                        _abi_decl(kind, object_names, kwargs))
+    _record_module(metrics, "remote")
+    return objects, module, response["code"]
+
+
+def _compile_objects(decl, ufl_objects, object_names, module_name, prefix, parameters, cache_dir,
+                     cffi_extra_compile_args, cffi_verbose, cffi_debug, cffi_libraries, num_workers, cffi_mode="api",
+                     metrics=None):
+
+    import ffcx.compiler
+
+    # Names of all struct/function are unique across modules with
+    # different code, as they include signatures of the objects and of
+    # the parameters (through the prefix). Modules which differ only in
+    # the C compiler arguments share the code, which can then be taken
+    # from the code cache.
+    code = ffcx.compiler.generate_ufl_code(ufl_objects, prefix=prefix, parameters=parameters, metrics=metrics)
+    with ffcx.metrics.stage(metrics, "formatting"):
+        code_h, code_body = ffcx.formatting.format_code(code, parameters)
+    if metrics is not None:
+        metrics["code_bytes"] = {"h": len(code_h), "c": len(code_body)}
 
     # Compile (ensuring that compile dir exists)
     cache_dir.mkdir(exist_ok=True, parents=True)
 
+    if num_workers > 1:
+        # Compile each object in a separate translation unit, in
+        # parallel, and link the object files into the module
+        source, units = ffcx.formatting.format_code_units(code, parameters)
+        objects = _compile_units(units, cache_dir, cffi_extra_compile_args, cffi_debug, num_workers)
+    else:
+        source, objects = code_body, []
+
+    c_filename = cache_dir.joinpath(module_name + ".c")
+    ready_name = c_filename.with_suffix(".c.cached")
+
     logger.info(79 * "#")
     logger.info("Calling JIT C compiler")
     logger.info(79 * "#")
 
     t0 = time.time()
-    f = io.StringIO()
-    with redirect_stdout(f):
-        ffibuilder.compile(tmpdir=cache_dir, verbose=True, debug=cffi_debug)
-    s = f.getvalue()
+    with ffcx.metrics.stage(metrics, "compile"):
+        if cffi_mode == "abi":
+            module_file = _compile_library(module_name, source, objects, cache_dir, cffi_extra_compile_args,
+                                           cffi_debug, cffi_libraries)
+            s = f"Compiled {module_file} for cffi ABI mode.\n"
+        else:
+            import cffi
+            ffibuilder = cffi.FFI()
+            ffibuilder.set_source(module_name, source, include_dirs=[ffcx.codegeneration.get_include_path()],
+                                  extra_compile_args=cffi_extra_compile_args, libraries=cffi_libraries,
+                                  extra_objects=objects)
+            ffibuilder.cdef(decl)
+
+            f = io.StringIO()
+            with redirect_stdout(f):
+                module_file = ffibuilder.compile(tmpdir=cache_dir, verbose=True, debug=cffi_debug)
+            s = f.getvalue()
     if (cffi_verbose):
         print(s)
 
@@ -263,29 +903,152 @@ def _compile_objects(decl, ufl_objects, object_names, module_name, parameters, c
     fd.write(s)
     fd.close()
 
+    # Publish the module in the manifest, and remove least recently used
+    # modules beyond the limits of the cache
+    cache = ffcx.cache.get_module_cache(cache_dir, parameters)
+    cache.add_to_manifest([(module_name, module_file)])
+    cache.evict()
+
     return code_body
 
 
-def _load_objects(cache_dir, module_name, object_names):
+def _new_compiler():
+    """Return a C compiler with the configuration of the Python build, as used by cffi."""
+    # distutils is provided by setuptools on Python >= 3.12, which cffi
+    # requires for compiling too
+    import setuptools  # noqa: F401
+    from distutils.ccompiler import new_compiler
+    from distutils.sysconfig import customize_compiler
+    compiler = new_compiler()
+    customize_compiler(compiler)
+
+    # Name objects after the base names of their sources in output_dir,
+    # rather than after their absolute paths below output_dir
+    object_filenames = compiler.object_filenames
+    compiler.object_filenames = lambda sources, strip_dir=0, output_dir="": \
+        object_filenames(sources, strip_dir=1, output_dir=output_dir)
+    return compiler
+
+
+def _compile_library(module_name, source, objects, cache_dir, cffi_extra_compile_args, cffi_debug,
+                     cffi_libraries):
+    """Compile C source, linked with object files, into the plain shared library <module_name>.so.
+
+    Returns the path of the library.
+    """
+    compiler = _new_compiler()
+    # Build even if the outputs (the placeholder below) are newer
+    compiler.force = True
+    cache_dir = cache_dir.resolve()
+    c_filename = cache_dir.joinpath(module_name + ".c")
+    with open(c_filename, "w") as f:
+        f.write(source)
+
+    # Link under a unique name and move into place, so that the library is
+    # complete once it can be found
+    library = cache_dir.joinpath(module_name + ".so")
+    fd, tmp_library = tempfile.mkstemp(dir=cache_dir, prefix=module_name + "_", suffix=".so")
+    os.close(fd)
+    try:
+        module_objects = compiler.compile([str(c_filename)], output_dir=str(cache_dir),
+                                          include_dirs=[ffcx.codegeneration.get_include_path()],
+                                          debug=bool(cffi_debug), extra_postargs=cffi_extra_compile_args)
+        compiler.link_shared_object(module_objects + objects, tmp_library, libraries=cffi_libraries,
+                                    debug=bool(cffi_debug))
+        os.replace(tmp_library, library)
+    finally:
+        if os.path.exists(tmp_library):
+            os.unlink(tmp_library)
+    return str(library)
+
+
+def _compile_units(units, cache_dir, cffi_extra_compile_args, cffi_debug, num_workers):
+    """Compile translation units to object files with num_workers concurrent compiler processes.
+
+    Object files are named by a signature of the source and the
+    compiler arguments, and are reused if present in the cache
+    directory. Hence after changes to some objects, only their
+    translation units are recompiled.
+    """
+    # Use the compiler configuration of the Python build, as cffi does
+    compiler = _new_compiler()
+    cache_dir = cache_dir.resolve()
+
+    def compile_unit(unit):
+        signature = hashlib.sha1(";".join([unit, str(cffi_extra_compile_args), str(cffi_debug)]).encode("utf-8"))
+        obj = cache_dir.joinpath(f"ffcx_unit_{signature.hexdigest()}.o")
+        if obj.exists():
+            # Mark object as recently used
+            os.utime(obj)
+            return str(obj), False
+
+        # Compile under a unique name and move into place, so that
+        # concurrent compilations of the same unit do not interfere
+        fd, source = tempfile.mkstemp(dir=cache_dir, prefix=obj.stem + "_", suffix=".c")
+        with os.fdopen(fd, "w") as f:
+            f.write(unit)
+        source = Path(source)
+        try:
+            [tmp_obj] = compiler.compile([str(source)], output_dir=str(cache_dir),
+                                         include_dirs=[ffcx.codegeneration.get_include_path()],
+                                         debug=bool(cffi_debug), extra_postargs=cffi_extra_compile_args)
+            os.replace(tmp_obj, obj)
+        finally:
+            source.unlink()
+        return str(obj), True
 
-    # Create module finder that searches the compile path
-    finder = importlib.machinery.FileFinder(
-        str(cache_dir), (importlib.machinery.ExtensionFileLoader, importlib.machinery.EXTENSION_SUFFIXES))
+    t0 = time.time()
+    with concurrent.futures.ThreadPoolExecutor(num_workers) as executor:
+        objects, compiled = zip(*executor.map(compile_unit, units))
+    logger.info(f"Compiled {sum(compiled)} of {len(units)} translation units with {num_workers} workers "
+                f"in {time.time() - t0:.4f}")
+    return list(objects)
+
+
+def _load_objects(cache_dir, module_name, object_names, module_file=None, abi_decl=None):
+
+    if abi_decl is not None:
+        # Load plain shared library in cffi ABI mode, into a module with
+        # the attributes of modules compiled in API mode
+        if module_file is None:
+            module_file = cache_dir.joinpath(module_name + ".so")
+        import cffi
+        ffi = cffi.FFI()
+        ffi.cdef(abi_decl)
+        try:
+            lib = ffi.dlopen(str(module_file))
+        except OSError as e:
+            raise ImportError(f"Unable to load JIT library {module_file}: {e}") from e
+        compiled_module = types.ModuleType(module_name)
+        compiled_module.__file__ = str(module_file)
+        compiled_module.ffi = ffi
+        compiled_module.lib = lib
+        sys.modules[module_name] = compiled_module
+    else:
+        if module_file is not None:
+            # Load module from known file
+            loader = importlib.machinery.ExtensionFileLoader(module_name, str(module_file))
+            spec = importlib.util.spec_from_file_location(module_name, str(module_file), loader=loader)
+        else:
+            # Create module finder that searches the compile path
+            finder = importlib.machinery.FileFinder(
+                str(cache_dir), (importlib.machinery.ExtensionFileLoader, importlib.machinery.EXTENSION_SUFFIXES))
 
-    # Find module. Clear search cache to be sure dynamically created
-    # (new) modules are found
-    finder.invalidate_caches()
-    spec = finder.find_spec(module_name)
-    if spec is None:
-        raise ModuleNotFoundError("Unable to find JIT module.")
+            # Find module. Clear search cache to be sure dynamically created
+            # (new) modules are found
+            finder.invalidate_caches()
+            spec = finder.find_spec(module_name)
+            if spec is None:
+                raise ModuleNotFoundError("Unable to find JIT module.")
 
-    # Load module
-    compiled_module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(compiled_module)
+        # Load module
+        compiled_module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(compiled_module)
 
     compiled_objects = []
     for name in object_names:
         obj = getattr(compiled_module.lib, name)
         compiled_objects.append(obj)
 
+    _loaded_modules[module_name] = (str(cache_dir), compiled_objects, compiled_module)
     return compiled_objects, compiled_module
@@ -70,6 +70,10 @@ class FFCXBackendSymbols(object):
 
         self.original_constant_offsets = original_constant_offsets
 
+        # Point maps and permutation indices of the permuted quadrature
+        # points looked up in unpermuted tables, see element_table
+        self.permuted_points = set()
+
     def element_tensor(self):
         """Symbol for the element tensor itself."""
         return self.S("A")
@@ -80,12 +84,12 @@ class FFCXBackendSymbols(object):
             # Always 0 for cells (even with restriction)
             return self.L.LiteralInt(0)
         elif entitytype == "facet":
-            postfix = "[0]"
+            index = 0
             if restriction == "-":
-                postfix = "[1]"
-            return self.S("entity_local_index" + postfix)
+                index = 1
+            return self.S("entity_local_index")[index]
         elif entitytype == "vertex":
-            return self.S("entity_local_index[0]")
+            return self.S("entity_local_index")[0]
         else:
             logging.exception(f"Unknown entitytype {entitytype}")
 
@@ -106,6 +110,10 @@ class FFCXBackendSymbols(object):
         """Quadrature permutation, as input to the function."""
         return self.S("quadrature_permutation")[index]
 
+    def permuted_quadrature_loop_index(self, index):
+        """Index of the quadrature point in unpermuted tables, for the permutation of restriction index."""
+        return self.S(f"iq_perm{index}")
+
     def custom_weights_table(self):
         """Table for chunk of custom quadrature weights (including cell measure scaling)."""
         return self.S("weights_chunk")
@@ -194,5 +202,11 @@ class FFCXBackendSymbols(object):
         else:
             qp = 0
 
+        if tabledata.point_map is not None:
+            # Look up the permuted point in the unpermuted table
+            index = 1 if restriction == "-" else 0
+            self.permuted_points.add((tabledata.point_map, index))
+            return self.named_table(tabledata.name)[0][entity][self.permuted_quadrature_loop_index(index)]
+
         # Return direct access to element table
         return self.named_table(tabledata.name)[qp][entity][iq]
@@ -309,6 +309,72 @@ extern "C"
       const int* restrict entity_local_index,
       const uint8_t* restrict quadrature_permutation);
 
+  /// Tabulate integral into tensors A for a batch of cells with
+  /// compiled quadrature rule and single precision
+  ///
+  /// All arrays are stored in structure-of-arrays layout with the cell
+  /// index running fastest, i.e. entry k of the per-cell array for cell
+  /// n is found at index k * num_cells + n. The per-cell dimensions are
+  /// as for ufcx_tabulate_tensor_float32.
+  ///
+  /// @param[in] num_cells Number of cells in the batch
+  /// @param[out] A Dimensions: A[entry][num_cells]
+  /// @param[in] w Dimensions: w[coefficient dof][num_cells]
+  /// @param[in] c Dimensions: c[constant value][num_cells]
+  /// @param[in] coordinate_dofs Dimensions:
+  /// coordinate_dofs[restriction * num_dofs * 3][num_cells]
+  /// @param[in] entity_local_index Dimensions:
+  /// entity_local_index[restriction][num_cells]
+  /// @param[in] quadrature_permutation Dimensions:
+  /// quadrature_permutation[restriction][num_cells]
+  ///
+  /// @see ufcx_tabulate_tensor_float32
+  typedef void(ufcx_tabulate_tensor_batch_float32)(
+      int num_cells, float* restrict A, const float* restrict w,
+      const float* restrict c, const double* restrict coordinate_dofs,
+      const int* restrict entity_local_index,
+      const uint8_t* restrict quadrature_permutation);
+
+  /// Tabulate integral into tensors A for a batch of cells with
+  /// compiled quadrature rule and double precision
+  ///
+  /// @see ufcx_tabulate_tensor_batch_float32
+  typedef void(ufcx_tabulate_tensor_batch_float64)(
+      int num_cells, double* restrict A, const double* restrict w,
+      const double* restrict c, const double* restrict coordinate_dofs,
+      const int* restrict entity_local_index,
+      const uint8_t* restrict quadrature_permutation);
+
+  /// Tabulate integral into tensors A for a batch of cells with
+  /// compiled quadrature rule and extended double precision
+  ///
+  /// @see ufcx_tabulate_tensor_batch_float32
+  typedef void(ufcx_tabulate_tensor_batch_longdouble)(
+      int num_cells, long double* restrict A, const long double* restrict w,
+      const long double* restrict c, const double* restrict coordinate_dofs,
+      const int* restrict entity_local_index,
+      const uint8_t* restrict quadrature_permutation);
+
+  /// Tabulate integral into tensors A for a batch of cells with
+  /// compiled quadrature rule and complex single precision
+  ///
+  /// @see ufcx_tabulate_tensor_batch_float32
+  typedef void(ufcx_tabulate_tensor_batch_complex64)(
+      int num_cells, float _Complex* restrict A, const float _Complex* restrict w,
+      const float _Complex* restrict c, const double* restrict coordinate_dofs,
+      const int* restrict entity_local_index,
+      const uint8_t* restrict quadrature_permutation);
+
+  /// Tabulate integral into tensors A for a batch of cells with
+  /// compiled quadrature rule and complex double precision
+  ///
+  /// @see ufcx_tabulate_tensor_batch_float32
+  typedef void(ufcx_tabulate_tensor_batch_complex128)(
+      int num_cells, double _Complex* restrict A, const double _Complex* restrict w,
+      const double _Complex* restrict c, const double* restrict coordinate_dofs,
+      const int* restrict entity_local_index,
+      const uint8_t* restrict quadrature_permutation);
+
   typedef struct ufcx_integral
   {
     const bool* enabled_coefficients;
@@ -321,6 +387,14 @@ extern "C"
 
     /// Get the coordinate element associated with the geometry of the mesh.
     ufcx_finite_element* coordinate_element;
+
+    /// Batched (structure-of-arrays) kernels, NULL if not generated.
+    /// Appended so that the members above keep their offsets.
+    ufcx_tabulate_tensor_batch_float32* tabulate_tensor_batch_float32;
+    ufcx_tabulate_tensor_batch_float64* tabulate_tensor_batch_float64;
+    ufcx_tabulate_tensor_batch_longdouble* tabulate_tensor_batch_longdouble;
+    ufcx_tabulate_tensor_batch_complex64* tabulate_tensor_batch_complex64;
+    ufcx_tabulate_tensor_batch_complex128* tabulate_tensor_batch_complex128;
   } ufcx_integral;
 
   typedef struct ufcx_expression
@@ -61,13 +61,18 @@ Compiler stages
    to the UFC format, generating as output one or more .h/.c files
    conforming to the UFC format.
 
+The output of stage 3 can be stored in an on-disk cache (see ffcx.cache),
+in which case stages 1-3 are skipped for objects compiled before.
+
 """
 
 import logging
 import typing
 from time import time
 
+import ffcx.metrics
 from ffcx.analysis import analyze_ufl_objects
+from ffcx.cache import compute_code_key, get_code_cache
 from ffcx.codegeneration.codegeneration import generate_code
 from ffcx.formatting import format_code
 from ffcx.ir.representation import compute_ir
@@ -80,37 +85,85 @@ def _print_timing(stage, timing):
         stage=stage, time=timing))
 
 
-def compile_ufl_objects(ufl_objects: typing.List[typing.Any],
-                        object_names: typing.Dict = {},
-                        prefix: str = None,
-                        parameters: typing.Dict = {},
-                        visualise: bool = False):
-    """Generate UFC code for a given UFL objects.
+def generate_ufl_code(ufl_objects: typing.List[typing.Any],
+                      object_names: typing.Dict = {},
+                      prefix: str = None,
+                      parameters: typing.Dict = {},
+                      visualise: bool = False,
+                      metrics: typing.Dict = None):
+    """Generate code blocks for given UFL objects (compiler stages 1-3).
 
-    Parameters
-    ----------
-    @param ufl_objects:
-        Objects to be compiled. Accepts elements, forms, integrals or coordinate mappings.
+    The code is taken from the code cache if possible. If metrics is not
+    None, the metrics of stages 1-3 are recorded in it (see ffcx.metrics).
 
     """
+    # Look up generated code in the code cache
+    cache = get_code_cache(parameters)
+    key = None
+    if cache is not None and not visualise:
+        key = compute_code_key(ufl_objects, object_names, prefix, parameters)
+        if key is not None:
+            code = cache.get(key)
+            if code is not None:
+                logger.info(f"Generated code found in cache ({key}), skipping compiler stages 1-3.")
+                if metrics is not None:
+                    metrics["code_cache_hit"] = True
+                return code
+    if metrics is not None:
+        metrics["code_cache_hit"] = False
+
     # Stage 1: analysis
     cpu_time = time()
-    analysis = analyze_ufl_objects(ufl_objects, parameters)
+    with ffcx.metrics.stage(metrics, "analysis"):
+        analysis = analyze_ufl_objects(ufl_objects, parameters)
     _print_timing(1, time() - cpu_time)
 
     # Stage 2: intermediate representation
     cpu_time = time()
-    ir = compute_ir(analysis, object_names, prefix, parameters, visualise)
+    with ffcx.metrics.stage(metrics, "ir"):
+        ir = compute_ir(analysis, object_names, prefix, parameters, visualise)
     _print_timing(2, time() - cpu_time)
+    if metrics is not None:
+        metrics["num_integrals"] = len(ir.integrals)
 
     # Stage 3: code generation
     cpu_time = time()
-    code = generate_code(ir, parameters)
+    with ffcx.metrics.stage(metrics, "codegeneration"):
+        code = generate_code(ir, parameters, metrics)
     _print_timing(3, time() - cpu_time)
 
+    if key is not None:
+        cache.put(key, code)
+
+    return code
+
+
+def compile_ufl_objects(ufl_objects: typing.List[typing.Any],
+                        object_names: typing.Dict = {},
+                        prefix: str = None,
+                        parameters: typing.Dict = {},
+                        visualise: bool = False,
+                        metrics: typing.Dict = None):
+    """Generate UFC code for a given UFL objects.
+
+    Parameters
+    ----------
+    @param ufl_objects:
+        Objects to be compiled. Accepts elements, forms, integrals or coordinate mappings.
+    @param metrics:
+        Dict filled in with the metrics of the compilation, see ffcx.metrics (optional).
+
+    """
+    # Stages 1-3
+    code = generate_ufl_code(ufl_objects, object_names, prefix, parameters, visualise, metrics)
+
     # Stage 4: format code
     cpu_time = time()
-    code_h, code_c = format_code(code, parameters)
+    with ffcx.metrics.stage(metrics, "formatting"):
+        code_h, code_c = format_code(code, parameters)
     _print_timing(4, time() - cpu_time)
 
+    if metrics is not None:
+        metrics["code_bytes"] = {"h": len(code_h), "c": len(code_c)}
+
     return code_h, code_c
@@ -127,9 +127,10 @@ def reference_cell_vertices(cellname):
 def map_facet_points(points, facet, cellname):
     """Map points from a reference facet to a physical facet."""
     geom = basix.geometry(basix.cell.string_to_type(cellname))
-    facet_vertices = [geom[i] for i in basix.topology(basix.cell.string_to_type(cellname))[-2][facet]]
-    return [facet_vertices[0] + sum((i - facet_vertices[0]) * j for i, j in zip(facet_vertices[1:], p))
-            for p in points]
+    facet_vertices = geom[basix.topology(basix.cell.string_to_type(cellname))[-2][facet]]
+    points = numpy.asarray(points)
+    axes = facet_vertices[1:1 + points.shape[-1]] - facet_vertices[0]
+    return facet_vertices[0] + points @ axes
 
 
 class BaseElement(ABC):
@@ -16,6 +16,7 @@ ufcx_utils.
 import logging
 import os
 import pprint
+import re
 import textwrap
 
 from ffcx import __version__ as FFCX_VERSION
@@ -45,6 +46,10 @@ FORMAT_TEMPLATE = {
 """,
 }
 
+# First line of generated headers, identifying the UFL objects,
+# parameters and compiler versions the code was generated with
+STAMP_TEMPLATE = "// FFCx stamp: {stamp}\n"
+
 c_extern_pre = """
 #ifdef __cplusplus
 extern "C" {
@@ -95,9 +100,52 @@ def format_code(code, parameters):
     return code_h, code_c
 
 
-def write_code(code_h, code_c, prefix, output_dir):
-    _write_file(code_h, prefix, ".h", output_dir)
+def format_code_units(code, parameters):
+    """Format given code in UFC format as separate translation units.
+
+    Returns the declarations of all objects, preceded by the includes,
+    and a list with the source of each object, preceded by the
+    declarations of the objects it refers to. The source of an object
+    thus only changes with the code of the object, and the names of the
+    objects it refers to.
+    """
+    code_pre = _generate_comment(parameters) + "\n" + FORMAT_TEMPLATE["header_c"]
+    code_pre += _generate_includes(parameters)[1]
+
+    blocks = [c for parts_code in code for c in parts_code]
+    declared_names = [re.findall(r"^extern .*?(\w+);$", c[0], re.MULTILINE) for c in blocks]
+
+    units = []
+    for _, impl in blocks:
+        unit_decl = "".join(c[0] for c, names in zip(blocks, declared_names) if any(name in impl for name in names))
+        units.append(code_pre + unit_decl + impl)
+
+    return code_pre + "".join(c[0] for c in blocks), units
+
+
+def write_code(code_h, code_c, prefix, output_dir, stamp=None):
+    """Write generated code to files, with the stamp (if any) on the first line of the header.
+
+    The header is written last, so that a stamped header is only
+    present with the source file it was generated with.
+    """
+    if stamp is not None:
+        code_h = STAMP_TEMPLATE.format(stamp=stamp) + code_h
     _write_file(code_c, prefix, ".c", output_dir)
+    _write_file(code_h, prefix, ".h", output_dir)
+
+
+def read_stamp(prefix, output_dir):
+    """Return the stamp of code written by write_code, or None if the code has no stamp or is missing."""
+    if not os.path.isfile(os.path.join(output_dir, prefix + ".c")):
+        return None
+    try:
+        with open(os.path.join(output_dir, prefix + ".h")) as hfile:
+            line = hfile.readline()
+    except OSError:
+        return None
+    match = re.fullmatch(STAMP_TEMPLATE.format(stamp=r"(\w+)"), line)
+    return match.group(1) if match else None
 
 
 def _write_file(output, prefix, postfix, output_dir):
@@ -6,6 +6,7 @@
 """Tools for precomputed tables of terminal values."""
 
 import collections
+import hashlib
 import logging
 
 import numpy
@@ -28,7 +29,78 @@ uniform_ttypes = ("fixed", "ones", "zeros", "uniform")
 unique_table_reference_t = collections.namedtuple(
     "unique_table_reference_t",
     ["name", "values", "offset", "block_size", "ttype",
-     "is_piecewise", "is_uniform", "is_permuted"])
+     "is_piecewise", "is_uniform", "is_permuted",
+     "point_map"],  # name of the map of permuted points, if permutations are looked up at runtime
+    defaults=(None, ))
+
+
+table_cache_info_t = collections.namedtuple("table_cache_info_t", ["hits", "misses", "entries", "nbytes", "maxbytes"])
+
+
+class TableCache(object):
+    """Least recently used cache of tabulated element tables.
+
+    The cache is bounded by the total size of the cached tables in
+    bytes. Cached tables are read-only, and are copied when returned.
+    """
+
+    def __init__(self, maxbytes):
+        self.maxbytes = maxbytes
+        self.tables = collections.OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached table data for key, or None."""
+        t = self.tables.get(key)
+        if t is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.tables.move_to_end(key)
+        return dict(t, array=t['array'].copy())
+
+    def put(self, key, t):
+        """Add table data to the cache, evicting least recently used tables if needed."""
+        array = t['array'].copy()
+        if array.nbytes > self.maxbytes:
+            return
+        array.setflags(write=False)
+        self.tables[key] = dict(t, array=array)
+        self.nbytes += array.nbytes
+        while self.nbytes > self.maxbytes:
+            _, evicted = self.tables.popitem(last=False)
+            self.nbytes -= evicted['array'].nbytes
+
+    def info(self):
+        return table_cache_info_t(self.hits, self.misses, len(self.tables), self.nbytes, self.maxbytes)
+
+    def clear(self):
+        self.tables.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+
+# Process-wide cache of tables, shared by all integrals and forms
+table_cache = TableCache(maxbytes=256 * 2**20)
+
+
+def table_cache_info():
+    """Return hits, misses, number of entries and size in bytes of the table cache."""
+    return table_cache.info()
+
+
+def table_cache_clear():
+    """Remove all tables from the table cache and reset its counters."""
+    table_cache.clear()
+
+
+def quadrature_points_hash(points):
+    """Return a hash of the points of a quadrature rule."""
+    points = numpy.ascontiguousarray(points, dtype=numpy.float64)
+    return hashlib.sha1(repr(points.shape).encode() + points.tobytes()).hexdigest()
 
 
 def equal_tables(a, b, rtol=default_rtol, atol=default_atol):
@@ -40,6 +112,54 @@ def equal_tables(a, b, rtol=default_rtol, atol=default_atol):
         return numpy.allclose(a, b, rtol=rtol, atol=atol)
 
 
+class UniqueTableIndex(object):
+    """Index of named tables for finding a numerically equal table.
+
+    Tables are bucketed by shape and by the sum of the absolute values of
+    their entries, quantized to bins of width bin_width. A table equal to
+    another within the tolerances of equal_tables has a sum of absolute
+    values within n * atol + rtol * sum of the other, for n entries, so
+    only the few buckets overlapping that range are compared with
+    equal_tables.
+    """
+
+    def __init__(self, tables=None, rtol=default_rtol, atol=default_atol, bin_width=1e-2):
+        self.rtol = rtol
+        self.atol = atol
+        self.bin_width = bin_width
+        self.buckets = collections.defaultdict(list)
+        self.tables = {}
+        for name, table in (tables or {}).items():
+            self.add(name, table)
+
+    def __getitem__(self, name):
+        return self.tables[name][1]
+
+    def fingerprint(self, table):
+        return float(numpy.sum(numpy.abs(table)))
+
+    def add(self, name, table):
+        """Add a table to the index."""
+        table = numpy.asarray(table)
+        self.tables[name] = (len(self.tables), table)
+        key = (table.shape, int(numpy.floor(self.fingerprint(table) / self.bin_width)))
+        self.buckets[key].append(name)
+
+    def find(self, table):
+        """Return the name of the first added table equal to table, or None."""
+        table = numpy.asarray(table)
+        s = self.fingerprint(table)
+        # Range of sums of equal tables, allowing for rounding in the sums
+        delta = (table.size * self.atol + self.rtol * s) / (1.0 - self.rtol) + 1e-12 * (1.0 + s)
+        first = int(numpy.floor((s - delta) / self.bin_width))
+        last = int(numpy.floor((s + delta) / self.bin_width))
+        candidates = [name for k in range(first, last + 1) for name in self.buckets.get((table.shape, k), [])]
+        for name in sorted(candidates, key=lambda name: self.tables[name][0]):
+            if equal_tables(table, self[name], rtol=self.rtol, atol=self.atol):
+                return name
+        return None
+
+
 def clamp_table_small_numbers(table,
                               rtol=default_rtol,
                               atol=default_atol,
@@ -56,11 +176,36 @@ def get_ffcx_table_values(points, cell, integral_type, ufl_element, avg, entityt
                           derivative_counts, flat_component):
     """Extract values from FFCx element table.
 
-    Returns a 3D numpy array with axes
-    (entity number, quadrature point number, dof number)
+    Returns a 4D numpy array with axes
+    (permutation number, entity number, quadrature point number, dof number)
+
+    Points may be given with an additional leading axis enumerating
+    permutations of the quadrature points, see permute_quadrature.
+
+    Tables are looked up in the process-wide table cache before they
+    are tabulated.
     """
+    key = (ufl_element, quadrature_points_hash(points), cell.cellname(), integral_type, avg, entitytype,
+           tuple(derivative_counts), flat_component)
+    t = table_cache.get(key)
+    if t is None:
+        t = _tabulate_ffcx_table_values(points, cell, integral_type, ufl_element, avg, entitytype,
+                                        derivative_counts, flat_component)
+        table_cache.put(key, t)
+    return t
+
+
+def _tabulate_ffcx_table_values(points, cell, integral_type, ufl_element, avg, entitytype,
+                                derivative_counts, flat_component):
+    """Tabulate values for get_ffcx_table_values."""
     deriv_order = sum(derivative_counts)
 
+    # Points for each permutation
+    points = numpy.asarray(points)
+    if points.ndim == 2:
+        points = points[numpy.newaxis, :, :]
+    num_perms = points.shape[0]
+
     if integral_type in ufl.custom_integral_types:
         # Use quadrature points on cell for analysis in custom integral types
         integral_type = "cell"
@@ -87,9 +232,11 @@ def get_ffcx_table_values(points, cell, integral_type, ufl_element, avg, entityt
         elif avg == "facet":
             integral_type = "exterior_facet"
 
-        # Make quadrature rule and get points and weights
+        # Make quadrature rule and get points and weights. Averages
+        # do not depend on the permutation.
         points, weights = create_quadrature_points_and_weights(integral_type, cell,
                                                                ufl_element.degree(), "default")
+        points = points[numpy.newaxis, :, :]
 
     # Tabulate table of basis functions and derivatives in points for each entity
     tdim = cell.topological_dimension()
@@ -99,32 +246,26 @@ def get_ffcx_table_values(points, cell, integral_type, ufl_element, avg, entityt
     basix_element = create_element(ufl_element)
 
     # Extract arrays for the right scalar component
-    component_tables = []
     component_element, offset, stride = basix_element.get_component_element(flat_component)
 
-    for entity in range(num_entities):
-        entity_points = map_integral_points(points, integral_type, cell, entity)
-        tbl = component_element.tabulate(deriv_order, entity_points)
-        tbl = tbl[basix_index(*derivative_counts)]
-        component_tables.append(tbl)
+    # Map the points of all permutations to each entity, and tabulate at
+    # all of them in one call
+    entity_points = numpy.array([map_integral_points(points.reshape(-1, points.shape[-1]), integral_type, cell, entity)
+                                 for entity in range(num_entities)])
+    num_points = entity_points.shape[1] // points.shape[0]
+    entity_points = entity_points.reshape(num_entities, points.shape[0], num_points, -1).transpose(1, 0, 2, 3)
+    tbl = component_element.tabulate(deriv_order, entity_points.reshape(-1, entity_points.shape[-1]))
+    tbl = tbl[basix_index(*derivative_counts)]
+    component_tables = numpy.reshape(tbl, (points.shape[0], num_entities, num_points, -1))
 
     if avg in ("cell", "facet"):
         # Compute numeric integral of the each component table
         wsum = sum(weights)
-        for entity, tbl in enumerate(component_tables):
-            num_dofs = tbl.shape[1]
-            tbl = numpy.dot(tbl, weights) / wsum
-            tbl = numpy.reshape(tbl, (1, num_dofs))
-            component_tables[entity] = tbl
-
-    # Loop over entities and fill table blockwise (each block = points x dofs)
-    # Reorder axes as (points, dofs) instead of (dofs, points)
-    assert len(component_tables) == num_entities
-    num_points, num_dofs = component_tables[0].shape
-    shape = (1, num_entities, num_points, num_dofs)
-    res = numpy.zeros(shape)
-    for entity in range(num_entities):
-        res[:, entity, :, :] = component_tables[entity]
+        component_tables = numpy.array([[numpy.reshape(numpy.dot(tbl, weights) / wsum, (1, -1))
+                                         for tbl in entity_tables] for entity_tables in component_tables])
+
+    # Table has axes (permutations, entities, points, dofs)
+    res = numpy.array(numpy.broadcast_to(component_tables, (num_perms, ) + component_tables.shape[1:]))
 
     return {'array': res, 'offset': offset, 'stride': stride}
 
@@ -217,51 +358,107 @@ def get_modified_terminal_element(mt):
     return element, mt.averaged, local_derivatives, fc
 
 
+# Affine maps x -> A x + b of points on the reference facet under one
+# rotation and one reflection of the facet
+_facet_rotation_maps = {
+    "interval": (numpy.identity(1), numpy.zeros(1)),
+    "triangle": (numpy.array([[0.0, 1.0], [-1.0, -1.0]]), numpy.array([0.0, 1.0])),
+    "quadrilateral": (numpy.array([[0.0, 1.0], [-1.0, 0.0]]), numpy.array([0.0, 1.0]))}
+_facet_reflection_maps = {
+    "interval": (numpy.array([[-1.0]]), numpy.array([1.0])),
+    "triangle": (numpy.array([[0.0, 1.0], [1.0, 0.0]]), numpy.zeros(2)),
+    "quadrilateral": (numpy.array([[0.0, 1.0], [1.0, 0.0]]), numpy.zeros(2))}
+_facet_num_rotations = {"interval": 1, "triangle": 3, "quadrilateral": 4}
+
+
+def permute_quadrature(points, facettype, permutations=None):
+    """Permute the points of a quadrature rule on a reference facet.
+
+    Parameters
+    ----------
+    points
+        Points on the reference facet, with axes (point, coordinate)
+    facettype
+        Cell type of the facet
+    permutations
+        Sequence of (reflections, rotations) pairs. Defaults to all
+        permutations of the facet, ordered with the reflections running
+        fastest.
+
+    Returns
+    -------
+    Array of permuted points with axes (permutation, point, coordinate).
+
+    """
+    points = numpy.asarray(points, dtype=numpy.float64)
+    fdim = _facet_rotation_maps[facettype][0].shape[0]
+    assert numpy.allclose(points[:, fdim:], 0.0)
+    points = points[:, :fdim]
+
+    if permutations is None:
+        permutations = [(ref, rot) for rot in range(_facet_num_rotations[facettype]) for ref in range(2)]
+
+    # Compose the affine map of each permutation, rotations first
+    A = numpy.zeros((len(permutations), fdim, fdim))
+    b = numpy.zeros((len(permutations), fdim))
+    R, r = _facet_rotation_maps[facettype]
+    F, f = _facet_reflection_maps[facettype]
+    for k, (reflections, rotations) in enumerate(permutations):
+        Ak, bk = numpy.identity(fdim), numpy.zeros(fdim)
+        for i in range(rotations % _facet_num_rotations[facettype]):
+            Ak, bk = R @ Ak, R @ bk + r
+        if reflections % 2:
+            Ak, bk = F @ Ak, F @ bk + f
+        A[k], b[k] = Ak, bk
+
+    return numpy.einsum("kij,pj->kpi", A, points) + b[:, numpy.newaxis, :]
+
+
 def permute_quadrature_interval(points, reflections=0):
-    output = points.copy()
-    for p in output:
-        assert len(p) < 2 or numpy.isclose(p[1], 0)
-        assert len(p) < 3 or numpy.isclose(p[2], 0)
-    for i in range(reflections):
-        for n, p in enumerate(output):
-            output[n] = [1 - p[0]]
-    return output
+    return permute_quadrature(points, "interval", [(reflections, 0)])[0]
 
 
 def permute_quadrature_triangle(points, reflections=0, rotations=0):
-    output = points.copy()
-    for p in output:
-        assert len(p) < 3 or numpy.isclose(p[2], 0)
-    for i in range(rotations):
-        for n, p in enumerate(output):
-            output[n] = [p[1], 1 - p[0] - p[1]]
-    for i in range(reflections):
-        for n, p in enumerate(output):
-            output[n] = [p[1], p[0]]
-    return output
+    return permute_quadrature(points, "triangle", [(reflections, rotations)])[0]
 
 
 def permute_quadrature_quadrilateral(points, reflections=0, rotations=0):
-    output = points.copy()
-    for p in output:
-        assert len(p) < 3 or numpy.isclose(p[2], 0)
-    for i in range(rotations):
-        for n, p in enumerate(output):
-            output[n] = [p[1], 1 - p[0]]
-    for i in range(reflections):
-        for n, p in enumerate(output):
-            output[n] = [p[1], p[0]]
-    return output
+    return permute_quadrature(points, "quadrilateral", [(reflections, rotations)])[0]
+
+
+def facet_cell_type(cell):
+    """Return the cell type of the facets of a cell."""
+    return {"triangle": "interval", "quadrilateral": "interval",
+            "tetrahedron": "triangle", "hexahedron": "quadrilateral"}[cell.cellname()]
+
+
+def quadrature_permutation_map(points, facettype, rtol=default_rtol, atol=default_atol):
+    """Map the points of each permutation of a facet quadrature rule to the unpermuted points.
+
+    Returns an integer array with axes (permutation, point), such that
+    point q of permutation k is point map[k, q] of the rule, or None if
+    the points are not invariant under the permutations of the facet.
+    """
+    permuted = permute_quadrature(points, facettype)
+    points = numpy.asarray(points)[:, :permuted.shape[2]]
+    close = numpy.all(numpy.isclose(permuted[:, :, numpy.newaxis, :], points[numpy.newaxis, numpy.newaxis, :, :],
+                                    rtol=rtol, atol=atol), axis=3)
+    if not numpy.all(numpy.count_nonzero(close, axis=2) == 1):
+        return None
+    return numpy.argmax(close, axis=2)
 
 
 def build_optimized_tables(quadrature_rule, cell, integral_type, entitytype,
                            modified_terminals, existing_tables,
-                           rtol=default_rtol, atol=default_atol):
+                           rtol=default_rtol, atol=default_atol, point_map=None):
     """Build the element tables needed for a list of modified terminals.
 
     Input:
       entitytype - str
       modified_terminals - ordered sequence of unique modified terminals
+      point_map - name and array of the quadrature_permutation_map of the
+                  rule of an interior facet integral. If given, permuted
+                  tables store the values in the unpermuted points only.
       FIXME: Document
 
     Output:
@@ -283,7 +480,7 @@ def build_optimized_tables(quadrature_rule, cell, integral_type, entitytype,
     element_numbers = {element: i for i, element in enumerate(unique_elements)}
     mt_tables = {}
 
-    _existing_tables = existing_tables.copy()
+    _existing_tables = UniqueTableIndex(existing_tables)
 
     for mt in modified_terminals:
         res = analysis.get(mt)
@@ -298,50 +495,20 @@ def build_optimized_tables(quadrature_rule, cell, integral_type, entitytype,
         name = generate_psi_table_name(quadrature_rule, element_number, avg, entitytype,
                                        local_derivatives, flat_component)
 
-        # FIXME - currently just recalculate the tables every time,
-        # only reusing them if they match numerically.
-        # It should be possible to reuse the cached tables by name, but
-        # the dofmap offset may differ due to restriction.
+        # Tables are tabulated once per process for each element,
+        # quadrature rule, derivative and component, see
+        # get_ffcx_table_values. Tables are reused within the integral if
+        # they match numerically, as the dofmap offset may differ due to
+        # restriction.
 
         tdim = cell.topological_dimension()
 
-        if integral_type == "interior_facet":
-            if tdim == 1:
-                t = get_ffcx_table_values(quadrature_rule.points, cell,
-                                          integral_type, element, avg, entitytype,
-                                          local_derivatives, flat_component)
-            elif tdim == 2:
-                new_table = []
-                for ref in range(2):
-                    new_table.append(get_ffcx_table_values(
-                        permute_quadrature_interval(quadrature_rule.points, ref), cell,
-                        integral_type, element, avg, entitytype, local_derivatives, flat_component))
-
-                t = new_table[0]
-                t['array'] = numpy.vstack([td['array'] for td in new_table])
-            elif tdim == 3:
-                cell_type = cell.cellname()
-                if cell_type == "tetrahedron":
-                    new_table = []
-                    for rot in range(3):
-                        for ref in range(2):
-                            new_table.append(get_ffcx_table_values(
-                                permute_quadrature_triangle(
-                                    quadrature_rule.points, ref, rot),
-                                cell, integral_type, element, avg, entitytype, local_derivatives,
-                                flat_component))
-                    t = new_table[0]
-                    t['array'] = numpy.vstack([td['array'] for td in new_table])
-                elif cell_type == "hexahedron":
-                    new_table = []
-                    for rot in range(4):
-                        for ref in range(2):
-                            new_table.append(get_ffcx_table_values(
-                                permute_quadrature_quadrilateral(
-                                    quadrature_rule.points, ref, rot),
-                                cell, integral_type, element, avg, entitytype, local_derivatives, flat_component))
-                    t = new_table[0]
-                    t['array'] = numpy.vstack([td['array'] for td in new_table])
+        if integral_type == "interior_facet" and tdim > 1:
+            # Tabulate the table for all permutations of the facet
+            # quadrature points at once
+            t = get_ffcx_table_values(permute_quadrature(quadrature_rule.points, facet_cell_type(cell)), cell,
+                                      integral_type, element, avg, entitytype,
+                                      local_derivatives, flat_component)
         else:
             t = get_ffcx_table_values(quadrature_rule.points, cell,
                                       integral_type, element, avg, entitytype,
@@ -357,21 +524,25 @@ def build_optimized_tables(quadrature_rule, cell, integral_type, entitytype,
             # Reduce table to dimension 1 along num_entities axis in generated code
             tbl = tbl[:, :1, :, :]
         is_permuted = is_permuted_table(tbl)
+        table_point_map = None
         if not is_permuted:
             # Reduce table along num_perms axis
             tbl = tbl[:1, :, :, :]
+        elif point_map is not None and tbl.shape[2] == point_map[1].shape[1]:
+            # Keep only the unpermuted table if the permuted tables are
+            # the unpermuted one at permuted points
+            unpermuted = tbl[0][:, point_map[1], :].transpose(1, 0, 2, 3)
+            if numpy.allclose(tbl, unpermuted, rtol=rtol, atol=atol):
+                tbl = tbl[:1, :, :, :]
+                table_point_map = point_map[0]
 
         # Check for existing identical table
-        new_table = True
-        for table_name in _existing_tables:
-            if equal_tables(tbl, _existing_tables[table_name]):
-                name = table_name
-                tbl = _existing_tables[name]
-                new_table = False
-                break
-
-        if new_table:
-            _existing_tables[name] = tbl
+        existing_name = _existing_tables.find(tbl)
+        if existing_name is not None:
+            name = existing_name
+            tbl = _existing_tables[name]
+        else:
+            _existing_tables.add(name, tbl)
 
         cell_offset = 0
         basix_element = create_element(element)
@@ -386,7 +557,7 @@ def build_optimized_tables(quadrature_rule, cell, integral_type, entitytype,
         # tables is just np.arrays, mt_tables hold metadata too
         mt_tables[mt] = unique_table_reference_t(
             name, tbl, offset, block_size, tabletype,
-            tabletype in piecewise_ttypes, tabletype in uniform_ttypes, is_permuted)
+            tabletype in piecewise_ttypes, tabletype in uniform_ttypes, is_permuted, table_point_map)
 
     return mt_tables
 
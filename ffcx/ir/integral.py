@@ -16,13 +16,21 @@ from ffcx.ir.analysis.graph import build_scalar_graph
 from ffcx.ir.analysis.modified_terminals import (analyse_modified_terminal,
                                                  is_modified_terminal)
 from ffcx.ir.analysis.visualise import visualise_graph
-from ffcx.ir.elementtables import build_optimized_tables
+from ffcx.ir.elementtables import (build_optimized_tables,
+                                   clamp_table_small_numbers, facet_cell_type,
+                                   quadrature_permutation_map)
+from ffcx.ir.sumfactorization import (factorize_table, sum_factorization_t,
+                                      tensor_product_cells,
+                                      tensor_product_shape)
 from ufl.algorithms.balancing import balance_modifiers
 from ufl.checks import is_cellwise_constant
 from ufl.classes import QuadratureWeight
 
 logger = logging.getLogger("ffcx")
 
+# Integral types for which blocks with piecewise factors can be preintegrated
+preintegrated_integral_types = ("cell", "exterior_facet")
+
 # FIXME: What's ma?
 ma_data_t = collections.namedtuple("ma_data_t", ["ma_index", "tabledata"])
 
@@ -34,15 +42,16 @@ block_data_t = collections.namedtuple("block_data_t",
                                        "restrictions",  # restriction "+" | "-" | None for each block rank
                                        "transposed",  # block is the transpose of another
                                        "is_uniform",
-                                       "name",  # used in "preintegrated" and "premultiplied"
+                                       "name",  # name of "preintegrated" or "premultiplied" table, if any
                                        "ma_data",  # used in "full", "safe" and "partial"
                                        "piecewise_ma_index",  # used in "partial"
-                                       "is_permuted"  # Do quad points on facets need to be permuted?
-                                       ])
+                                       "is_permuted",  # Do quad points on facets need to be permuted?
+                                       "sum_factorization"  # sum_factorization_t for each block rank, or None
+                                       ], defaults=(None, ))
 
 
 def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_shape,
-                        p, visualise):
+                        p, visualise, sum_factorization=None):
     # The intermediate representation dict we're building and returning
     # here
     ir = {}
@@ -81,6 +90,19 @@ def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_sh
                              for i, v in S.nodes.items()
                              if is_modified_terminal(v['expression'])}
 
+        # Map permuted facet quadrature points to the unpermuted points,
+        # to look up permuted points in unpermuted tables at runtime
+        point_map = None
+        if p["quadrature_permutation_maps"] and integral_type == "interior_facet" \
+                and cell.topological_dimension() > 1:
+            point_map = quadrature_permutation_map(quadrature_rule.points, facet_cell_type(cell),
+                                                   rtol=p["table_rtol"], atol=p["table_atol"])
+            if point_map is None:
+                logger.info("Quadrature points are not invariant under facet permutations, "
+                            "using permuted tables.")
+            else:
+                point_map = (f"qperm_Q{quadrature_rule.id()}", point_map)
+
         mt_table_reference = build_optimized_tables(
             quadrature_rule,
             cell,
@@ -89,7 +111,8 @@ def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_sh
             initial_terminals.values(),
             ir["unique_tables"],
             rtol=p["table_rtol"],
-            atol=p["table_atol"])
+            atol=p["table_atol"],
+            point_map=point_map)
 
         # Fetch unique tables for this quadrature rule
         table_types = {v.name: v.ttype for v in mt_table_reference.values()}
@@ -174,6 +197,18 @@ def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_sh
         if visualise:
             visualise_graph(F, 'F.pdf')
 
+        # Check if sum factorization is requested and possible for this
+        # quadrature rule
+        sf_shape = None
+        if sum_factorization is not None and sum_factorization.get(quadrature_rule):
+            if integral_type != "cell" or cell.cellname() not in tensor_product_cells:
+                logger.info(f"Sum factorization not supported for {integral_type} integrals "
+                            f"on {cell.cellname()}, using standard quadrature loop.")
+            else:
+                sf_shape = tensor_product_shape(quadrature_rule.points)
+                if sf_shape is None:
+                    logger.info("Quadrature rule is not a tensor product, using standard quadrature loop.")
+
         # Loop over factorization terms
         block_contributions = collections.defaultdict(list)
         for ma_indices, fi_ci in sorted(argument_factorization.items()):
@@ -209,10 +244,7 @@ def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_sh
 
             # Check if each *each* factor corresponding to this argument is piecewise
             all_factors_piecewise = all(F.nodes[ifi[0]]["status"] == 'piecewise' for ifi in fi_ci)
-            block_is_permuted = False
-            for name in unames:
-                if tables[name].shape[0] > 1:
-                    block_is_permuted = True
+            block_is_permuted = any(tr.is_permuted for tr in trs)
             ma_data = []
             for i, ma in enumerate(ma_indices):
                 ma_data.append(ma_data_t(ma, trs[i]))
@@ -228,6 +260,53 @@ def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_sh
             # Insert in expr_ir for this quadrature loop
             block_contributions[blockmap].append(blockdata)
 
+        # Integrate the products of the argument tables at compile time
+        # for blocks with piecewise factors, if this is cheaper than the
+        # quadrature loop
+        preintegrated_names = {}
+        for blockmap, contributions in block_contributions.items():
+            if not p["preintegrate"] or integral_type not in preintegrated_integral_types:
+                break
+            candidates = [k for k, blockdata in enumerate(contributions)
+                          if blockdata.all_factors_piecewise and not blockdata.is_permuted
+                          and len(blockmap) > 0 and "quadrature" not in blockdata.ttypes]
+            if not candidates or not preintegration_is_cheaper(
+                    quadrature_rule.weights.shape[0], blockmap, [contributions[k] for k in candidates]):
+                continue
+            for k in candidates:
+                blockdata = contributions[k]
+                pname = preintegrated_names.get(blockdata.unames)
+                if pname is None:
+                    ptable = integrate_block(quadrature_rule.weights,
+                                             [mad.tabledata.values for mad in blockdata.ma_data])
+                    ptable = clamp_table_small_numbers(ptable, rtol=p["table_rtol"], atol=p["table_atol"])
+                    num_preintegrated = sum(1 for t in ir["unique_table_types"].values() if t == "preintegrated")
+                    pname = f"PI{num_preintegrated}"
+                    preintegrated_names[blockdata.unames] = pname
+                    ir["unique_tables"][pname] = ptable
+                    ir["unique_table_types"][pname] = "preintegrated"
+                contributions[k] = blockdata._replace(name=pname)
+
+        # Sum factorize the remaining blocks if requested
+        if sf_shape is not None:
+            for contributions in block_contributions.values():
+                for k, blockdata in enumerate(contributions):
+                    if blockdata.name is None:
+                        trs = [mad.tabledata for mad in blockdata.ma_data]
+                        block_sf = factorize_block(trs, sf_shape, quadrature_rule, ir["unique_tables"],
+                                                   ir["unique_table_types"], p["table_rtol"], p["table_atol"])
+                        contributions[k] = blockdata._replace(sum_factorization=block_sf)
+
+        # Fold the quadrature weights into a varying argument table of the
+        # remaining blocks with piecewise factors if requested
+        if p["premultiply"] and integral_type not in ufl.custom_integral_types:
+            for contributions in block_contributions.values():
+                for k, blockdata in enumerate(contributions):
+                    if blockdata.name is None and blockdata.sum_factorization is None \
+                            and blockdata.all_factors_piecewise:
+                        contributions[k] = premultiply_block(blockdata, quadrature_rule.weights,
+                                                             ir["unique_tables"], ir["unique_table_types"])
+
         # Figure out which table names are referenced
         active_table_names = set()
         for i, v in F.nodes.items():
@@ -235,12 +314,19 @@ def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_sh
             if tr is not None and F.nodes[i]['status'] != 'inactive':
                 active_table_names.add(tr.name)
 
-        # Figure out which table names are referenced in blocks
+        # Figure out which table names are referenced in blocks,
+        # preintegrated blocks only use the preintegrated table and sum
+        # factorized blocks only use the one dimensional tables
         for blockmap, contributions in itertools.chain(
                 block_contributions.items()):
             for blockdata in contributions:
+                if blockdata.sum_factorization is not None:
+                    continue
+                if ir["unique_table_types"].get(blockdata.name) == "preintegrated":
+                    continue
                 for mad in blockdata.ma_data:
-                    active_table_names.add(mad.tabledata.name)
+                    if mad.tabledata.ttype != "premultiplied":
+                        active_table_names.add(mad.tabledata.name)
 
         active_tables = {}
         active_table_types = {}
@@ -251,6 +337,13 @@ def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_sh
                 active_tables[name] = tables[name]
                 active_table_types[name] = table_types[name]
 
+        # Add the map of permuted quadrature points if any active table
+        # uses it
+        if point_map is not None and any(tr.point_map is not None and tr.name in active_tables
+                                         for tr in mt_table_reference.values()):
+            active_tables[point_map[0]] = point_map[1]
+            active_table_types[point_map[0]] = "permutation_map"
+
         # Add tables and types for this quadrature rule to global tables dict
         ir["unique_tables"].update(active_tables)
         ir["unique_table_types"].update(active_table_types)
@@ -259,7 +352,8 @@ def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_sh
         # Store final ir for this num_points
         ir["integrand"][quadrature_rule] = {"factorization": F,
                                             "modified_arguments": [F.nodes[i]['mt'] for i in argkeys],
-                                            "block_contributions": block_contributions}
+                                            "block_contributions": block_contributions,
+                                            "scalar_graph_nodes": len(S.nodes)}
 
         restrictions = [i.restriction for i in initial_terminals.values()]
         ir["needs_facet_permutations"] = "+" in restrictions and "-" in restrictions
@@ -267,6 +361,113 @@ def compute_integral_ir(cell, integral_type, entitytype, integrands, argument_sh
     return ir
 
 
+def preintegration_is_cheaper(num_points, blockmap, blocks):
+    """Compare the flops of preintegrated blocks to those of the quadrature loop.
+
+    In the quadrature loop, the blocks with the same blockmap are summed
+    in a single loop nest. For rank 2 blocks, the products of the block
+    factors and the test function tables are hoisted out of the trial
+    function loop, which leaves one multiplication and one addition per
+    entry and distinct trial function table. A preintegrated block costs
+    one multiplication and one addition per entry.
+    """
+    block_size = numpy.prod([len(dofmap) for dofmap in blockmap])
+    if len(blockmap) == 2:
+        num_tables = len(set(blockdata.unames[1] for blockdata in blocks))
+        quadrature_cost = num_points * 2 * (num_tables * block_size + len(blocks) * len(blockmap[0]))
+    else:
+        quadrature_cost = num_points * 2 * len(blocks) * block_size
+    preintegrated_cost = 2 * len(blocks) * block_size
+    return preintegrated_cost < quadrature_cost
+
+
+def integrate_block(weights, tables):
+    """Integrate the product of argument tables with the quadrature weights.
+
+    The tables have axes [perm][entity][points][dofs], with one entity
+    for uniform and one point for piecewise tables. Returns a table
+    with axes [perm][entity][dofs of argument 0]...[dofs of argument n].
+    """
+    num_points = weights.shape[0]
+    num_entities = max(t.shape[1] for t in tables)
+    tables = [numpy.broadcast_to(t[0], (num_entities, num_points, t.shape[3])) for t in tables]
+    indices = "ijkl"[:len(tables)]
+    subscripts = "q," + ",".join(f"eq{i}" for i in indices) + f"->e{indices}"
+    ptable = numpy.einsum(subscripts, weights, *tables)
+    return ptable.reshape((1, ) + ptable.shape)
+
+
+def premultiply_block(blockdata, weights, unique_tables, unique_table_types):
+    """Fold the quadrature weights into the first varying argument table of a block.
+
+    The premultiplied table is added to unique_tables. Returns the block
+    with the premultiplied table in place of the argument table, or the
+    block unchanged if no argument table varies over the quadrature
+    points.
+
+    Tables looked up through a map of permuted quadrature points are
+    not premultiplied, as their point iq_perm is used at point iq, where
+    weights[iq] applies.
+    """
+    for i, mad in enumerate(blockdata.ma_data):
+        tr = mad.tabledata
+        if tr.ttype in ("uniform", "varying") and tr.point_map is None:
+            break
+    else:
+        return blockdata
+
+    # Premultiplied tables are shared between blocks
+    pname = f"PM_{tr.name}"
+    if pname not in unique_tables:
+        unique_tables[pname] = tr.values * weights[numpy.newaxis, numpy.newaxis, :, numpy.newaxis]
+        unique_table_types[pname] = "premultiplied"
+
+    ma_data = list(blockdata.ma_data)
+    ma_data[i] = ma_data_t(mad.ma_index, tr._replace(name=pname, values=unique_tables[pname], ttype="premultiplied"))
+    return blockdata._replace(name=pname, ma_data=tuple(ma_data))
+
+
+def factorize_block(trs, shape, quadrature_rule, unique_tables, unique_table_types, rtol, atol):
+    """Factorize the argument tables of a block into one dimensional tables.
+
+    The one dimensional tables are added to unique_tables. Returns a
+    sum_factorization_t for each argument, or None if any argument
+    table does not factorize.
+    """
+    if not trs:
+        return None
+
+    factorizations = []
+    for tr in trs:
+        if tr.ttype not in ("uniform", "varying") or tr.is_permuted:
+            logger.info(f"Table {tr.name} of type {tr.ttype} not sum factorized.")
+            return None
+        f = factorize_table(tr.values[0, 0], shape, rtol=rtol, atol=atol)
+        if f is None:
+            logger.info(f"Table {tr.name} does not factorize, using standard quadrature loop.")
+            return None
+        factorizations.append(f)
+
+    block_sf = []
+    for tables, dofmap in factorizations:
+        names = []
+        for table in tables:
+            table = table.reshape((1, 1) + table.shape)
+            for name, existing in unique_tables.items():
+                if unique_table_types.get(name) == "sum_factorization" and existing.shape == table.shape \
+                        and numpy.allclose(existing, table, rtol=rtol, atol=atol):
+                    break
+            else:
+                num_sf = sum(1 for t in unique_table_types.values() if t == "sum_factorization")
+                name = f"SF{num_sf}_Q{quadrature_rule.id()}"
+                unique_tables[name] = table
+                unique_table_types[name] = "sum_factorization"
+            names.append(name)
+        block_sf.append(sum_factorization_t(tuple(names), dofmap))
+
+    return tuple(block_sf)
+
+
 def analyse_dependencies(F, mt_unique_table_reference):
     # Sets 'status' of all nodes to either: 'inactive', 'piecewise' or 'varying'
     # Children of 'target' nodes are either 'piecewise' or 'varying'.
@@ -294,6 +294,7 @@ def _compute_integral_ir(form_data, form_index, element_numbers, integral_names,
 
         # Group integrands with the same quadrature rule
         grouped_integrands = {}
+        sum_factorization = {}
         for integral in itg_data.integrals:
             md = integral.metadata() or {}
             scheme = md["quadrature_rule"]
@@ -340,6 +341,10 @@ def _compute_integral_ir(form_data, form_index, element_numbers, integral_names,
 
             grouped_integrands[rule].append(integral.integrand())
 
+            # Sum factorize the integrands of a rule only if all of them ask for it
+            use_sf = bool(md.get("sum_factorization", parameters["sum_factorization"]))
+            sum_factorization[rule] = sum_factorization.get(rule, True) and use_sf
+
         sorted_integrals = {}
         for rule, integrands in grouped_integrands.items():
             integrands_summed = sorted_expr_sum(integrands)
@@ -386,7 +391,7 @@ def _compute_integral_ir(form_data, form_index, element_numbers, integral_names,
         # Build more specific intermediate representation
         integral_ir = compute_integral_ir(itg_data.domain.ufl_cell(), itg_data.integral_type,
                                           ir["entitytype"], integrands, ir["tensor_shape"],
-                                          parameters, visualise)
+                                          parameters, visualise, sum_factorization)
 
         ir.update(integral_ir)
 
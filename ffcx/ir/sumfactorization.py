@@ -0,0 +1,132 @@
+# Copyright (C) 2022 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Sum factorization of element tensors on tensor product cells.
+
+On quadrilaterals and hexahedra, with a tensor product quadrature rule,
+the basis functions of tensor product elements (and their reference
+derivatives) factorize as products of one dimensional functions,
+
+    phi_i(X) = prod_d u^d_{k_d(i)}(X_d).
+
+An element tensor contribution
+
+    A_ij = sum_q f(q) phi_i(q) psi_j(q)
+
+can then be computed by contracting the quadrature point values f(q)
+with the one dimensional tables one dimension at a time, which costs
+O(p^(2d + 1)) instead of O(p^(3d)) operations for degree p in d
+dimensions.
+"""
+
+import collections
+import itertools
+import logging
+
+import numpy
+
+logger = logging.getLogger("ffcx")
+
+# Factorization of the table of a block argument: names of the one
+# dimensional tables for each dimension, and map from the (flattened,
+# row-major) tensor product dof index to the column in the full table
+sum_factorization_t = collections.namedtuple("sum_factorization_t", ["tables", "dofmap"])
+
+tensor_product_cells = ("quadrilateral", "hexahedron")
+
+
+def tensor_product_shape(points, rtol=1e-6, atol=1e-9):
+    """Return the number of points in each dimension if points form a tensor product grid.
+
+    The points must be ordered lexicographically with the first
+    coordinate running slowest. Returns None for other point sets.
+    """
+    points = numpy.asarray(points)
+    axes = []
+    for d in range(points.shape[1]):
+        x = numpy.sort(points[:, d])
+        unique = x[numpy.concatenate(([True], ~numpy.isclose(x[1:], x[:-1], rtol=rtol, atol=atol)))]
+        axes.append(unique)
+    grid = numpy.array(list(itertools.product(*axes)))
+    if grid.shape != points.shape or not numpy.allclose(grid, points, rtol=rtol, atol=atol):
+        return None
+    return tuple(len(x) for x in axes)
+
+
+def factorize_table(table, shape, rtol=1e-6, atol=1e-9):
+    """Factorize the table of an element at tensor product quadrature points.
+
+    Parameters
+    ----------
+    table
+        Table values with axes (points, dofs)
+    shape
+        Number of quadrature points in each dimension
+
+    Returns
+    -------
+    A list of one dimensional tables with axes (points, dofs) for each
+    dimension, and the map from flattened tensor product dof index to
+    table column. Returns None if the table does not factorize.
+
+    """
+    num_points, num_dofs = table.shape
+    tdim = len(shape)
+    values = table.reshape(shape + (num_dofs, ))
+
+    # Find the one dimensional functions (up to scaling) of each dof by
+    # slicing the dof values through the point of largest magnitude
+    functions = [[] for d in range(tdim)]
+    indices = []
+    scales = []
+    for dof in range(num_dofs):
+        v = values[..., dof]
+        qmax = numpy.unravel_index(numpy.argmax(numpy.abs(v)), shape)
+        vmax = v[qmax]
+        if abs(vmax) <= atol:
+            return None
+        index = []
+        for d in range(tdim):
+            u = v[qmax[:d] + (slice(None), ) + qmax[d + 1:]] / vmax
+            for k, w in enumerate(functions[d]):
+                if numpy.allclose(u, w, rtol=rtol, atol=atol):
+                    break
+            else:
+                k = len(functions[d])
+                functions[d].append(u)
+            index.append(k)
+        indices.append(tuple(index))
+        scales.append(vmax)
+
+    # Dofs must map one-to-one onto the tensor product of the one
+    # dimensional functions
+    dofs_shape = tuple(len(f) for f in functions)
+    if numpy.prod(dofs_shape) != num_dofs or len(set(indices)) != num_dofs:
+        return None
+    dofmap = numpy.zeros(dofs_shape, dtype=int)
+    scale = numpy.zeros(dofs_shape)
+    for dof, index in enumerate(indices):
+        dofmap[index] = dof
+        scale[index] = scales[dof]
+
+    # The scaling of the dofs must itself be a tensor product,
+    # distribute it over the one dimensional functions
+    origin = (0, ) * tdim
+    if abs(scale[origin]) <= atol:
+        return None
+    factors = []
+    for d in range(tdim):
+        s = scale[origin[:d] + (slice(None), ) + origin[d + 1:]]
+        factors.append(s if d == 0 else s / scale[origin])
+    tables = [numpy.array(functions[d]).T * factors[d] for d in range(tdim)]
+
+    # Check the factorization against the full table
+    product = tables[0]
+    for t in tables[1:]:
+        product = numpy.einsum("pi,qj->pqij", product, t).reshape(product.shape[0] * t.shape[0], -1)
+    if not numpy.allclose(product, table[:, dofmap.flatten()], rtol=rtol, atol=atol):
+        return None
+
+    return tables, tuple(dofmap.flatten())
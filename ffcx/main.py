@@ -6,17 +6,28 @@
 """Command-line interface to FFCx.
 
 Parse command-line arguments and generate code from input UFL form files.
+Generated headers start with a stamp of the UFL objects, parameters,
+signature of ufcx.h and versions of FFCx, UFL and Basix, and files whose stamp is up to date are not
+generated again (unless ``--force`` is given).
+The subcommand ``ffcx warm-cache`` precompiles UFL objects into a JIT
+cache directory (see ffcx.warm_cache).
 """
 
 import argparse
+import concurrent.futures
 import cProfile
+import io
+import json
 import logging
 import pathlib
 import re
 import string
+import sys
+import traceback
 
 import ufl
 
+import ffcx.cache
 from ffcx import __version__ as FFCX_VERSION
 from ffcx import compiler, formatting
 from ffcx.parameters import FFCX_DEFAULT_PARAMETERS, get_parameters
@@ -24,12 +35,20 @@ from ffcx.parameters import FFCX_DEFAULT_PARAMETERS, get_parameters
 logger = logging.getLogger("ffcx")
 
 parser = argparse.ArgumentParser(
-    description="FEniCS Form Compiler (FFCx, https://fenicsproject.org)")
+    description="FEniCS Form Compiler (FFCx, https://fenicsproject.org)",
+    epilog="Run 'ffcx warm-cache --help' for precompiling UFL objects into a JIT cache directory.")
 parser.add_argument(
     "--version", action='version', version=f"%(prog)s (version {FFCX_VERSION})")
 parser.add_argument("-o", "--output-directory", type=str, default=".", help="output directory")
 parser.add_argument("--visualise", action="store_true", help="visualise the IR graph")
 parser.add_argument("-p", "--profile", action='store_true', help="enable profiling")
+parser.add_argument("-f", "--force", action="store_true",
+                    help="generate code even if the stamp of existing code is up to date")
+parser.add_argument("--metrics", metavar="FILE",
+                    help="write metrics of the compilation of each file to FILE as JSON (see ffcx.metrics), "
+                         "with peak memory when run as python -X tracemalloc -m ffcx")
+parser.add_argument("-j", "--jobs", type=int, default=1,
+                    help="number of files compiled in parallel, in a pool of processes (default: 1)")
 
 # Add all parameters from FFCx parameter system
 for param_name, (param_val, param_desc) in FFCX_DEFAULT_PARAMETERS.items():
@@ -39,43 +58,134 @@ for param_name, (param_val, param_desc) in FFCX_DEFAULT_PARAMETERS.items():
 parser.add_argument("ufl_file", nargs='+', help="UFL file(s) to be compiled")
 
 
-def main(args=None):
-    xargs = parser.parse_args(args)
-
-    # Parse all other parameters
-    priority_parameters = {k: v for k, v in xargs.__dict__.items() if v is not None}
-    parameters = get_parameters(priority_parameters)
-
-    # Call parser and compiler for each file
-    for filename in xargs.ufl_file:
-        file = pathlib.Path(filename)
-
-        # Remove weird characters (file system allows more than the C
-        # preprocessor)
-        prefix = file.stem
-        prefix = re.subn("[^{}]".format(string.ascii_letters + string.digits + "_"), "!", prefix)[0]
-        prefix = re.subn("!+", "_", prefix)[0]
-
-        # Turn on profiling
-        if xargs.profile:
-            pr = cProfile.Profile()
-            pr.enable()
-
-        # Load UFL file
-        ufd = ufl.algorithms.load_ufl_file(filename)
-
+def compile_file(filename, output_directory, parameters, visualise=False, profile=False, force=False,
+                 metrics=None):
+    """Generate code for the UFL file filename and write it to output_directory.
+
+    The header starts with a stamp of the UFL objects, parameters,
+    signature of ufcx.h and versions of FFCx, UFL and Basix, and the files are left untouched if their stamp
+    is up to date, unless force is true. If metrics is a dict, it is
+    filled in with the metrics of the compilation (see ffcx.metrics), and
+    ``up_to_date``.
+    """
+    file = pathlib.Path(filename)
+
+    # Remove weird characters (file system allows more than the C
+    # preprocessor)
+    prefix = file.stem
+    prefix = re.subn("[^{}]".format(string.ascii_letters + string.digits + "_"), "!", prefix)[0]
+    prefix = re.subn("!+", "_", prefix)[0]
+
+    # Turn on profiling
+    if profile:
+        pr = cProfile.Profile()
+        pr.enable()
+
+    # Load UFL file
+    ufd = ufl.algorithms.load_ufl_file(filename)
+    ufl_objects = ufd.forms + ufd.expressions + ufd.elements
+
+    # Skip files with code generated from the same objects with the same
+    # parameters and compiler versions
+    stamp = ffcx.cache.compute_code_key(ufl_objects, ufd.object_names, prefix, parameters) if ufl_objects else None
+    up_to_date = not (force or visualise) and stamp is not None \
+        and formatting.read_stamp(prefix, output_directory) == stamp
+    if metrics is not None:
+        metrics["up_to_date"] = up_to_date
+    if up_to_date:
+        logger.info(f"Generated code of {filename} is up to date")
+    else:
         # Generate code
         code_h, code_c = compiler.compile_ufl_objects(
-            ufd.forms + ufd.expressions + ufd.elements, ufd.object_names,
-            prefix=prefix, parameters=parameters, visualise=xargs.visualise)
+            ufl_objects, ufd.object_names, prefix=prefix, parameters=parameters, visualise=visualise,
+            metrics=metrics)
 
         # Write to file
-        formatting.write_code(code_h, code_c, prefix, xargs.output_directory)
+        formatting.write_code(code_h, code_c, prefix, output_directory, stamp)
+
+    # Turn off profiling and write status to file
+    if profile:
+        pr.disable()
+        pfn = f"ffcx_{prefix}.profile"
+        pr.dump_stats(pfn)
+
+
+def _compile_file_in_worker(filename, output_directory, parameters, visualise, profile, force, record_metrics):
+    """Compile a UFL file in a worker process.
+
+    Returns the log output, the error (None on success) and the metrics
+    (None if not recorded), which the main process reports in the order
+    of the files.
+    """
+    metrics = {} if record_metrics else None
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    loggers = [logger, logging.getLogger("py.warnings")]
+    for log in loggers:
+        log.addHandler(handler)
+        log.propagate = False
+    logger.setLevel(parameters["verbosity"])
+    try:
+        compile_file(filename, output_directory, parameters, visualise, profile, force, metrics)
+        error = None
+    except Exception as e:
+        error = (f"{type(e).__name__}: {e}", traceback.format_exc())
+    finally:
+        for log in loggers:
+            log.removeHandler(handler)
+            log.propagate = True
+    return stream.getvalue(), error, metrics
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    if args and args[0] == "warm-cache":
+        from ffcx.warm_cache import main as warm_cache
+        return warm_cache(args[1:])
 
-        # Turn off profiling and write status to file
-        if xargs.profile:
-            pr.disable()
-            pfn = f"ffcx_{prefix}.profile"
-            pr.dump_stats(pfn)
+    xargs = parser.parse_args(args)
+
+    # Parse all other parameters
+    priority_parameters = {k: v for k, v in xargs.__dict__.items()
+                           if v is not None and k in FFCX_DEFAULT_PARAMETERS}
+    parameters = get_parameters(priority_parameters)
 
+    # Call parser and compiler for each file, in a pool of processes
+    # with more than one job
+    failed = []
+    records = {}
+    if xargs.jobs > 1 and len(xargs.ufl_file) > 1:
+        with concurrent.futures.ProcessPoolExecutor(min(xargs.jobs, len(xargs.ufl_file))) as executor:
+            futures = [executor.submit(_compile_file_in_worker, filename, xargs.output_directory, parameters,
+                                       xargs.visualise, xargs.profile, xargs.force, xargs.metrics is not None)
+                       for filename in xargs.ufl_file]
+            for filename, future in zip(xargs.ufl_file, futures):
+                log, error, records[filename] = future.result()
+                sys.stderr.write(log)
+                if error is not None:
+                    logger.error(f"Compilation of {filename} failed:\n{error[1]}")
+                    failed.append((filename, error[0]))
+    else:
+        for filename in xargs.ufl_file:
+            records[filename] = {} if xargs.metrics is not None else None
+            try:
+                compile_file(filename, xargs.output_directory, parameters, xargs.visualise, xargs.profile,
+                             xargs.force, records[filename])
+            except Exception as e:
+                logger.error(f"Compilation of {filename} failed:\n{traceback.format_exc()}")
+                failed.append((filename, f"{type(e).__name__}: {e}"))
+
+    # Write the metrics of the files which compiled
+    if xargs.metrics is not None:
+        failed_files = {filename for filename, _ in failed}
+        with open(xargs.metrics, "w") as f:
+            json.dump({filename: record for filename, record in records.items() if filename not in failed_files},
+                      f, indent=2)
+
+    if failed:
+        logger.error(f"{len(failed)} of {len(xargs.ufl_file)} files failed to compile:\n"
+                     + "\n".join(f"  {filename}: {message}" for filename, message in failed))
+        return 1
     return 0
@@ -0,0 +1,80 @@
+# Copyright (C) 2022 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Metrics of the compiler stages and of the generated kernels.
+
+Passing a dict as the argument ``metrics`` of
+ffcx.compiler.compile_ufl_objects, or of the JIT functions compile_forms,
+compile_elements and compile_expressions, fills it in with a record
+of the compilation, which can be written as JSON:
+
+- ``stages``: the wall time (``time``, seconds) and the peak of memory
+  allocated in Python above the start of the stage (``peak_memory``,
+  bytes, if memory is traced) of the compiler stages ``analysis``,
+  ``ir``, ``codegeneration`` and ``formatting``, and of the C compilation
+  (``compile``), the request to the compile server (``remote``) and the
+  loading of the module (``load``) by the JIT;
+- ``code_cache_hit``: whether stages 1-3 were skipped by the code cache;
+- ``num_integrals``: the number of integrals (without code cache hit);
+- ``kernels``: for each integral and expression (without code cache
+  hit), its name, kind,
+  integral type, number of quadrature rules, number of nodes of its
+  scalar graph (as built by build_scalar_graph) and of the argument
+  factorization, number of unique tables and bytes of generated code;
+- ``code_bytes``: bytes of the generated header (``h``) and source (``c``);
+- ``module``: how the JIT obtained the module, one of ``loaded`` (by
+  this process before), ``cached`` (from the cache directory) or
+  ``compiled``.
+
+Peak memory is only recorded while tracemalloc traces memory, as
+started by ``tracemalloc.start()`` or ``python -X tracemalloc``.
+Tracing slows down compilation several times, so times are only
+comparable between records with or between records without memory.
+"""
+
+import contextlib
+import time
+import tracemalloc
+
+
+@contextlib.contextmanager
+def stage(metrics, name):
+    """Record the time and peak memory of the stage name in the context, if metrics is not None."""
+    if metrics is None:
+        yield
+        return
+
+    start = _reset_peak() if tracemalloc.is_tracing() else None
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record = {"time": time.perf_counter() - t0}
+        if start is not None:
+            record["peak_memory"] = tracemalloc.get_traced_memory()[1] - start
+        metrics.setdefault("stages", {})[name] = record
+
+
+def _reset_peak():
+    """Reset the peak of traced memory, and return the traced memory it is counted from."""
+    if hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+        return tracemalloc.get_traced_memory()[0]
+    # Python < 3.9
+    tracemalloc.clear_traces()
+    return 0
+
+
+def kernel_metrics(kind, kernel_ir, name, code):
+    """Return the metrics of the integral or expression with IR kernel_ir, and code blocks code."""
+    integrands = kernel_ir.integrand.values()
+    return {"name": name,
+            "kind": kind,
+            "integral_type": kernel_ir.integral_type,
+            "quadrature_rules": len(kernel_ir.integrand),
+            "scalar_graph_nodes": sum(integrand["scalar_graph_nodes"] for integrand in integrands),
+            "factorization_nodes": sum(len(integrand["factorization"].nodes) for integrand in integrands),
+            "unique_tables": len(kernel_ir.unique_tables),
+            "code_bytes": sum(len(c) for c in code)}
@@ -4,18 +4,64 @@
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
+import functools
 import hashlib
+import weakref
 
 import ufl
 
 import ffcx
 
+# Signatures of UFL expressions, weakly keyed on the expression. Forms
+# cache their own signature, and elements their repr.
+_expression_signatures = weakref.WeakKeyDictionary()
+
+
+def _expression_signature(expr):
+    """Compute the signature of a UFL expression, independent of the numbering of its terminals."""
+    try:
+        return _expression_signatures[expr]
+    except KeyError:
+        pass
+
+    coeffs = ufl.algorithms.extract_coefficients(expr)
+    consts = ufl.algorithms.analysis.extract_constants(expr)
+    args = ufl.algorithms.analysis.extract_arguments(expr)
+
+    rn = dict()
+    rn.update(dict((c, i) for i, c in enumerate(coeffs)))
+    rn.update(dict((c, i) for i, c in enumerate(consts)))
+    rn.update(dict((c, i) for i, c in enumerate(args)))
+
+    domains = []
+    for coeff in coeffs:
+        domains.append(*coeff.ufl_domains())
+    for arg in args:
+        domains.append(*arg.ufl_function_space().ufl_domains())
+    for gc in ufl.algorithms.analysis.extract_type(expr, ufl.classes.GeometricQuantity):
+        domains.append(*gc.ufl_domains())
+
+    domains = ufl.algorithms.analysis.unique_tuple(domains)
+    rn.update(dict((d, i) for i, d in enumerate(domains)))
+
+    signature = ufl.algorithms.signature.compute_expression_signature(expr, rn)
+    _expression_signatures[expr] = signature
+    return signature
+
+
+@functools.lru_cache(maxsize=256)
+def _signature_hash(object_signature, kind):
+    """Return SHA-1 hash of the signature of UFL objects, before the tag is added."""
+    signatures = [object_signature, str(ffcx.__version__), ffcx.codegeneration.get_signature(), kind, ""]
+    return hashlib.sha1(";".join(signatures).encode('utf-8'))
+
 
 def compute_signature(ufl_objects, tag):
     """Compute the signature hash.
 
     Based on the UFL type of the objects and an additional optional
-    'tag'.
+    'tag'. The signatures of the objects are cached, such that names of
+    several objects generated from the same form only hash the tag.
     """
     object_signature = ""
     for ufl_object in ufl_objects:
@@ -30,30 +76,8 @@ def compute_signature(ufl_objects, tag):
             expr = ufl_object[0]
             points = ufl_object[1]
 
-            # FIXME Move this to UFL, cache the computation
-            coeffs = ufl.algorithms.extract_coefficients(expr)
-            consts = ufl.algorithms.analysis.extract_constants(expr)
-            args = ufl.algorithms.analysis.extract_arguments(expr)
-
-            rn = dict()
-            rn.update(dict((c, i) for i, c in enumerate(coeffs)))
-            rn.update(dict((c, i) for i, c in enumerate(consts)))
-            rn.update(dict((c, i) for i, c in enumerate(args)))
-
-            domains = []
-            for coeff in coeffs:
-                domains.append(*coeff.ufl_domains())
-            for arg in args:
-                domains.append(*arg.ufl_function_space().ufl_domains())
-            for gc in ufl.algorithms.analysis.extract_type(expr, ufl.classes.GeometricQuantity):
-                domains.append(*gc.ufl_domains())
-
-            domains = ufl.algorithms.analysis.unique_tuple(domains)
-            rn.update(dict((d, i) for i, d in enumerate(domains)))
-
             # Hash on UFL signature and points
-            signature = ufl.algorithms.signature.compute_expression_signature(expr, rn)
-            object_signature += signature
+            object_signature += _expression_signature(expr)
             object_signature += repr(points)
 
             kind = "expression"
@@ -61,9 +85,9 @@ def compute_signature(ufl_objects, tag):
             raise RuntimeError(f"Unknown ufl object type {ufl_object.__class__.__name__}")
 
     # Build combined signature
-    signatures = [object_signature, str(ffcx.__version__), ffcx.codegeneration.get_signature(), kind, tag]
-    string = ";".join(signatures)
-    return hashlib.sha1(string.encode('utf-8')).hexdigest()
+    h = _signature_hash(object_signature, kind).copy()
+    h.update(tag.encode('utf-8'))
+    return h.hexdigest()
 
 
 def integral_name(original_form, integral_type, form_id, subdomain_id, prefix):
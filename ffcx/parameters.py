@@ -23,6 +23,22 @@ FFCX_DEFAULT_PARAMETERS = {
                       float, double, float _Complex, double _Complex, ..."""),
     "tabulate_tensor_void":
         (False, "True to generate empty tabulation kernels."),
+    "batch_size":
+        (0, """Number of cells evaluated together in the innermost loop of the batched tabulate_tensor kernel.
+               (0 means no batched kernel is generated)"""),
+    "preintegrate":
+        (False, """Integrate products of basis functions at compile time for blocks with piecewise constant factors,
+               when this needs fewer flops than the quadrature loop."""),
+    "premultiply":
+        (False, """Fold quadrature weights into an argument table for blocks with piecewise constant factors
+               which are not preintegrated."""),
+    "sum_factorization":
+        (False, """Use sum factorization for cell integrals over quadrilaterals and hexahedra.
+               Can be set per integral with the metadata key 'sum_factorization'."""),
+    "quadrature_permutation_maps":
+        (False, """Store tables of interior facet integrals in unpermuted quadrature points only, and map the
+               points of each facet permutation to them at runtime. Used for quadrature rules invariant under
+               the facet permutations."""),
     "table_rtol":
         (1e-6, "Relative precision to use when comparing finite element table values for table reuse."),
     "table_atol":
@@ -33,6 +49,16 @@ FFCX_DEFAULT_PARAMETERS = {
                (-1 means no alignment assumed, safe option)"""),
     "padlen":
         (1, "Pads every declared array in tabulation kernel such that its last dimension is divisible by given value."),
+    "code_cache_dir":
+        ("", """Directory of the on-disk cache of generated code, which is used to skip analysis, representation
+               and code generation for objects compiled before. Empty to disable the cache."""),
+    "code_cache_size":
+        (256, "Size limit of the code cache in MiB, least recently used code is removed beyond it (0 for no limit)."),
+    "jit_cache_size":
+        (0, """Size limit of the JIT cache directory in MiB, least recently used modules are removed beyond it
+               (0 for no limit)."""),
+    "jit_cache_entries":
+        (0, "Limit of modules and object files in the JIT cache directory (0 for no limit)."),
     "verbosity":
         (30, "Logger verbosity. Follows standard logging library levels, i.e. INFO=20, DEBUG=10, etc.")
 }
@@ -108,7 +134,8 @@ def get_parameters(priority_parameters: Optional[dict] = None) -> dict:
 
     logger.setLevel(parameters["verbosity"])
 
-    logger.info("Final parameter values")
-    logger.info(pprint.pformat(parameters))
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Final parameter values")
+        logger.info(pprint.pformat(parameters))
 
     return parameters
@@ -0,0 +1,185 @@
+# Copyright (C) 2022 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Compile server for the JIT.
+
+The server is a long running process listening on a Unix domain socket,
+which compiles UFL objects sent by JIT clients and returns the path of
+the compiled module. Imports, Basix elements, element tables and other
+state of the compiler are kept between requests. Start it with
+
+    ffcx-server --socket /tmp/ffcx.sock
+
+and set the environment variable FFCX_SERVER_SOCKET=/tmp/ffcx.sock in the
+processes which call compile_forms, compile_elements or
+compile_expressions. These then send their objects to the server, and
+fall back to compiling locally if the server is not available.
+
+Modules are compiled in the cache directory of the request, or in the
+cache directory of the server if the request has none. Requests are
+unpickled, so the socket is only accessible by the user running the
+server.
+"""
+
+import argparse
+import logging
+import os
+import pickle
+import signal
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import tempfile
+import traceback
+
+logger = logging.getLogger("ffcx")
+
+# Environment variable with the path of the socket of the server used by the JIT
+socket_variable = "FFCX_SERVER_SOCKET"
+
+# Exceptions raised by pickling objects which cannot be pickled, such as
+# objects holding handles of C++ objects
+pickling_errors = (pickle.PicklingError, TypeError, AttributeError)
+
+_header = struct.Struct("!Q")
+
+
+def dumps(message):
+    """Return a pickled message, as sent by send and request."""
+    return pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def send(sock, message):
+    """Send a pickled message, preceded by its size.
+
+    The message is pickled before anything is sent, so nothing is sent
+    if it cannot be pickled.
+    """
+    _send_bytes(sock, dumps(message))
+
+
+def _send_bytes(sock, data):
+    sock.sendall(_header.pack(len(data)) + data)
+
+
+def receive(sock):
+    """Receive a message sent by send."""
+    size, = _header.unpack(_receive_bytes(sock, _header.size))
+    return pickle.loads(_receive_bytes(sock, size))
+
+
+def _receive_bytes(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(min(size - len(data), 2**20))
+        if not chunk:
+            raise ConnectionError("Connection closed by peer.")
+        data += chunk
+    return bytes(data)
+
+
+def request(socket_path, data):
+    """Send a request pickled by dumps to the server listening on socket_path and return the response."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(socket_path))
+        _send_bytes(sock, data)
+        return receive(sock)
+
+
+class CompileHandler(socketserver.BaseRequestHandler):
+    """Compile the objects of a request with the JIT, and respond with the path of the module."""
+
+    def handle(self):
+        import ffcx.codegeneration.jit
+
+        try:
+            message = receive(self.request)
+        except (ConnectionError, pickle.UnpicklingError, EOFError) as e:
+            logger.warning(f"Invalid request: {e}")
+            return
+
+        if message.get("version") != ffcx.__version__:
+            send(self.request, {"refused": f"server runs FFCx version {ffcx.__version__}"})
+            return
+
+        compile_objects = {"elements": ffcx.codegeneration.jit.compile_elements,
+                           "forms": ffcx.codegeneration.jit.compile_forms,
+                           "expressions": ffcx.codegeneration.jit.compile_expressions}[message["kind"]]
+        kwargs = message["kwargs"]
+        if kwargs["cache_dir"] is None:
+            kwargs["cache_dir"] = self.server.cache_dir
+
+        try:
+            _, module, code = compile_objects(message["objects"], **kwargs)
+            response = {"module": module.__file__, "code": code}
+        except Exception as e:
+            logger.info(f"Compilation failed: {e}")
+            response = {"error": e, "traceback": traceback.format_exc()}
+
+        try:
+            send(self.request, response)
+        except pickling_errors:
+            # Exception which cannot be pickled
+            send(self.request, {"error": RuntimeError(response["traceback"])})
+
+
+class CompileServer(socketserver.UnixStreamServer):
+    """Server handling one compilation at a time, as the JIT is not thread safe."""
+
+    request_queue_size = 128
+
+    def __init__(self, socket_path, cache_dir):
+        self.cache_dir = cache_dir
+        super().__init__(str(socket_path), CompileHandler)
+
+    def server_bind(self):
+        # Create the socket accessible by the owner only, as requests are unpickled
+        umask = os.umask(0o077)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+        os.chmod(self.server_address, stat.S_IRUSR | stat.S_IWUSR)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="FFCx compile server for the JIT")
+    parser.add_argument("--socket", required=True, help="path of the Unix domain socket to listen on")
+    parser.add_argument("--cache-dir", help="cache directory for requests without one (default: temporary)")
+    parser.add_argument("--verbosity", type=int, default=logging.WARNING, help="logger verbosity")
+    xargs = parser.parse_args(args)
+
+    logging.basicConfig(level=xargs.verbosity)
+
+    # Compile in this process, not in another server
+    os.environ.pop(socket_variable, None)
+
+    # Import the compiler before the first request
+    import ffcx.codegeneration.jit  # noqa: F401
+
+    # Remove the socket on termination
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    if os.path.lexists(xargs.socket):
+        if not stat.S_ISSOCK(os.lstat(xargs.socket).st_mode):
+            parser.error(f"{xargs.socket} exists and is not a socket")
+        os.unlink(xargs.socket)
+    cache_dir = xargs.cache_dir or tempfile.mkdtemp(prefix="ffcx-server-")
+
+    with CompileServer(xargs.socket, cache_dir) as server:
+        logger.info(f"FFCx compile server listening on {xargs.socket}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(xargs.socket)
+    return 0
+
+
+if __name__ == "__main__":
+    main()
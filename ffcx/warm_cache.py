@@ -0,0 +1,115 @@
+# Copyright (C) 2022 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+"""Precompile forms, elements and expressions into a JIT cache directory.
+
+Every object of the inputs is compiled with the JIT, on its own as
+compiled by solvers, for every combination of scalar type and C
+compiler arguments given, in a pool of processes. Inputs are UFL files,
+or names of Python modules with the lists (or dicts) ``forms``,
+``elements`` and ``expressions``. Run as
+
+    ffcx warm-cache --cache-dir ~/.cache/fenics --scalar-types double "double _Complex" \
+        --compile-args="-O2 -g0" HyperElasticity.py
+
+"""
+
+import argparse
+import concurrent.futures
+import importlib
+import logging
+import os
+import pathlib
+import shlex
+import time
+import traceback
+
+import ufl
+
+logger = logging.getLogger("ffcx")
+
+parser = argparse.ArgumentParser(prog="ffcx warm-cache",
+                                 description="Precompile UFL objects into a JIT cache directory")
+parser.add_argument("--cache-dir", required=True, help="JIT cache directory")
+parser.add_argument("--scalar-types", nargs="+", default=["double"],
+                    help="scalar types to compile for (default: double)")
+parser.add_argument("--compile-args", type=shlex.split, action="append",
+                    help="C compiler arguments to compile with, as one string (--compile-args=\"-O2 -g0\"), "
+                         "can be repeated (default: those of the JIT)")
+parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                    help="number of compiling processes (default: number of CPUs)")
+parser.add_argument("--timeout", type=float, default=600,
+                    help="seconds to wait for a compilation by another process (default: 600)")
+parser.add_argument("inputs", nargs="+", help="UFL files or Python modules")
+
+
+def load_objects(source):
+    """Return (kind, name, object) of the forms, elements and expressions of a UFL file or Python module."""
+    if pathlib.Path(source).exists():
+        ufd = ufl.algorithms.load_ufl_file(source)
+        objects = {"forms": ufd.forms, "elements": ufd.elements, "expressions": ufd.expressions}
+        names = ufd.object_names
+    else:
+        module = importlib.import_module(source)
+        objects = {kind: getattr(module, kind, []) for kind in ("forms", "elements", "expressions")}
+        names = {}
+
+    labelled = []
+    for kind, objs in objects.items():
+        items = objs.items() if isinstance(objs, dict) else enumerate(objs)
+        for key, obj in items:
+            if isinstance(key, int):
+                name = names.get(id(obj)) or (kind == "expressions" and names.get(id(obj[0]))) or f"{kind}[{key}]"
+            else:
+                name = key
+            labelled.append((kind, f"{source}:{name}", obj))
+    return labelled
+
+
+def compile_object(kind, obj, scalar_type, compile_args, cache_dir, timeout):
+    """Compile one object with the JIT. Returns (status, seconds, error message)."""
+    import ffcx.codegeneration.jit
+    compile_objects = {"forms": ffcx.codegeneration.jit.compile_forms,
+                       "elements": ffcx.codegeneration.jit.compile_elements,
+                       "expressions": ffcx.codegeneration.jit.compile_expressions}[kind]
+    t0 = time.perf_counter()
+    try:
+        _, _, code = compile_objects([obj], parameters={"scalar_type": scalar_type}, cache_dir=cache_dir,
+                                     timeout=timeout, cffi_extra_compile_args=compile_args)
+    except Exception as e:
+        logger.debug(traceback.format_exc())
+        return "failed", time.perf_counter() - t0, f"{type(e).__name__}: {e}"
+    return ("hit" if code == (None, None) else "compiled"), time.perf_counter() - t0, None
+
+
+def main(args=None):
+    xargs = parser.parse_args(args)
+    cache_dir = str(pathlib.Path(xargs.cache_dir).expanduser())
+
+    objects = []
+    for source in xargs.inputs:
+        objects += load_objects(source)
+    matrix = [(scalar_type, compile_args) for scalar_type in xargs.scalar_types
+              for compile_args in (xargs.compile_args or [None])]
+
+    t0 = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max(xargs.jobs, 1)) as executor:
+        jobs = [(name, scalar_type, compile_args,
+                 executor.submit(compile_object, kind, obj, scalar_type, compile_args, cache_dir, xargs.timeout))
+                for kind, name, obj in objects for scalar_type, compile_args in matrix]
+
+        print(f"{'status':<10}{'time [s]':>10}  object")
+        counts = {"hit": 0, "compiled": 0, "failed": 0}
+        for name, scalar_type, compile_args, future in jobs:
+            status, seconds, error = future.result()
+            counts[status] += 1
+            args = "default" if compile_args is None else " ".join(compile_args)
+            print(f"{status:<10}{seconds:>10.2f}  {name} ({scalar_type}, {args})")
+            if error is not None:
+                print(f"{'':<22}{error}")
+
+    print(f"{len(jobs)} compilations in {time.perf_counter() - t0:.2f} s: {counts['compiled']} compiled, "
+          f"{counts['hit']} cache hits, {counts['failed']} failed")
+    return 1 if counts["failed"] else 0
@@ -4,9 +4,24 @@
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
+import fcntl
+import gc
+import importlib.machinery
+import os
+import signal
 import sys
+import threading
+import time
+import weakref
+from pathlib import Path
 
+import ffcx.cache
+import ffcx.codegeneration.codegeneration
 import ffcx.codegeneration.jit
+import ffcx.compiler
+import ffcx.parameters
+import numpy as np
+import pytest
 import ufl
 
 
@@ -33,3 +48,351 @@ def test_cache_modes(compile_args):
 
     assert(newname == tmpname)
     assert(newfile != tmpfile)
+
+
+def test_code_cache(tmp_path):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    a = ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx
+    parameters = ffcx.parameters.get_parameters({"code_cache_dir": str(tmp_path)})
+
+    code = ffcx.compiler.compile_ufl_objects([a], prefix="cached", parameters=parameters)
+    cache = ffcx.cache.get_code_cache(parameters)
+    assert len(cache.entries()) == 1
+
+    # Second compilation takes the generated code from the cache
+    cached_code = ffcx.compiler.compile_ufl_objects([a], prefix="cached", parameters=parameters)
+    assert cached_code == code
+    assert len(cache.entries()) == 1
+
+    # Changing the generated code gives a new entry
+    ffcx.compiler.compile_ufl_objects([a], prefix="cached", parameters={**parameters, "padlen": 4})
+    assert len(cache.entries()) == 2
+
+
+def test_code_cache_key(monkeypatch):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    a = ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx
+    parameters = ffcx.parameters.get_parameters()
+    key = ffcx.cache.compute_code_key([a], {}, "cached", parameters)
+    assert ffcx.cache.compute_code_key([a], {}, "cached", parameters) == key
+
+    # Code generated by another version of FFCx, or for another ufcx.h,
+    # is not used
+    monkeypatch.setattr(ffcx, "__version__", ffcx.__version__ + ".other")
+    assert ffcx.cache.compute_code_key([a], {}, "cached", parameters) != key
+    monkeypatch.undo()
+    monkeypatch.setattr(ffcx.codegeneration, "_signature", "other")
+    assert ffcx.cache.compute_code_key([a], {}, "cached", parameters) != key
+
+
+def test_code_cache_eviction(tmp_path):
+    code = ffcx.codegeneration.codegeneration.code_blocks(
+        elements=[("decl", 1000 * "x")], dofmaps=[], integrals=[], forms=[], expressions=[])
+    cache = ffcx.cache.CodeCache(tmp_path, max_size=2500)
+    for i in range(5):
+        cache.put(f"entry{i}", code)
+        os.utime(cache.filename(f"entry{i}"), (i, i))
+    assert [e[0].name for e in cache.entries()] == ["entry3.code.json", "entry4.code.json"]
+
+    # Using an entry keeps it in the cache
+    assert cache.get("entry3") == code
+    cache.put("entry5", code)
+    assert cache.get("entry4") is None
+    assert cache.get("entry3") == code
+
+
+def test_code_cache_jit(tmp_path, compile_args):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx]
+    parameters = {"code_cache_dir": str(tmp_path / "code")}
+
+    _, module0, (_, code0) = ffcx.codegeneration.jit.compile_forms(
+        forms, parameters=parameters, cache_dir=tmp_path / "jit", cffi_extra_compile_args=compile_args)
+    _, module1, (_, code1) = ffcx.codegeneration.jit.compile_forms(
+        forms, parameters=parameters, cache_dir=tmp_path / "jit", cffi_extra_compile_args=compile_args + ["-O0"])
+
+    # Modules differing in compiler arguments share the generated code
+    assert module0.__name__ != module1.__name__
+    assert code0 == code1
+    assert len(ffcx.cache.get_code_cache(parameters).entries()) == 1
+
+
+def test_cache_stale_owner(tmp_path, compile_args):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(u, v) * ufl.dx]
+
+    # C file of a compilation abandoned by a dead process, which holds no lock
+    _, module, _ = ffcx.codegeneration.jit.compile_forms(forms, cffi_extra_compile_args=compile_args)
+    tmp_path.joinpath(module.__name__ + ".c").touch()
+
+    t0 = time.time()
+    compiled_forms, _, _ = ffcx.codegeneration.jit.compile_forms(
+        forms, cache_dir=tmp_path, timeout=60, cffi_extra_compile_args=compile_args)
+    assert time.time() - t0 < 60
+    assert compiled_forms[0].rank == 2
+
+
+def test_cache_wait_for_owner(tmp_path):
+    lock = os.open(tmp_path / "libffcx_test.lock", os.O_RDWR | os.O_CREAT)
+    fcntl.flock(lock, fcntl.LOCK_EX)
+
+    # Owner holding the lock beyond the timeout, without leaving a waiting
+    # thread or the alarm ending the wait
+    threads = threading.active_count()
+    handler = signal.getsignal(signal.SIGALRM)
+    with pytest.raises(TimeoutError):
+        ffcx.codegeneration.jit.get_cached_module("libffcx_test", [], tmp_path, 0.2)
+    assert threading.active_count() == threads
+    assert signal.getsignal(signal.SIGALRM) is handler
+    assert signal.getitimer(signal.ITIMER_REAL) == (0.0, 0.0)
+
+    # Outside the main thread, the lock is polled
+    result = []
+    other = os.open(tmp_path / "libffcx_test.lock", os.O_RDWR)
+    waiter = threading.Thread(target=lambda: result.append(ffcx.codegeneration.jit._lock(other, fcntl.LOCK_SH, 0.2)))
+    waiter.start()
+    waiter.join()
+    os.close(other)
+    assert result == [False]
+
+    # Owner failing is detected as soon as it releases the lock
+    def fail():
+        time.sleep(0.2)
+        (tmp_path / "libffcx_test.c.failed").touch()
+        os.close(lock)
+
+    threading.Thread(target=fail).start()
+    t0 = time.time()
+    with pytest.raises(RuntimeError):
+        ffcx.codegeneration.jit.get_cached_module("libffcx_test", [], tmp_path, 60)
+    assert time.time() - t0 < 10
+
+    # Next call takes over compilation
+    _, _, lock = ffcx.codegeneration.jit.get_cached_module("libffcx_test", [], tmp_path, 60)
+    assert lock is not None
+    assert not (tmp_path / "libffcx_test.c.failed").exists()
+    os.close(lock)
+
+
+def test_cache_incremental_units(tmp_path, compile_args):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    k = ufl.Coefficient(element)
+
+    def compile_form(c):
+        form = ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx(1) + k * u * v * ufl.dx(2) + c * u * v * ufl.ds
+        compiled_forms, module, _ = ffcx.codegeneration.jit.compile_forms(
+            [form], cache_dir=tmp_path, cffi_extra_compile_args=compile_args, num_workers=2)
+        return len(list(tmp_path.glob("ffcx_unit_*.o")))
+
+    compile_form(1.0)
+    num_objects = compile_form(2.0)
+
+    # Changing one integral recompiles the integral and the form only
+    assert compile_form(3.0) == num_objects + 2
+
+
+def test_cache_units_relative_cache_dir(tmp_path, monkeypatch, compile_args):
+    monkeypatch.chdir(tmp_path)
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + u * v * ufl.ds]
+
+    compiled_forms, _, _ = ffcx.codegeneration.jit.compile_forms(
+        forms, cache_dir="cache", cffi_extra_compile_args=compile_args, num_workers=2)
+    assert compiled_forms[0].rank == 2
+
+    # Objects are compiled into the cache directory itself, without changing the working directory
+    assert os.getcwd() == str(tmp_path)
+    assert len(list(tmp_path.joinpath("cache").glob("ffcx_unit_*.o"))) > 0
+    assert not [p for p in tmp_path.joinpath("cache").iterdir() if p.is_dir()]
+    assert [p.name for p in tmp_path.iterdir()] == ["cache"]
+
+
+def test_cache_loaded_module(tmp_path, compile_args):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx]
+
+    compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms(
+        forms, cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+    assert code != (None, None)
+
+    # Same forms, and equal forms, return the loaded module
+    compiled_forms2, module2, code = ffcx.codegeneration.jit.compile_forms(
+        forms, cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+    assert module2 is module
+    assert compiled_forms2 == compiled_forms
+    assert code == (None, None)
+
+    forms_equal = [ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx]
+    _, module2, _ = ffcx.codegeneration.jit.compile_forms(
+        forms_equal, cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+    assert module2 is module
+
+    # Modules removed from sys.modules are loaded again
+    del sys.modules[module.__name__]
+    _, module2, _ = ffcx.codegeneration.jit.compile_forms(
+        forms, cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+    assert module2 is not module
+    assert module2.__name__ == module.__name__
+
+
+def test_cache_loaded_module_parameters(tmp_path, monkeypatch, compile_args):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [u * v * ufl.dx]
+    _, module, _ = ffcx.codegeneration.jit.compile_forms(
+        forms, cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+
+    # Parameters from configuration files are part of the key
+    monkeypatch.setattr(ffcx.parameters, "_load_parameters", lambda: ({}, {"table_rtol": 1e-5}))
+    _, module2, code = ffcx.codegeneration.jit.compile_forms(
+        forms, cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+    assert module2.__name__ != module.__name__
+    assert code != (None, None)
+
+    # Parameters resolving to the same values return the loaded module
+    _, module3, code = ffcx.codegeneration.jit.compile_forms(
+        forms, parameters={"table_rtol": 1e-5}, cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+    assert module3 is module2
+    assert code == (None, None)
+
+
+def test_cache_loaded_module_references(tmp_path, compile_args):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    expression = ufl.grad(u)
+    points = np.array([[0.5, 0.5]])
+    ffcx.codegeneration.jit.compile_elements([element], cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+    ffcx.codegeneration.jit.compile_expressions([(expression, points)], cache_dir=tmp_path,
+                                                cffi_extra_compile_args=compile_args)
+    ffcx.codegeneration.jit.compile_forms([u * v * ufl.dx], cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+
+    # Compiled objects are not kept alive by the module names of the
+    # objects
+    stores = ffcx.codegeneration.jit._module_name_stores
+    assert id(expression) in stores and id(points) in stores
+    refs = [weakref.ref(expression), weakref.ref(points)]
+    del u, v, expression, points
+    gc.collect()
+    assert [ref() for ref in refs] == [None, None]
+    assert all(ref() is not None for ref, _ in stores.values())
+
+
+def test_module_cache_eviction(tmp_path, compile_args):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    modules = []
+    for i in range(3):
+        _, module, _ = ffcx.codegeneration.jit.compile_forms(
+            [(i + 1.0) * u * v * ufl.dx], cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+        modules.append(module.__name__)
+
+    # Order modules by last use
+    for i, name in enumerate(modules):
+        t = time.time() - 1000 + 100 * i
+        os.utime(tmp_path / (name + ".c.cached"), (t, t))
+    cache = ffcx.cache.ModuleCache(tmp_path, max_entries=2)
+    entries = cache.entries()
+    assert [e.name for e in entries] == modules
+    assert all(e.state == "ready" for e in entries)
+
+    # Module being compiled is not removed
+    lock = os.open(tmp_path / (modules[0] + ".lock"), os.O_RDWR)
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    try:
+        assert [e.name for e in cache.evict()] == modules[1:2]
+    finally:
+        os.close(lock)
+    assert cache.evict() == []
+    cache.max_entries = 1
+    assert [e.name for e in cache.evict()] == modules[0:1]
+    assert [e.name for e in cache.entries()] == modules[2:]
+    assert not list(tmp_path.glob(modules[0] + ".*"))
+
+    # Recently used modules are kept
+    os.utime(tmp_path / (modules[2] + ".c.cached"))
+    cache.max_entries = 0
+    assert cache.evict() == []
+
+
+def test_module_cache_mark_used(tmp_path, compile_args):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    _, module, _ = ffcx.codegeneration.jit.compile_forms(
+        [4.0 * u * v * ufl.dx], cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+    marker = tmp_path / (module.__name__ + ".c.cached")
+
+    def load():
+        del sys.modules[module.__name__]
+        _, _, code = ffcx.codegeneration.jit.compile_forms(
+            [4.0 * u * v * ufl.dx], cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+        assert code == (None, None)
+
+    # Loads do not write to the marker of a recently used module
+    t = time.time() - 10
+    os.utime(marker, (t, t))
+    load()
+    assert marker.stat().st_mtime == t
+
+    t = time.time() - 1000
+    os.utime(marker, (t, t))
+    load()
+    assert marker.stat().st_mtime > time.time() - 10
+
+
+def test_module_cache_main(tmp_path, compile_args, capsys):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    _, module, _ = ffcx.codegeneration.jit.compile_forms(
+        [5.0 * u * v * ufl.dx], cache_dir=tmp_path, cffi_extra_compile_args=compile_args)
+
+    # Abandoned compilation
+    abandoned = tmp_path / "libffcx_forms_abandoned.c"
+    abandoned.touch()
+    os.utime(abandoned, (time.time() - 1000, time.time() - 1000))
+
+    assert ffcx.cache.main(["stats", str(tmp_path)]) == 0
+    out = capsys.readouterr().out
+    assert "ready" in out and "total" in out
+
+    assert ffcx.cache.main(["verify", str(tmp_path)]) == 1
+    assert "libffcx_forms_abandoned: compilation was abandoned" in capsys.readouterr().out
+    assert ffcx.cache.main(["verify", "--remove", str(tmp_path)]) == 0
+    assert not abandoned.exists()
+    assert ffcx.cache.main(["verify", str(tmp_path)]) == 0
+
+    assert ffcx.cache.main(["prune", "--max-entries", "0", str(tmp_path)]) == 0
+    assert "Removed 0 entries" in capsys.readouterr().out
+    assert ffcx.cache.main(["clear", str(tmp_path)]) == 0
+    assert "Removed 1 entries" in capsys.readouterr().out
+    assert not list(tmp_path.glob(module.__name__ + ".*"))
+
+
+def test_module_cache_archive(tmp_path, compile_args, monkeypatch):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [7.0 * u * v * ufl.dx]
+    _, module, _ = ffcx.codegeneration.jit.compile_forms(
+        forms, cache_dir=tmp_path / "a", cffi_extra_compile_args=compile_args)
+    assert ffcx.cache.ModuleCache(tmp_path / "a").read_manifest() == {module.__name__: Path(module.__file__)}
+
+    archive = str(tmp_path / "cache.tar.gz")
+    assert ffcx.cache.main(["export", str(tmp_path / "a"), archive]) == 0
+    assert ffcx.cache.main(["import", str(tmp_path / "b"), archive]) == 0
+    assert ffcx.cache.ModuleCache(tmp_path / "b").import_archive(archive) == []
+
+    # Imported module is loaded from the file in the manifest, without
+    # searching the directory
+    del sys.modules[module.__name__]
+    monkeypatch.setattr(importlib.machinery, "FileFinder", None)
+    compiled_forms, module_b, code = ffcx.codegeneration.jit.compile_forms(
+        forms, cache_dir=tmp_path / "b", cffi_extra_compile_args=compile_args)
+    assert code == (None, None)
+    assert module_b.__file__ == str(tmp_path / "b" / Path(module.__file__).name)
+    assert compiled_forms[0].rank == 2
@@ -4,9 +4,12 @@
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
+import json
 import os
 import os.path
+import shutil
 import subprocess
+import sys
 
 
 def test_cmdline_simple():
@@ -19,3 +22,73 @@ def test_visualise():
     subprocess.run(["ffcx", "--visualise", "Poisson.py"])
     assert os.path.isfile("S.pdf")
     assert os.path.isfile("F.pdf")
+
+
+def test_warm_cache(tmp_path):
+    os.chdir(os.path.dirname(__file__))
+    args = ["ffcx", "warm-cache", "--cache-dir", str(tmp_path), "--scalar-types", "double", "float", "-j", "2",
+            "Poisson.py"]
+    result = subprocess.run(args, capture_output=True, text=True)
+    assert result.returncode == 0
+    assert "6 compiled, 0 cache hits" in result.stdout
+
+    result = subprocess.run(args, capture_output=True, text=True)
+    assert result.returncode == 0
+    assert "0 compiled, 6 cache hits" in result.stdout
+    assert "Poisson.py:a (float, default)" in result.stdout
+
+
+def test_cmdline_jobs(tmp_path):
+    os.chdir(os.path.dirname(__file__))
+    for name in ("a.py", "b.py"):
+        shutil.copy("Poisson.py", tmp_path / name)
+    tmp_path.joinpath("broken.py").write_text("a = undefined_name\n")
+
+    files = [str(tmp_path / name) for name in ("a.py", "broken.py", "b.py")]
+    result = subprocess.run(["ffcx", "-j", "2", "-o", str(tmp_path)] + files, capture_output=True, text=True)
+    assert result.returncode == 1
+    assert "1 of 3 files failed to compile" in result.stderr
+    assert "broken.py: NameError" in result.stderr
+    for name in ("a.h", "a.c", "b.h", "b.c"):
+        assert tmp_path.joinpath(name).is_file()
+
+    result = subprocess.run(["ffcx", "-j", "2", "-o", str(tmp_path)] + files[::2], capture_output=True, text=True)
+    assert result.returncode == 0
+
+
+def test_cmdline_up_to_date(tmp_path):
+    os.chdir(os.path.dirname(__file__))
+    args = ["ffcx", "-o", str(tmp_path), "Poisson.py"]
+    subprocess.run(args, check=True)
+    header = tmp_path / "Poisson.h"
+    assert header.read_text().startswith("// FFCx stamp: ")
+
+    # Unchanged files are left untouched
+    os.utime(header, (0, 0))
+    subprocess.run(args, check=True)
+    assert header.stat().st_mtime == 0
+
+    subprocess.run(args + ["--force"], check=True)
+    assert header.stat().st_mtime > 0
+
+    # Other parameters change the stamp
+    stamp = header.read_text().split("\n")[0]
+    subprocess.run(args + ["--scalar_type", "float"], check=True)
+    assert header.read_text().split("\n")[0] != stamp
+
+    # Another version of FFCx or of ufcx.h regenerates the files
+    for patch in ["ffcx.__version__ += '.other'", "ffcx.codegeneration._signature = 'other'"]:
+        stamp = header.read_text().split("\n")[0]
+        code = f"import sys, ffcx, ffcx.codegeneration, ffcx.main; {patch}; sys.exit(ffcx.main.main(sys.argv[1:]))"
+        subprocess.run([sys.executable, "-c", code] + args[1:] + ["--scalar_type", "float"], check=True)
+        assert header.read_text().split("\n")[0] != stamp
+
+
+def test_cmdline_metrics(tmp_path):
+    os.chdir(os.path.dirname(__file__))
+    metrics = tmp_path / "metrics.json"
+    subprocess.run(["ffcx", "-o", str(tmp_path), "--metrics", str(metrics), "Poisson.py"], check=True)
+    record = json.loads(metrics.read_text())["Poisson.py"]
+    assert not record["up_to_date"]
+    assert set(record["stages"]) == {"analysis", "ir", "codegeneration", "formatting"}
+    assert record["num_integrals"] == 2
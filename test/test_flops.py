@@ -37,3 +37,61 @@ def test_flops():
     r = sum(flops_2, 0.) / sum(flops_1, 0.)
 
     assert r > (dofs2**2 / dofs1**2)
+
+
+def test_flops_preintegration():
+    # Both integrands are piecewise constant on affine triangles,
+    # preintegration is never more expensive than the quadrature loop
+    for k in [1, 2, 4]:
+        a = create_form(k)
+        flops = count_flops(a)
+        flops_pi = count_flops(a, {"preintegrate": True})
+        assert len(flops_pi) == 2
+        for f, f_pi in zip(flops, flops_pi):
+            assert f_pi <= f
+            if k > 1:
+                assert f_pi < f
+
+    # Preintegrated cost grows with the block size only
+    k1, k2 = 2, 4
+    dofs1 = (k1 + 1.) * (k1 + 2.) / 2.
+    dofs2 = (k2 + 1.) * (k2 + 2.) / 2.
+    r = sum(count_flops(create_form(k2), {"preintegrate": True})) / \
+        sum(count_flops(create_form(k1), {"preintegrate": True}))
+    assert r < dofs2**2 / dofs1**2
+
+
+def test_flops_preintegration_varying():
+    # Coefficient varies over the cell, no blocks are preintegrated
+    mesh = ufl.Mesh(ufl.VectorElement("Lagrange", "triangle", 1))
+    V = ufl.FunctionSpace(mesh, ufl.FiniteElement("Lagrange", ufl.triangle, 2))
+    u, v, f = ufl.TrialFunction(V), ufl.TestFunction(V), ufl.Coefficient(V)
+    a = f * ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx
+
+    assert count_flops(a, {"preintegrate": True}) == count_flops(a)
+
+
+def test_flops_premultiplied():
+    mesh = ufl.Mesh(ufl.VectorElement("Lagrange", "triangle", 1))
+    V = ufl.FunctionSpace(mesh, ufl.FiniteElement("Lagrange", ufl.triangle, 3))
+    u, v = ufl.TrialFunction(V), ufl.TestFunction(V)
+
+    a = ufl.inner(ufl.jump(u), ufl.jump(v)) * ufl.dS
+    assert count_flops(a, {"premultiply": True})[0] < count_flops(a)[0]
+
+    L = v * ufl.dx
+    flops = count_flops(L)
+    flops_pm = count_flops(L, {"premultiply": True})
+    assert flops_pm[0] < flops[0]
+
+
+def test_flops_sum_factorization():
+    mesh = ufl.Mesh(ufl.VectorElement("Q", "hexahedron", 1))
+    V = ufl.FunctionSpace(mesh, ufl.FiniteElement("Q", ufl.hexahedron, 3))
+    u, v = ufl.TrialFunction(V), ufl.TestFunction(V)
+    a = ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx
+
+    flops = count_flops(a)
+    flops_sf = count_flops(a, {"sum_factorization": True})
+
+    assert 2 * flops_sf[0] < flops[0]
@@ -0,0 +1,37 @@
+# Copyright (C) 2022 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+
+import subprocess
+import sys
+
+import pytest
+
+
+def imported_modules(statement):
+    """Return the modules imported by a fresh interpreter running statement."""
+    code = f"{statement}; import sys; print(' '.join(sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, check=True)
+    return set(result.stdout.decode().split())
+
+
+@pytest.mark.parametrize("statement, unwanted", [
+    ("import ffcx", ["pkg_resources", "ufl", "cffi", "ffcx.codegeneration.jit"]),
+    ("import ffcx.codegeneration.jit", ["cffi", "ffcx.codegeneration.codegeneration", "ffcx.element_interface",
+                                        "ffcx.ir.representation", "ffcx.analysis"]),
+])
+def test_lazy_imports(statement, unwanted):
+    modules = imported_modules(statement)
+    assert not modules.intersection(unwanted)
+
+
+def test_ufcx_declarations():
+    import ffcx.codegeneration.jit
+
+    assert "typedef struct ufcx_form" in ffcx.codegeneration.jit.UFC_FORM_DECL
+    assert "ufcx_tabulate_tensor_float64" in ffcx.codegeneration.jit.UFC_INTEGRAL_DECL
+    assert "<HEADER_DECL>" in ffcx.codegeneration.jit.ufcx_h
+    with pytest.raises(AttributeError):
+        ffcx.codegeneration.jit.UFC_UNKNOWN_DECL
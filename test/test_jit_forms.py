@@ -4,6 +4,11 @@
 #
 # SPDX-License-Identifier:    LGPL-3.0-or-later
 
+import json
+import sys
+import threading
+import tracemalloc
+
 import numpy as np
 import pytest
 
@@ -645,3 +650,403 @@ def test_prism(compile_args):
            ffi.cast('double *', coords.ctypes.data), ffi.NULL, ffi.NULL)
 
     assert np.isclose(sum(b), 0.5)
+
+
+@pytest.mark.parametrize("mode", ["double", "double _Complex"])
+@pytest.mark.parametrize("integral_type", ["cell", "exterior_facet"])
+def test_batched_tabulate_tensor(mode, integral_type, compile_args):
+    cell = ufl.triangle
+    element = ufl.FiniteElement("Lagrange", cell, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    f = ufl.Coefficient(element)
+    kappa = ufl.Constant(cell)
+    measure = ufl.dx if integral_type == "cell" else ufl.ds
+    a = kappa * f * ufl.inner(ufl.grad(u), ufl.grad(v)) * measure
+    forms = [a]
+    compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms(
+        forms, parameters={'scalar_type': mode, 'batch_size': 4}, cffi_extra_compile_args=compile_args)
+
+    ffi = module.ffi
+    np_type = cdtype_to_numpy(mode)
+    integral0 = compiled_forms[0].integrals(getattr(module.lib, integral_type))[0]
+
+    # Number of cells not a multiple of the batch size
+    num_cells = 7
+    rng = np.random.default_rng(7)
+    coords = np.zeros((num_cells, 3, 3), dtype=np.float64)
+    coords[:, 1, 0] = 1.0
+    coords[:, 2, 1] = 1.0
+    coords[:, :, :2] += 0.2 * rng.random((num_cells, 3, 2))
+    w = rng.random((num_cells, 6)).astype(np_type)
+    c = rng.random((num_cells, 1)).astype(np_type)
+    facets = rng.integers(0, 3, (num_cells, 1)).astype(np.intc)
+
+    A = np.zeros((num_cells, 36), dtype=np_type)
+    kernel = getattr(integral0, f"tabulate_tensor_{np_type}")
+    for cell_index in range(num_cells):
+        kernel(ffi.cast(f'{mode} *', A[cell_index].ctypes.data),
+               ffi.cast(f'{mode} *', w[cell_index].ctypes.data),
+               ffi.cast(f'{mode} *', c[cell_index].ctypes.data),
+               ffi.cast('double *', coords[cell_index].ctypes.data),
+               ffi.cast('int *', facets[cell_index].ctypes.data), ffi.NULL)
+
+    # Batched kernel data is stored with the cell index innermost
+    A_batch = np.zeros((36, num_cells), dtype=np_type)
+    w_batch = np.ascontiguousarray(w.T)
+    c_batch = np.ascontiguousarray(c.T)
+    coords_batch = np.ascontiguousarray(coords.reshape(num_cells, -1).T)
+    facets_batch = np.ascontiguousarray(facets.T)
+    kernel = getattr(integral0, f"tabulate_tensor_batch_{np_type}")
+    kernel(num_cells, ffi.cast(f'{mode} *', A_batch.ctypes.data),
+           ffi.cast(f'{mode} *', w_batch.ctypes.data),
+           ffi.cast(f'{mode} *', c_batch.ctypes.data),
+           ffi.cast('double *', coords_batch.ctypes.data),
+           ffi.cast('int *', facets_batch.ctypes.data), ffi.NULL)
+
+    assert np.allclose(A_batch.T, A)
+    assert not np.allclose(A, 0.0)
+
+    # The batched kernels are appended to ufcx_integral, keeping the offsets of the other members
+    assert ffi.offsetof("ufcx_integral", "tabulate_tensor_batch_float32") \
+        > ffi.offsetof("ufcx_integral", "coordinate_element")
+
+
+def tabulate_cell_tensor(module, integral, mode, shape, w, coords):
+    """Return the element tensor of an integral on a single cell without constants."""
+    np_type = cdtype_to_numpy(mode)
+    A = np.zeros(shape, dtype=np_type)
+    c = np.zeros(1, dtype=np_type)
+    ffi = module.ffi
+    getattr(integral, f"tabulate_tensor_{np_type}")(
+        ffi.cast(f'{mode} *', A.ctypes.data), ffi.cast(f'{mode} *', w.ctypes.data),
+        ffi.cast(f'{mode} *', c.ctypes.data), ffi.cast('double *', coords.ctypes.data), ffi.NULL, ffi.NULL)
+    return A
+
+
+@pytest.mark.parametrize("mode", ["double", "double _Complex"])
+@pytest.mark.parametrize("cell,num_vertices", [(ufl.quadrilateral, 4), (ufl.hexahedron, 8)])
+@pytest.mark.parametrize("degree", [1, 2])
+def test_sum_factorization(mode, cell, num_vertices, degree, compile_args):
+    element = ufl.FiniteElement("Q", cell, degree)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    x = ufl.SpatialCoordinate(cell)
+    f = 1.0 + x[0] * x[1]
+    a = (f * ufl.inner(ufl.grad(u), ufl.grad(v)) + ufl.inner(u, v)) * ufl.dx
+    L = ufl.inner(f, v) * ufl.dx
+    forms = [a, L]
+
+    compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms(
+        forms, parameters={'scalar_type': mode}, cffi_extra_compile_args=compile_args)
+    sf_compiled_forms, sf_module, sf_code = ffcx.codegeneration.jit.compile_forms(
+        forms, parameters={'scalar_type': mode, 'sum_factorization': True}, cffi_extra_compile_args=compile_args)
+    assert "Sum factorized" not in code[1]
+    assert "Sum factorized" in sf_code[1]
+
+    # Affine image of the reference cell
+    tdim = cell.topological_dimension()
+    vertices = np.array([[(i >> d) & 1 for d in range(tdim)] for i in range(num_vertices)], dtype=np.float64)
+    coords = np.zeros((num_vertices, 3), dtype=np.float64)
+    coords[:, :tdim] = vertices @ (np.eye(tdim) + 0.2 * np.ones((tdim, tdim))) + 0.5
+
+    num_dofs = (degree + 1)**tdim
+    w = np.zeros(1, dtype=cdtype_to_numpy(mode))
+    for form, sf_form, shape in zip(compiled_forms, sf_compiled_forms, [(num_dofs, num_dofs), (num_dofs, )]):
+        A = tabulate_cell_tensor(module, form.integrals(module.lib.cell)[0], mode, shape, w, coords)
+        A_sf = tabulate_cell_tensor(sf_module, sf_form.integrals(sf_module.lib.cell)[0], mode, shape, w, coords)
+        assert np.allclose(A_sf, A)
+        assert not np.allclose(A, 0.0)
+
+
+def test_sum_factorization_fallback(compile_args):
+    cell = ufl.quadrilateral
+    element = ufl.FiniteElement("Q", cell, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    q = ufl.TestFunction(ufl.FiniteElement("DQ", cell, 0))
+
+    # Requested per integral, the piecewise constant test function does
+    # not factorize and the facet integral is not supported
+    a = u * v * ufl.dx(metadata={"sum_factorization": True})
+    b = u * q * ufl.dx(metadata={"sum_factorization": True})
+    m = u * v * ufl.ds(metadata={"sum_factorization": True})
+    compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms(
+        [a, b, m], cffi_extra_compile_args=compile_args)
+    assert code[1].count("Sum factorized") == 1
+
+    coords = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [1.0, 1.0, 0.0]], dtype=np.float64)
+    w = np.zeros(1)
+    A = tabulate_cell_tensor(module, compiled_forms[1].integrals(module.lib.cell)[0], "double", (1, 9), w, coords)
+    assert np.isclose(A.sum(), 1.0)
+
+
+@pytest.mark.parametrize("mode", ["double", "double _Complex"])
+@pytest.mark.parametrize("integral_type", ["cell", "exterior_facet"])
+@pytest.mark.parametrize("parameters,marker", [({"preintegrate": True}, "Preintegrated blocks"),
+                                               ({"premultiply": True}, "PM_")])
+def test_piecewise_factor_blocks(mode, integral_type, parameters, marker, compile_args):
+    cell = ufl.triangle
+    element = ufl.FiniteElement("Lagrange", cell, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    kappa = ufl.Constant(cell)
+    measure = ufl.dx if integral_type == "cell" else ufl.ds
+    a = kappa * (ufl.inner(ufl.grad(u), ufl.grad(v)) + ufl.inner(u, v)) * measure
+    forms = [a]
+
+    compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms(
+        forms, parameters={'scalar_type': mode}, cffi_extra_compile_args=compile_args)
+    pi_compiled_forms, pi_module, pi_code = ffcx.codegeneration.jit.compile_forms(
+        forms, parameters={'scalar_type': mode, **parameters}, cffi_extra_compile_args=compile_args)
+    assert marker not in code[1]
+    assert marker in pi_code[1]
+
+    np_type = cdtype_to_numpy(mode)
+    coords = np.array([[0.1, 0.0, 0.0], [1.2, 0.3, 0.0], [0.2, 0.9, 0.0]], dtype=np.float64)
+    w = np.zeros(1, dtype=np_type)
+    c = np.array([1.5], dtype=np_type)
+    for facet in range(3 if integral_type == "exterior_facet" else 1):
+        entity = np.array([facet], dtype=np.intc)
+        A = []
+        for cf, m in [(compiled_forms[0], module), (pi_compiled_forms[0], pi_module)]:
+            A.append(np.zeros((6, 6), dtype=np_type))
+            kernel = getattr(cf.integrals(getattr(m.lib, integral_type))[0], f"tabulate_tensor_{np_type}")
+            kernel(m.ffi.cast(f'{mode} *', A[-1].ctypes.data), m.ffi.cast(f'{mode} *', w.ctypes.data),
+                   m.ffi.cast(f'{mode} *', c.ctypes.data), m.ffi.cast('double *', coords.ctypes.data),
+                   m.ffi.cast('int *', entity.ctypes.data), m.ffi.NULL)
+        assert np.allclose(A[1], A[0])
+        assert not np.allclose(A[0], 0.0)
+
+
+@pytest.mark.parametrize("parameters", [{}, {"premultiply": True}])
+@pytest.mark.parametrize("cell,num_vertices,num_perms,dim", [(ufl.triangle, 3, 2, 6), (ufl.quadrilateral, 4, 2, 9),
+                                                             (ufl.tetrahedron, 4, 6, 10), (ufl.hexahedron, 8, 8, 27)])
+def test_quadrature_permutation_maps(cell, num_vertices, num_perms, dim, parameters, compile_args):
+    element = ufl.FiniteElement("DG", cell, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    a = (ufl.inner(ufl.jump(ufl.grad(u)), ufl.jump(ufl.grad(v))) + ufl.jump(u) * ufl.jump(v)) * ufl.dS
+    forms = [a]
+
+    compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms(
+        forms, cffi_extra_compile_args=compile_args)
+    pm_compiled_forms, pm_module, pm_code = ffcx.codegeneration.jit.compile_forms(
+        forms, parameters={"quadrature_permutation_maps": True, **parameters}, cffi_extra_compile_args=compile_args)
+    assert "qperm_Q" not in code[1]
+    assert "qperm_Q" in pm_code[1]
+    # Tables looked up through the map are not premultiplied by the weights
+    assert "PM_" not in pm_code[1]
+
+    rng = np.random.default_rng(0)
+    coords = rng.random((2, num_vertices, 3))
+    if cell.topological_dimension() == 2:
+        coords[:, :, 2] = 0.0
+    w = np.zeros(1)
+    c = np.zeros(1)
+    facets = np.array([0, 1], dtype=np.intc)
+    for p0 in range(num_perms):
+        for p1 in range(num_perms):
+            perms = np.array([p0, p1], dtype=np.uint8)
+            A = []
+            for cf, m in [(compiled_forms[0], module), (pm_compiled_forms[0], pm_module)]:
+                A.append(np.zeros((2 * dim, 2 * dim)))
+                kernel = cf.integrals(m.lib.interior_facet)[0].tabulate_tensor_float64
+                kernel(m.ffi.cast('double *', A[-1].ctypes.data), m.ffi.cast('double *', w.ctypes.data),
+                       m.ffi.cast('double *', c.ctypes.data), m.ffi.cast('double *', coords.ctypes.data),
+                       m.ffi.cast('int *', facets.ctypes.data), m.ffi.cast('uint8_t *', perms.ctypes.data))
+            assert np.allclose(A[1], A[0])
+            assert not np.allclose(A[0], 0.0)
+
+
+def test_parallel_translation_units(compile_args):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    f = ufl.Coefficient(element)
+    forms = [f * ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + ufl.inner(u, v) * ufl.ds,
+             ufl.inner(f, v) * ufl.dx]
+
+    coords = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0]], dtype=np.float64)
+    w = np.arange(1, 7, dtype=np.float64)
+    c = np.array([], dtype=np.float64)
+    facet = np.array([0], dtype=np.intc)
+
+    results = []
+    for num_workers in (1, 3):
+        compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms(
+            forms, cffi_extra_compile_args=compile_args, num_workers=num_workers)
+        ffi = module.ffi
+
+        # Objects in different translation units refer to each other
+        assert compiled_forms[0].finite_elements[0].space_dimension == 6
+        A = []
+        for form, integral_type in [(0, module.lib.cell), (0, module.lib.exterior_facet), (1, module.lib.cell)]:
+            integral = compiled_forms[form].integrals(integral_type)[0]
+            b = np.zeros(36 if form == 0 else 6, dtype=np.float64)
+            integral.tabulate_tensor_float64(
+                ffi.cast('double *', b.ctypes.data), ffi.cast('double *', w.ctypes.data),
+                ffi.cast('double *', c.ctypes.data), ffi.cast('double *', coords.ctypes.data),
+                ffi.cast('int *', facet.ctypes.data), ffi.NULL)
+            A.append(b)
+        results.append(A)
+
+    for A0, A1 in zip(*results):
+        assert np.allclose(A0, A1)
+        assert np.linalg.norm(A0) > 0
+
+
+def test_abi_mode(tmp_path, compile_args):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    f = ufl.Coefficient(element)
+    forms = [f * ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + ufl.inner(u, v) * ufl.ds]
+
+    coords = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0]], dtype=np.float64)
+    w = np.arange(1, 7, dtype=np.float64)
+    facet = np.array([0], dtype=np.intc)
+
+    results = []
+    for cffi_mode, num_workers in [("api", 1), ("abi", 1), ("abi", 2)]:
+        compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms(
+            forms, cache_dir=tmp_path / f"{cffi_mode}{num_workers}", cffi_extra_compile_args=compile_args,
+            num_workers=num_workers, cffi_mode=cffi_mode)
+        ffi = module.ffi
+        A = []
+        for integral_type in (module.lib.cell, module.lib.exterior_facet):
+            integral = compiled_forms[0].integrals(integral_type)[0]
+            b = np.zeros(36, dtype=np.float64)
+            integral.tabulate_tensor_float64(
+                ffi.cast('double *', b.ctypes.data), ffi.cast('double *', w.ctypes.data), ffi.NULL,
+                ffi.cast('double *', coords.ctypes.data), ffi.cast('int *', facet.ctypes.data), ffi.NULL)
+            A.append(b)
+        results.append(A)
+
+        if cffi_mode == "abi":
+            # Plain shared library, loaded from the cache
+            assert module.__file__ == str(tmp_path / f"{cffi_mode}{num_workers}" / (module.__name__ + ".so"))
+            assert (tmp_path / f"{cffi_mode}{num_workers}" / (module.__name__ + ".o")).exists()
+            del sys.modules[module.__name__]
+            compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms(
+                forms, cache_dir=tmp_path / f"{cffi_mode}{num_workers}", cffi_extra_compile_args=compile_args,
+                num_workers=num_workers, cffi_mode=cffi_mode)
+            assert code == (None, None)
+            assert compiled_forms[0].finite_elements[0].space_dimension == 6
+
+    for A in results[1:]:
+        for A0, A1 in zip(results[0], A):
+            assert np.allclose(A0, A1)
+            assert np.linalg.norm(A0) > 0
+
+
+def test_unnamed_coefficient_identifiers(compile_args):
+    # Coefficients from the 10th on print with braces, as w_{10}
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    v = ufl.TestFunction(element)
+    f = ufl.Coefficient(element, count=10)
+    assert str(f) == "w_{10}"
+
+    compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms(
+        [f * v * ufl.dx], cffi_extra_compile_args=compile_args)
+    assert compiled_forms[0].num_coefficients == 1
+
+    # Function spaces are looked up by the UFL name, under a valid identifier
+    assert 'strcmp(function_name, "w_{10}")' in code[1]
+    assert "functionspace_w__10_" in code[1]
+
+
+def test_tiered_compilation(tmp_path, compile_args):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx]
+
+    def tabulate(compiled_forms, module):
+        A = np.zeros((3, 3))
+        coords = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+        ffi = module.ffi
+        integral = compiled_forms[0].integrals(module.lib.cell)[0]
+        integral.tabulate_tensor_float64(ffi.cast('double *', A.ctypes.data), ffi.NULL, ffi.NULL,
+                                         ffi.cast('double *', coords.ctypes.data), ffi.NULL, ffi.NULL)
+        return A
+
+    compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms(
+        forms, cache_dir=tmp_path, cffi_extra_compile_args=compile_args, tiered=True)
+    A0 = tabulate(compiled_forms, module)
+
+    optimized_forms, optimized_module = module.optimized_build.upgrade(wait=True)
+    assert optimized_module.__name__ != module.__name__
+    assert np.allclose(tabulate(optimized_forms, optimized_module), A0)
+
+    # Optimized module is found by later calls
+    compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms(
+        forms, cache_dir=tmp_path, cffi_extra_compile_args=compile_args, tiered=True)
+    assert module.__name__ == optimized_module.__name__
+    assert code == (None, None)
+    assert module.optimized_build.ready()
+
+
+def test_tiered_compilation_without_cache_dir(compile_args):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(u, v) * ufl.dx]
+
+    _, module, _ = ffcx.codegeneration.jit.compile_forms(forms, cffi_extra_compile_args=compile_args, tiered=True)
+    upgrade = module.optimized_build
+    upgrade(wait=True)
+
+    # Later calls share the cache directory, and the build process is reaped
+    _, module, _ = ffcx.codegeneration.jit.compile_forms(forms, cffi_extra_compile_args=compile_args, tiered=True)
+    later = module.optimized_build
+    assert later.kwargs["cache_dir"] == upgrade.kwargs["cache_dir"]
+    assert module.__name__ == upgrade()[1].__name__
+    assert later.ready()
+    assert upgrade.process not in ffcx.codegeneration.jit._tiered_builds
+
+
+def test_tiered_compilation_unpicklable_objects(tmp_path, compile_args):
+    class Function(ufl.Coefficient):
+        def __init__(self, element):
+            super().__init__(element)
+            self._cpp_object = threading.Lock()
+
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    v = ufl.TestFunction(element)
+    forms = [Function(element) * v * ufl.dx]
+
+    # The module without optimization is returned, and no optimized build is started
+    compiled_forms, module, _ = ffcx.codegeneration.jit.compile_forms(
+        forms, cache_dir=tmp_path, cffi_extra_compile_args=compile_args, tiered=True)
+    assert compiled_forms[0].num_coefficients == 1
+    optimized = module.optimized_build
+    assert optimized.process is None
+    assert optimized.error is not None
+    assert not optimized.ready()
+    assert optimized.upgrade() is None
+    with pytest.raises(RuntimeError):
+        optimized.upgrade(wait=True)
+
+
+def test_metrics(tmp_path, compile_args):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 2)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    f = ufl.Coefficient(element)
+    forms = [f * ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + u * v * ufl.ds]
+
+    metrics = {}
+    tracemalloc.start()
+    try:
+        ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path, cffi_extra_compile_args=compile_args,
+                                              metrics=metrics)
+    finally:
+        tracemalloc.stop()
+    json.dumps(metrics)
+
+    assert metrics["module"] == "compiled"
+    assert not metrics["code_cache_hit"]
+    for stage in ("analysis", "ir", "codegeneration", "formatting", "compile", "load"):
+        assert metrics["stages"][stage]["time"] > 0
+        assert metrics["stages"][stage]["peak_memory"] >= 0
+    assert metrics["num_integrals"] == 2
+    assert [kernel["integral_type"] for kernel in metrics["kernels"]] == ["cell", "exterior_facet"]
+    for kernel in metrics["kernels"]:
+        assert kernel["scalar_graph_nodes"] > 0 and kernel["unique_tables"] > 0
+    assert metrics["code_bytes"]["c"] > sum(kernel["code_bytes"] for kernel in metrics["kernels"])
+
+    metrics = {}
+    ffcx.codegeneration.jit.compile_forms(forms, cache_dir=tmp_path, cffi_extra_compile_args=compile_args,
+                                          metrics=metrics)
+    assert metrics == {"module": "loaded"}
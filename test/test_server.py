@@ -0,0 +1,103 @@
+# Copyright (C) 2022 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+
+import stat
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import ffcx.codegeneration.jit
+import ffcx.server
+import ufl
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    socket_path = tmp_path / "ffcx.sock"
+    process = subprocess.Popen([sys.executable, "-m", "ffcx.server", "--socket", str(socket_path),
+                                "--cache-dir", str(tmp_path / "server-cache")])
+    for i in range(600):
+        if socket_path.exists():
+            break
+        time.sleep(0.1)
+    monkeypatch.setenv(ffcx.server.socket_variable, str(socket_path))
+    yield socket_path
+    process.terminate()
+    process.wait()
+
+
+def test_server_socket(server):
+    # Only the owner may send requests, which are unpickled
+    assert stat.S_ISSOCK(server.stat().st_mode)
+    assert stat.S_IMODE(server.stat().st_mode) == stat.S_IRUSR | stat.S_IWUSR
+
+
+def test_server_refuses_other_files(tmp_path):
+    path = tmp_path / "ffcx.sock"
+    path.write_text("data")
+    result = subprocess.run([sys.executable, "-m", "ffcx.server", "--socket", str(path)], stderr=subprocess.PIPE)
+    assert result.returncode != 0
+    assert b"is not a socket" in result.stderr
+    assert path.read_text() == "data"
+
+
+def test_server_compile_forms(server, compile_args):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    forms = [ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx]
+
+    compiled_forms, module, code = ffcx.codegeneration.jit.compile_forms(forms, cffi_extra_compile_args=compile_args)
+    assert module.__file__.startswith(str(server.parent / "server-cache"))
+    assert code[1] is not None
+
+    A = np.zeros((3, 3))
+    coords = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+    ffi = module.ffi
+    integral = compiled_forms[0].integrals(module.lib.cell)[0]
+    integral.tabulate_tensor_float64(ffi.cast('double *', A.ctypes.data), ffi.NULL, ffi.NULL,
+                                     ffi.cast('double *', coords.ctypes.data), ffi.NULL, ffi.NULL)
+    assert np.allclose(A, [[1.0, -0.5, -0.5], [-0.5, 0.5, 0.0], [-0.5, 0.0, 0.5]])
+
+    # Second request is served from the cache of the server
+    _, module, code = ffcx.codegeneration.jit.compile_forms(forms, cffi_extra_compile_args=compile_args)
+    assert code == (None, None)
+
+    # Errors are raised in the client
+    with pytest.raises(ufl.algorithms.check_arities.ArityMismatch):
+        ffcx.codegeneration.jit.compile_forms([u * v * ufl.dx + v * ufl.dx])
+
+
+class Function(ufl.Coefficient):
+    """Coefficient holding an object which cannot be pickled, as a handle of a C++ object."""
+
+    def __init__(self, element):
+        super().__init__(element)
+        self._cpp_object = threading.Lock()
+
+
+def test_server_unpicklable_objects(server, compile_args):
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    v = ufl.TestFunction(element)
+    forms = [Function(element) * v * ufl.dx]
+
+    # Compiled locally
+    metrics = {}
+    compiled_forms, module, _ = ffcx.codegeneration.jit.compile_forms(
+        forms, cffi_extra_compile_args=compile_args, metrics=metrics)
+    assert metrics["module"] == "compiled"
+    assert compiled_forms[0].num_coefficients == 1
+
+
+def test_server_unavailable(tmp_path, monkeypatch, compile_args):
+    monkeypatch.setenv(ffcx.server.socket_variable, str(tmp_path / "missing.sock"))
+    element = ufl.FiniteElement("Lagrange", ufl.triangle, 1)
+    compiled_elements, module, _ = ffcx.codegeneration.jit.compile_elements(
+        [element], cffi_extra_compile_args=compile_args)
+    assert compiled_elements[0][0].space_dimension == 3
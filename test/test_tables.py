@@ -0,0 +1,134 @@
+# Copyright (C) 2022 FEniCS Project
+#
+# This file is part of FFCx. (https://www.fenicsproject.org)
+#
+# SPDX-License-Identifier:    LGPL-3.0-or-later
+
+import numpy as np
+import pytest
+
+import ffcx.compiler
+import ffcx.parameters
+import ufl
+from ffcx.ir.elementtables import (TableCache, UniqueTableIndex,
+                                   equal_tables, permute_quadrature,
+                                   permute_quadrature_quadrilateral,
+                                   permute_quadrature_triangle,
+                                   table_cache_clear, table_cache_info)
+
+
+def compile_vector_laplace(degree):
+    element = ufl.VectorElement("Lagrange", ufl.triangle, degree)
+    u, v = ufl.TrialFunction(element), ufl.TestFunction(element)
+    a = ufl.inner(ufl.grad(u), ufl.grad(v)) * ufl.dx + ufl.inner(ufl.jump(u), ufl.jump(v)) * ufl.dS
+    parameters = ffcx.parameters.get_parameters()
+    code_h, code_c = ffcx.compiler.compile_ufl_objects([a], prefix="tables", parameters=parameters)
+
+    # Return the tabulate_tensor kernels
+    return [k.split("\n}\n")[0] for k in code_c.split("void tabulate_tensor")[1:]]
+
+
+def test_table_cache():
+    table_cache_clear()
+    kernels = compile_vector_laplace(2)
+    info = table_cache_info()
+    assert info.misses > 0
+    assert info.nbytes > 0
+
+    # Identical tables of the components and restrictions are tabulated
+    # once
+    assert info.hits > 0
+
+    # All tables of the same form compiled again are cached
+    assert compile_vector_laplace(2) == kernels
+    info2 = table_cache_info()
+    assert info2.misses == info.misses
+    assert info2.hits > info.hits
+
+    table_cache_clear()
+    assert table_cache_info().entries == 0
+
+
+def test_table_cache_eviction():
+    cache = TableCache(maxbytes=3 * 8 * 10)
+    for i in range(5):
+        cache.put(i, {'array': np.full(10, float(i)), 'offset': 0, 'stride': 1})
+    info = cache.info()
+    assert info.entries == 3
+    assert info.nbytes <= info.maxbytes
+
+    # Least recently used tables are evicted first
+    assert cache.get(0) is None
+    t = cache.get(4)
+    assert np.all(t['array'] == 4.0)
+
+    # Returned tables are copies
+    t['array'][:] = 0.0
+    assert np.all(cache.get(4)['array'] == 4.0)
+    assert cache.info().hits == 2
+    assert cache.info().misses == 1
+
+
+@pytest.mark.parametrize("facettype,rotate,reflect,num_rotations", [
+    ("interval", None, lambda p: [1 - p[0]], 1),
+    ("triangle", lambda p: [p[1], 1 - p[0] - p[1]], lambda p: [p[1], p[0]], 3),
+    ("quadrilateral", lambda p: [p[1], 1 - p[0]], lambda p: [p[1], p[0]], 4)])
+def test_permute_quadrature(facettype, rotate, reflect, num_rotations):
+    fdim = 1 if facettype == "interval" else 2
+    points = np.random.default_rng(2).random((7, fdim))
+    permuted = permute_quadrature(points, facettype)
+    assert permuted.shape == (2 * num_rotations, 7, fdim)
+
+    # All permutations, with reflections running fastest, map each point
+    # as rotating and then reflecting one point at a time
+    for rot in range(num_rotations):
+        for ref in range(2):
+            expected = []
+            for p in points:
+                for i in range(rot):
+                    p = rotate(p)
+                for i in range(ref):
+                    p = reflect(p)
+                expected.append(p)
+            assert np.allclose(permuted[2 * rot + ref], expected)
+
+    if facettype == "triangle":
+        assert np.allclose(permute_quadrature_triangle(points, 1, 2), permuted[5])
+    elif facettype == "quadrilateral":
+        assert np.allclose(permute_quadrature_quadrilateral(points, 1, 3), permuted[7])
+
+
+def test_unique_table_index():
+    t = np.linspace(0.0, 1.0, 12).reshape(1, 1, 3, 4)
+    index = UniqueTableIndex()
+    assert index.find(t) is None
+    index.add("FE0", t)
+    index.add("FE1", t.copy())
+
+    # Tables equal within the tolerances are found, the first added
+    # table is returned
+    assert index.find(t * (1.0 + 1e-8)) == "FE0"
+    assert index.find(t + 1e-10) == "FE0"
+    assert index["FE0"] is t
+
+    # Different values or shapes are not matched
+    assert index.find(t * 1.01) is None
+    assert index.find(t.reshape(1, 1, 4, 3)) is None
+
+
+def test_unique_table_index_matches_linear_search():
+    rng = np.random.default_rng(1)
+    tables = [rng.random((1, 1, 5, 3)) for i in range(20)]
+    tables += [t * (1.0 + rng.uniform(-1e-7, 1e-7)) for t in tables]
+    tables += [t + rng.uniform(-1e-3, 1e-3) for t in tables[:10]]
+    tables += [np.zeros((1, 1, 5, 3)), np.full((1, 1, 5, 3), 5e-10)]
+    rng.shuffle(tables)
+
+    index = UniqueTableIndex()
+    unique = {}
+    for i, t in enumerate(tables):
+        linear = next((name for name, u in unique.items() if equal_tables(t, u)), None)
+        assert index.find(t) == linear
+        if linear is None:
+            unique[f"FE{i}"] = t
+            index.add(f"FE{i}", t)